@@ -29,7 +29,7 @@ readline.parse_and_bind("?: complete")
 class GetData:
     @staticmethod
     def _get_name(endpoint):
-        return endpoint.machine.name.strip()
+        return endpoint.name
 
     @staticmethod
     def _get_mac(endpoint):
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark RabbitMQ message handling on the pika I/O thread before and after
+moving decoding and filtering into the decoder stage, and the decoder stage
+itself with the stdlib and the optional orjson backends.
+
+Run from lib/poseidon_core with POSEIDON_CONFIG set:
+    python benchmarks/bench_decode.py
+"""
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from functools import partial
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from faucetconfgetsetter import get_sdn_connect  # noqa: E402
+from poseidon_core.controllers import sdnevents  # noqa: E402
+from poseidon_core.controllers.sdnevents import SDNEvents  # noqa: E402
+from poseidon_core.helpers.prometheus import Prometheus  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def faucet_events(messages):
+    """FAUCET event mix, where one event in four is an L2_LEARN."""
+    bodies = []
+    for i in range(messages):
+        event = {"version": 1, "time": 1600000000.0 + i, "dp_id": 1}
+        event["dp_name"] = "switch1"
+        event["event_id"] = i
+        mac = "0e:00:00:00:%02x:%02x" % ((i >> 8) & 0xFF, i & 0xFF)
+        kind = i % 4
+        if kind == 0:
+            event["L2_LEARN"] = {
+                "port_no": 1 + i % 48,
+                "previous_port_no": None,
+                "vid": 100,
+                "eth_src": mac,
+                "eth_dst": "ff:ff:ff:ff:ff:ff",
+                "eth_type": 2048,
+                "l3_src_ip": "10.0.%u.%u" % ((i >> 8) & 0xFF, i & 0xFF),
+                "l3_dst_ip": "10.0.255.255",
+            }
+        elif kind == 1:
+            event["L2_EXPIRE"] = {"port_no": 1 + i % 48, "vid": 100, "eth_src": mac}
+        elif kind == 2:
+            event["PORT_CHANGE"] = {
+                "port_no": 1 + i % 48,
+                "reason": "MODIFY",
+                "state": 0,
+                "status": True,
+            }
+        else:
+            event["LACP_CHANGE"] = {"port_no": 1 + i % 48, "lacp_state": 1}
+        bodies.append(json.dumps(event).encode())
+    return bodies
+
+
+def baseline_callback(sdne, ch, method, _properties, body, q=None, rabbit=None):
+    """rabbit_callback as it was, decoding and filtering on the I/O thread."""
+    body = json.loads(body)
+    sdne.logger.debug(
+        "got a message: {0}:{1} (qsize {2})".format(method.routing_key, body, q.qsize())
+    )
+    sdne.update_prom_var_time(
+        "last_rabbitmq_routing_key_time", "routing_key", method.routing_key
+    )
+    if not sdne.ignore_rabbit(method.routing_key, body):
+        q.put((method.routing_key, body, None))
+        return
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def bench_callback(sdne, bodies, callback):
+    channel = SimpleNamespace(basic_ack=lambda delivery_tag: None)
+    method = SimpleNamespace(
+        routing_key=sdne.config["FA_RABBIT_ROUTING_KEY"], delivery_tag=1
+    )
+    rabbit = SimpleNamespace(ack=lambda delivery_tag: None)
+    q = queue.Queue()
+    start_time = time.perf_counter()
+    for body in bodies:
+        callback(channel, method, None, body, q=q, rabbit=rabbit)
+    return len(bodies) / (time.perf_counter() - start_time), q
+
+
+def bench_decoder(sdne, raw_queue, loads):
+    sdnevents.json_loads = loads
+    items = list(raw_queue.queue)
+    start_time = time.perf_counter()
+    for item in items:
+        sdne.decode_message(item)
+    rate = len(items) / (time.perf_counter() - start_time)
+    while not sdne.m_queue.empty():
+        sdne.m_queue.get_nowait()
+    return rate
+
+
+def main():
+    logging.disable(logging.INFO)
+    logger = logging.getLogger("bench")
+    prom = Prometheus()
+    prom.initialize_metrics()
+    sdne = SDNEvents(logger, prom, get_sdn_connect(logger))
+    sdne.m_queue.maxsize = 0
+    bodies = faucet_events(20000)
+
+    print("%32s %12s" % ("stage", "msgs/sec"))
+    rate, _ = bench_callback(sdne, bodies, partial(baseline_callback, sdne))
+    print("%32s %12.0f" % ("I/O thread, before", rate))
+    rate, raw_queue = bench_callback(sdne, bodies, sdne.rabbit_callback)
+    print("%32s %12.0f" % ("I/O thread, after", rate))
+    print("%32s %12.0f" % ("decoder, json", bench_decoder(sdne, raw_queue, json.loads)))
+    if orjson is not None:
+        rate = bench_decoder(sdne, raw_queue, orjson.loads)
+        print("%32s %12.0f" % ("decoder, orjson", rate))
+
+
+if __name__ == "__main__":
+    main()
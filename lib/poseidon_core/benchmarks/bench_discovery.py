@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the cost of one FAUCET L2_LEARN event as the mac_table grows,
+comparing full-sweep and incremental endpoint discovery.
+
+Run from lib/poseidon_core with POSEIDON_CONFIG set:
+    python benchmarks/bench_discovery.py
+"""
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from faucetconfgetsetter import get_sdn_connect  # noqa: E402
+
+
+def l2_learn(i):
+    mac = ":".join(["0e"] + ["%02x" % ((i >> s) & 0xFF) for s in (32, 24, 16, 8, 0)])
+    return {
+        "dp_name": "switch1",
+        "L2_LEARN": {
+            "l3_src_ip": "None",
+            "eth_src": mac,
+            "port_no": 1 + i % 48,
+            "vid": 100,
+        },
+    }
+
+
+def bench(table_size, incremental, events=20):
+    logger = logging.getLogger("bench")
+    logger.setLevel(logging.WARNING)
+    sdnc = get_sdn_connect(logger)
+    sdnc.config["incremental_discovery"] = incremental
+    sdnc.check_endpoints([l2_learn(i) for i in range(table_size)])
+    start_time = time.perf_counter()
+    for i in range(events):
+        sdnc.check_endpoints([l2_learn(i)])
+    return (time.perf_counter() - start_time) / events
+
+
+def main():
+    logging.disable(logging.INFO)
+    print("%10s %15s %17s" % ("endpoints", "full (ms)", "incremental (ms)"))
+    for table_size in (1000, 5000, 20000):
+        full = bench(table_size, False)
+        incremental = bench(table_size, True)
+        print("%10u %15.3f %17.3f" % (table_size, full * 1e3, incremental * 1e3))
+
+
+if __name__ == "__main__":
+    main()
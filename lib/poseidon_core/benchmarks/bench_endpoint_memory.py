@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the memory and construction time of endpoints from
+endpoint_factory(), against endpoints with their own pair of
+transitions.Machine instances and a __dict__, as endpoint_factory()
+used to build them.
+
+    python benchmarks/bench_endpoint_memory.py [COUNT]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+from poseidon_core.helpers.endpoint import Endpoint
+from poseidon_core.helpers.endpoint import endpoint_factory
+from transitions import Machine
+
+COUNT = 2000
+
+
+class DictEndpoint:
+    def __init__(self, name):
+        self.name = name
+        self.ignore = False
+        self.copro_ignore = False
+        self.endpoint_data = None
+        self.p_next_state = None
+        self.p_prev_state = None
+        self.p_next_copro_state = None
+        self.p_prev_copro_state = None
+        self.acl_data = []
+        self.metadata = {}
+        self.state_time = 0
+        self.copro_state_time = 0
+        self.observed_time = 0
+        self.dirty = True
+        self.timers = None
+
+    def _update_state_time(self, *args, **kwargs):
+        self.state_time = time.time()
+
+    def _update_copro_state_time(self, *args, **kwargs):
+        self.copro_state_time = time.time()
+
+
+def machine_endpoint_factory(name):
+    endpoint = DictEndpoint(name)
+    endpoint.machine = Machine(
+        model=endpoint,
+        model_attribute="state",
+        states=Endpoint.states,
+        transitions=Endpoint.transitions,
+        initial="unknown",
+        send_event=True,
+    )
+    endpoint.copro_machine = Machine(
+        model=endpoint,
+        model_attribute="copro_state",
+        states=Endpoint.copro_states,
+        transitions=Endpoint.copro_transitions,
+        initial="copro_unknown",
+        send_event=True,
+    )
+    return endpoint
+
+
+def measure(factory, count):
+    gc.collect()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    endpoints = [factory("%064x" % i) for i in range(count)]
+    construct_time = time.perf_counter() - start_time
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start_time = time.perf_counter()
+    for endpoint in endpoints:
+        endpoint.queue()
+        endpoint.operate()
+        endpoint.known()
+    transition_time = time.perf_counter() - start_time
+    return (size, construct_time, transition_time)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    print(
+        "%-22s %14s %16s %16s"
+        % ("%u endpoints" % count, "memory (MB)", "construct (s)", "transitions (s)")
+    )
+    for label, factory in (
+        ("machine per endpoint", machine_endpoint_factory),
+        ("shared machine", endpoint_factory),
+    ):
+        size, construct_time, transition_time = measure(factory, count)
+        print(
+            "%-22s %14.1f %16.3f %16.3f"
+            % (label, size / 2**20, construct_time, transition_time)
+        )
+
+
+if __name__ == "__main__":
+    main()
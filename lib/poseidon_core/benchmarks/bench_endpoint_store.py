@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark endpoint lookups by MAC, IP and state, scanning a dict of
+endpoints against the EndpointStore indexes.
+
+    python benchmarks/bench_endpoint_store.py
+"""
+import time
+
+from poseidon_core.helpers.endpoint import Endpoint
+from poseidon_core.helpers.endpoint_store import EndpointStore
+
+LOOKUPS = 100
+
+
+def make_endpoints(count):
+    endpoints = {}
+    for i in range(count):
+        # no state machine is needed for lookups, and building 100k is slow.
+        endpoint = Endpoint("%064x" % i)
+        endpoint.state = "operating" if i % 1000 == 0 else "known"
+        endpoint.endpoint_data = {
+            "mac": "0e:00:00:%02x:%02x:%02x"
+            % ((i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF),
+            "ipv4": "10.%u.%u.%u" % ((i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF),
+            "ipv6": "",
+        }
+        endpoints[endpoint.name] = endpoint
+    return endpoints
+
+
+def scan_lookups(endpoints, macs, ips):
+    for mac, ip in zip(macs, ips):
+        [e for e in endpoints.values() if mac == e.endpoint_data["mac"]]
+        [
+            e
+            for e in endpoints.values()
+            if ip == e.endpoint_data.get("ipv4", None)
+            or ip == e.endpoint_data.get("ipv6", None)
+        ]
+        [e for e in endpoints.values() if not e.ignore and e.state == "operating"]
+
+
+def store_lookups(store, macs, ips):
+    for mac, ip in zip(macs, ips):
+        store.by_mac(mac)
+        store.by_ip(ip)
+        store.not_ignored("operating")
+
+
+def timed(func, *args):
+    start_time = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start_time) / LOOKUPS
+
+
+def main():
+    print(
+        "%10s %14s %14s %12s" % ("endpoints", "scan (us)", "indexed (us)", "build (ms)")
+    )
+    for count in (10000, 100000):
+        endpoints = make_endpoints(count)
+        start_time = time.perf_counter()
+        store = EndpointStore(endpoints)
+        build_time = time.perf_counter() - start_time
+        sample = list(endpoints.values())[:: count // LOOKUPS]
+        macs = [endpoint.endpoint_data["mac"] for endpoint in sample]
+        ips = [endpoint.endpoint_data["ipv4"] for endpoint in sample]
+        scan_time = timed(scan_lookups, endpoints, macs, ips)
+        store_time = timed(store_lookups, store, macs, ips)
+        print(
+            "%10u %14.1f %14.1f %12.1f"
+            % (count, scan_time * 1e6, store_time * 1e6, build_time * 1e3)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark MAC vendor lookups per second, scanning nmap-mac-prefixes.txt
+for each MAC as get_ether_vendor used to (so the lookups miss its
+128 entry cache), against the in-memory OUI index.
+
+    python benchmarks/bench_oui.py
+"""
+import os
+import random
+import time
+
+from poseidon_core.constants import NO_DATA
+from poseidon_core.helpers.metadata import get_ether_vendor
+
+LOOKUP_PATH = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "poseidon_core",
+    "metadata",
+    "nmap-mac-prefixes.txt",
+)
+
+
+def scan_ether_vendor(mac, lookup_path):
+    mac = "".join(mac.split(":"))[:6].upper()
+    try:
+        with open(lookup_path, "r") as f:
+            for line in f:
+                if line.startswith(mac):
+                    return line.split()[1].strip()
+    except Exception:  # pragma: no cover
+        return NO_DATA
+
+
+def lookups_per_sec(func, macs):
+    start_time = time.perf_counter()
+    for mac in macs:
+        func(mac, LOOKUP_PATH)
+    return len(macs) / (time.perf_counter() - start_time)
+
+
+def main():
+    random.seed(0)
+    with open(LOOKUP_PATH, "r") as f:
+        prefixes = [line.split()[0] for line in f]
+    macs = [
+        ":".join(
+            [prefix[i : i + 2] for i in range(0, 6, 2)]
+            + ["%02x" % random.randrange(256) for _ in range(3)]
+        )
+        for prefix in random.sample(prefixes, 1000)
+    ]
+    for mac in macs:
+        assert scan_ether_vendor(mac, LOOKUP_PATH) == get_ether_vendor(mac, LOOKUP_PATH)
+    print("%-12s %14s" % ("lookup", "lookups/sec"))
+    print(
+        "%-12s %14.0f" % ("file scan", lookups_per_sec(scan_ether_vendor, macs[:100]))
+    )
+    print("%-12s %14.0f" % ("OUI index", lookups_per_sec(get_ether_vendor, macs)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark consumer throughput with per-message acks against prefetch with
+batched cumulative acks, using a local stand-in for the broker that charges
+a round trip for every ack frame.
+
+    python benchmarks/bench_rabbit.py
+"""
+import collections
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+from poseidon_core.helpers.rabbit import Rabbit
+
+ROUND_TRIP = 0.0002
+
+
+class StandInConnection:
+    """single I/O thread that delivers messages and runs callbacks and timers."""
+
+    def __init__(self, messages, prefetch_count):
+        self.messages = messages
+        self.prefetch_count = prefetch_count
+        self.delivered = 0
+        self.acked = 0
+        self.callbacks = collections.deque()
+        self.timers = []
+        self.on_message = None
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.append(callback)
+
+    def call_later(self, delay, callback):
+        self.timers.append((time.monotonic() + delay, callback))
+
+    def run(self, channel):
+        while self.acked < self.messages:
+            while self.callbacks:
+                self.callbacks.popleft()()
+            now = time.monotonic()
+            for timer in [timer for timer in self.timers if timer[0] <= now]:
+                self.timers.remove(timer)
+                timer[1]()
+            window = self.delivered - self.acked
+            if self.delivered < self.messages and (
+                not self.prefetch_count or window < self.prefetch_count
+            ):
+                self.delivered += 1
+                method = SimpleNamespace(delivery_tag=self.delivered)
+                self.on_message(channel, method, None, b"{}")
+            else:
+                time.sleep(0)
+
+
+class StandInChannel:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        time.sleep(ROUND_TRIP)
+        self.connection.acked = delivery_tag
+
+
+def bench(messages, prefetch_count, ack_batch_size, ack_interval, batched=True):
+    rabbit = Rabbit(
+        prefetch_count=prefetch_count,
+        ack_batch_size=ack_batch_size,
+        ack_interval=ack_interval,
+    )
+    connection = StandInConnection(messages, prefetch_count)
+    rabbit.channel = StandInChannel(connection)
+    work = queue.Queue()
+    connection.on_message = lambda ch, method, props, body: work.put(
+        method.delivery_tag
+    )
+
+    def consumer():
+        for _ in range(messages):
+            if batched:
+                rabbit.ack(work.get())
+            else:
+                Rabbit.threadsafe_ack(rabbit.channel, work.get())
+
+    consumer_thread = threading.Thread(target=consumer)
+    start_time = time.perf_counter()
+    consumer_thread.start()
+    connection.run(rabbit.channel)
+    consumer_thread.join()
+    return messages / (time.perf_counter() - start_time)
+
+
+def main():
+    messages = 5000
+    print("%30s %12s" % ("mode", "msgs/sec"))
+    for name, prefetch_count, ack_batch_size, ack_interval, batched in (
+        ("unlimited, basic_ack each", 0, 1, 0, False),
+        ("prefetch 1000, ack per 100", 1000, 100, 0.1, True),
+    ):
+        rate = bench(messages, prefetch_count, ack_batch_size, ack_interval, batched)
+        print("%30s %12.0f" % (name, rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark finding timed out endpoints by scanning every endpoint against
+popping due deadlines from EndpointTimers, when a small fraction of the
+endpoints have timed out.
+
+    python benchmarks/bench_timers.py
+"""
+import time
+
+from poseidon_core.helpers.endpoint import Endpoint
+from poseidon_core.helpers.timers import EndpointTimers
+
+TIMEOUT = 1800
+
+
+def make_endpoints(count, stale):
+    now = time.time()
+    endpoints = {}
+    for i in range(count):
+        # no state machine is needed to check timeouts, and building 100k is slow.
+        endpoint = Endpoint("%064x" % i)
+        endpoint.state = "known"
+        endpoint.observed_time = now - (2 * TIMEOUT if i < stale else i % TIMEOUT)
+        endpoints[endpoint.name] = endpoint
+    return endpoints
+
+
+def scan(endpoints):
+    return [
+        endpoint
+        for endpoint in endpoints.values()
+        if not endpoint.ignore
+        and (
+            endpoint.observed_timeout(TIMEOUT)
+            or (endpoint.operation_active() and endpoint.state_timeout(TIMEOUT))
+        )
+    ]
+
+
+def pop_due(endpoints, timers):
+    timed_out = []
+    for name in timers.due_reinvestigation(time.time()):
+        endpoint = endpoints[name]
+        if endpoint.observed_timeout(TIMEOUT):
+            timed_out.append(endpoint)
+        timers.schedule(endpoint)
+    return timed_out
+
+
+def main():
+    print(
+        "%10s %10s %12s %12s" % ("endpoints", "timed out", "scan (ms)", "timers (ms)")
+    )
+    for count in (1000, 10000, 100000):
+        stale = count // 100
+        endpoints = make_endpoints(count, stale)
+        timers = EndpointTimers(TIMEOUT, TIMEOUT)
+        for endpoint in endpoints.values():
+            timers.track(endpoint)
+        start_time = time.perf_counter()
+        assert len(scan(endpoints)) == stale
+        scan_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        assert len(pop_due(endpoints, timers)) == stale
+        timers_time = time.perf_counter() - start_time
+        print(
+            "%10u %10u %12.3f %12.3f"
+            % (count, stale, scan_time * 1e3, timers_time * 1e3)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Replay a RabbitMQ capture log (written when capture_file is set in the
+Poseidon config) through SDNEvents and SDNConnect, with the local FAUCET
+config stub in place of faucetconfrpc and no RabbitMQ. Reports events per
+second, time per stage and a checksum of the final endpoint state, so runs
+against the same capture can be compared. Timer jobs are not run, so the
+checksum only depends on the capture. Reverse DNS is not looked up, so
+replays do not depend on network access or DNS answers either.
+
+Run from lib/poseidon_core with POSEIDON_CONFIG set:
+    python benchmarks/replay.py capture.log [--speed N] [--expect CHECKSUM]
+
+--speed 1 replays in real time, N replays N times faster and 0 (the
+default) replays as fast as possible.
+"""
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import schedule
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from faucetconfgetsetter import FaucetLocalConfGetSetter  # noqa: E402
+from faucetconfgetsetter import get_test_config  # noqa: E402
+from poseidon_core.constants import NO_DATA  # noqa: E402
+from poseidon_core.controllers.sdnconnect import SDNConnect  # noqa: E402
+from poseidon_core.controllers.sdnevents import SDNEvents  # noqa: E402
+from poseidon_core.helpers.capture import read_capture  # noqa: E402
+from poseidon_core.helpers.metadata import DNSResolver  # noqa: E402
+from poseidon_core.helpers.prometheus import Prometheus  # noqa: E402
+from poseidon_core.operations.monitor import Monitor  # noqa: E402
+from prometheus_client import REGISTRY  # noqa: E402
+
+
+class OfflineDNSResolver(DNSResolver):
+    """answers every reverse DNS lookup from the cache, with NO_DATA."""
+
+    def cached(self, ip):
+        return NO_DATA
+
+
+class Replay:
+    def __init__(self, logger, prom):
+        config = get_test_config()
+        sdnc = SDNConnect(
+            config, logger, prom, faucetconfgetsetter_cl=FaucetLocalConfGetSetter
+        )
+        sdnc.dns_resolver = OfflineDNSResolver()
+        self.sdne = SDNEvents(logger, prom, sdnc)
+        scheduler = schedule.Scheduler()
+        self.monitor = Monitor(
+            logger, config, scheduler, self.sdne.job_queue, sdnc, prom
+        )
+        scheduler.clear()
+        self.channel = SimpleNamespace(basic_ack=lambda delivery_tag: None)
+        self.rabbit = SimpleNamespace(ack=lambda delivery_tag: None)
+        self.stage_secs = collections.defaultdict(float)
+        self.messages = 0
+
+    def timed(self, stage, func, *args, **kwargs):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.stage_secs[stage] += time.perf_counter() - start_time
+        return result
+
+    def pending(self):
+        return self.sdne.action_queue.qsize() + self.sdne.m_queue.qsize()
+
+    def receive(self, routing_key, body):
+        self.messages += 1
+        method = SimpleNamespace(routing_key=routing_key, delivery_tag=self.messages)
+        self.timed(
+            "receive",
+            self.sdne.rabbit_callback,
+            self.channel,
+            method,
+            None,
+            body,
+            q=self.sdne.raw_queue,
+            rabbit=self.rabbit,
+        )
+        while not self.sdne.raw_queue.empty():
+            self.timed(
+                "decode", self.sdne.decode_message, self.sdne.raw_queue.get_nowait()
+            )
+
+    def process(self):
+        self.timed("process", self.sdne.process_once, self.monitor)
+
+    def run(self, records, speed):
+        start_time = time.monotonic()
+        first_timestamp = None
+        for timestamp, routing_key, body in records:
+            if speed:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                due = start_time + (timestamp - first_timestamp) / speed
+                if due > time.monotonic():
+                    while self.pending():
+                        self.process()
+                    time.sleep(max(due - time.monotonic(), 0))
+            self.receive(routing_key, body)
+            if self.pending() >= self.sdne.max_batch_size:
+                self.process()
+        while self.pending():
+            self.process()
+        self.process()
+        return time.monotonic() - start_time
+
+    def checksum(self):
+        h = hashlib.sha256()
+        endpoints = self.sdne.sdnc.endpoints
+        for name in sorted(endpoints):
+            endpoint = endpoints[name]
+            h.update(
+                json.dumps(
+                    [
+                        name,
+                        endpoint.state,
+                        endpoint.ignore,
+                        endpoint.endpoint_data,
+                        endpoint.metadata,
+                    ],
+                    sort_keys=True,
+                    default=str,
+                ).encode("utf-8")
+            )
+        return h.hexdigest()
+
+
+def method_runtimes():
+    runtimes = {}
+    for metric in REGISTRY.collect():
+        if metric.name == "poseidon_method_runtime_secs":
+            for sample in metric.samples:
+                if sample.name.endswith("_sum"):
+                    runtimes[sample.labels["method"]] = sample.value
+    return runtimes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("capture", help="capture log to replay")
+    parser.add_argument(
+        "--speed", type=float, default=0, help="replay speed, 0 for maximum"
+    )
+    parser.add_argument("--expect", help="exit non-zero unless the checksum matches")
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)
+    logger = logging.getLogger("replay")
+    prom = Prometheus()
+    prom.initialize_metrics()
+    replay = Replay(logger, prom)
+    elapsed = replay.run(read_capture(args.capture), args.speed)
+    checksum = replay.checksum()
+
+    print(
+        "%u messages in %.3fs, %.0f msgs/sec"
+        % (replay.messages, elapsed, replay.messages / max(elapsed, 1e-9))
+    )
+    print("%40s %12s" % ("stage", "secs"))
+    for stage, secs in replay.stage_secs.items():
+        print("%40s %12.3f" % (stage, secs))
+    for method, secs in sorted(method_runtimes().items(), key=lambda x: -x[1]):
+        if " " not in method:
+            print("%40s %12.3f" % (method, secs))
+    states = collections.Counter(
+        endpoint.state for endpoint in replay.sdne.sdnc.endpoints.values()
+    )
+    print("endpoints: %u %s" % (len(replay.sdne.sdnc.endpoints), dict(states)))
+    print("checksum: %s" % checksum)
+    if args.expect and args.expect != checksum:
+        sys.exit("checksum mismatch, expected %s" % args.expect)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,11 @@ Created on 17 November 2017
 """
 import ipaddress
 import logging
-from collections import defaultdict
+import threading
 
 from poseidon_core.controllers.faucet.config import FaucetRemoteConfGetSetter
 from poseidon_core.helpers.config import parse_rules
+from poseidon_core.helpers.trunks import TrunkPorts
 from poseidon_core.operations.primitives.acl import ACL
 from poseidon_core.operations.primitives.coprocess import Coprocess
 from poseidon_core.operations.volos.acls import Acl
@@ -34,9 +35,15 @@ class FaucetProxy:
             "max_concurrent_reinvestigations", config["max_concurrent_reinvestigations"]
         )
         self.trunk_ports = kwargs.get("trunk_ports", config["trunk_ports"])
+        if not isinstance(self.trunk_ports, TrunkPorts):
+            self.trunk_ports = TrunkPorts(self.trunk_ports)
         self.ignore_vlans = kwargs.get("ignore_vlans", config["ignore_vlans"])
         self.ignore_ports = kwargs.get("ignore_ports", config["ignore_ports"])
-        self.mirror_counts = kwargs.get("mirror_counts", defaultdict(int))
+        self.mirror_counts = kwargs.get("mirror_counts", {})
+        # mirroring runs on action worker threads, and the count must change
+        # together with the mirror request for the same switch port.
+        self.mirror_locks = {}
+        self.shared_mirror_lock = kwargs.get("mirror_lock", None)
         self.frpc = None
         faucetconfgetsetter_cl = kwargs.get(
             "faucetconfgetsetter_cl", FaucetRemoteConfGetSetter
@@ -45,6 +52,10 @@ class FaucetProxy:
         self._set_default_switch_conf()
         self.logger = logging.getLogger("faucet")
         self.mac_table = {}
+        # a dict rather than a set, so changes are reported in the order they happened.
+        self.changed_macs = {}
+        # MACs a full get_endpoints() would return, after the public address filter.
+        self.visible_macs = set()
 
         # parse volos config
         self.volos = Volos(config)
@@ -150,22 +161,21 @@ class FaucetProxy:
         """
         ret_list = list()
         for d in data:
-            md = d[0]
-            d.reverse()
-            for i, _ in enumerate(d):
-                ipv4_set = False
-                ipv6_set = False
-                if "ip-address" in d[i]:
-                    if ":" in d[i]["ip-address"]:
-                        md["ipv6"] = d[i]["ip-address"]
+            md = dict(d[0])
+            ipv4_set = False
+            ipv6_set = False
+            for entry in reversed(d):
+                if "ip-address" in entry:
+                    if ":" in entry["ip-address"]:
+                        md["ipv6"] = entry["ip-address"]
                         ipv6_set = True
                     else:
-                        md["ipv4"] = d[i]["ip-address"]
+                        md["ipv4"] = entry["ip-address"]
                         ipv4_set = True
-                if "ipv4" in md:
-                    ipv4_set = True
-                if "ipv6" in md:
-                    ipv6_set = True
+            if "ipv4" in md:
+                ipv4_set = True
+            if "ipv6" in md:
+                ipv6_set = True
             if not ipv4_set:
                 md["ipv4"] = 0
             if not ipv6_set:
@@ -179,6 +189,16 @@ class FaucetProxy:
             ret_list.append(md)
         return ret_list
 
+    @staticmethod
+    def ignore_raw_event(body):
+        """
+        cheap check of an undecoded event body, so that events ignore_event
+        would ignore anyway can be dropped without a full parse.
+        """
+        if isinstance(body, str):
+            return '"L2_LEARN"' not in body
+        return b'"L2_LEARN"' not in body
+
     def ignore_event(self, message):
         for message_type in ("L2_LEARN",):
             message_body = message.get(message_type, None)
@@ -247,8 +267,10 @@ class FaucetProxy:
                 self.mac_table[eth_src].insert(0, data)
             else:
                 self.mac_table[eth_src] = [data]
+            self.changed_macs[eth_src] = True
 
-    def get_endpoints(self, messages=None):
+    def get_endpoints(self, messages=None, changed_only=False):
+        """return mac_table entries, or only those changed since the last call."""
         retval = []
 
         if messages:
@@ -256,18 +278,29 @@ class FaucetProxy:
             for message in messages:
                 if not self.ignore_event(message):
                     self.event(message)
-        for mac in self.mac_table:
+        if changed_only:
+            macs = self.changed_macs
+        else:
+            macs = self.mac_table
+        if not changed_only:
+            self.visible_macs = set()
+        for mac in macs:
             if self.learn_pub_adds:
-                retval.append(self.mac_table[mac])
+                visible = True
             else:
                 # only allow private addresses
                 first_entry = self.mac_table[mac][0]
-                if "ip-address" in first_entry and (
+                visible = "ip-address" in first_entry and (
                     first_entry["ip-address"] == "None"
                     or first_entry["ip-address"] is None
                     or not ipaddress.ip_address(first_entry["ip-address"]).is_global
-                ):
-                    retval.append(self.mac_table[mac])
+                )
+            if visible:
+                retval.append(self.mac_table[mac])
+                self.visible_macs.add(mac)
+            else:
+                self.visible_macs.discard(mac)
+        self.changed_macs = {}
         return retval
 
     def update_acls(
@@ -329,6 +362,19 @@ class FaucetProxy:
                 if mirror_port:
                     self.frpc.clear_mirror_port(switch, mirror_port)
 
+    def share_mirrors(self, mirror_counts, mirror_lock):
+        """
+        count mirrors in mirror_counts, shared with other processes mirroring
+        on the same switches, and make every mirror change under mirror_lock.
+        """
+        self.mirror_counts = mirror_counts
+        self.shared_mirror_lock = mirror_lock
+
+    def mirror_lock(self, mirror_key):
+        if self.shared_mirror_lock is not None:
+            return self.shared_mirror_lock
+        return self.mirror_locks.setdefault(mirror_key, threading.Lock())
+
     def mirror_mac(self, my_mac, my_switch, my_port):
         self.logger.debug("Mirroring mac %s", my_mac)
         switch, port = self._mac_switch_port(my_mac)
@@ -338,9 +384,10 @@ class FaucetProxy:
             if mirror_port:
                 mirror_key = (switch, port)
                 self.logger.info(f"Request mirror of {mirror_key}")
-                self.frpc.mirror_port(switch, mirror_port, port)
-                self.mirror_counts[mirror_key] += 1
-                count = self.mirror_counts[mirror_key]
+                with self.mirror_lock(mirror_key):
+                    self.frpc.mirror_port(switch, mirror_port, port)
+                    count = self.mirror_counts.get(mirror_key, 0) + 1
+                    self.mirror_counts[mirror_key] = count
                 self.logger.info(f"Mirroring {count} MACs on {mirror_key}")
             else:
                 self.logger.error(
@@ -353,25 +400,25 @@ class FaucetProxy:
         self.logger.debug("Unmirroring mac %s", my_mac)
         switch, port = self._mac_switch_port(my_mac)
         if port and switch:
-            trunk = False
-            for sw in self.trunk_ports:
-                if sw == switch and self.trunk_ports[sw].split(",")[1] == str(port):
-                    trunk = True
-            if not trunk:
+            if not self.trunk_ports.is_trunk_port(switch, port):
                 switch, port = self.proxy_mirror_port(switch, port)
                 mirror_port = self.mirror_switch_port(switch)
                 if mirror_port:
                     mirror_key = (switch, port)
                     self.logger.info(f"Request unmirror of {mirror_key}")
-                    if self.mirror_counts[mirror_key]:
-                        self.mirror_counts[mirror_key] -= 1
-                        if not self.mirror_counts[mirror_key]:
-                            self.logger.info(
-                                f"Removing last remaining mirror on {mirror_key}"
-                            )
-                            self.frpc.unmirror_port(switch, mirror_port, port)
-                        count = self.mirror_counts[mirror_key]
-                        self.logger.info(f"Mirroring {count} MACs on {mirror_key}")
+                    with self.mirror_lock(mirror_key):
+                        count = self.mirror_counts.get(mirror_key, 0)
+                        if count:
+                            count -= 1
+                            if count:
+                                self.mirror_counts[mirror_key] = count
+                            else:
+                                self.logger.info(
+                                    f"Removing last remaining mirror on {mirror_key}"
+                                )
+                                self.frpc.unmirror_port(switch, mirror_port, port)
+                                del self.mirror_counts[mirror_key]
+                            self.logger.info(f"Mirroring {count} MACs on {mirror_key}")
                 else:
                     self.logger.error(
                         f"Unable to configure unmirror on {switch}:{port} due to warnings"
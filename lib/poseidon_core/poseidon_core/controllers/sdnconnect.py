@@ -1,21 +1,27 @@
 import difflib
 import ipaddress
 import json
+import logging
+import queue
 import time
-from copy import deepcopy
 
 import pika
 from poseidon_core.constants import NO_DATA
 from poseidon_core.controllers.faucet.config import FaucetRemoteConfGetSetter
 from poseidon_core.controllers.faucet.faucet import FaucetProxy
+from poseidon_core.controllers.shards import machine_shard
+from poseidon_core.helpers.actions import ActionExecutor
 from poseidon_core.helpers.actions import Actions
 from poseidon_core.helpers.endpoint import Endpoint
 from poseidon_core.helpers.endpoint import endpoint_factory
 from poseidon_core.helpers.endpoint import MACHINE_IP_FIELDS
 from poseidon_core.helpers.endpoint import MACHINE_IP_PREFIXES
+from poseidon_core.helpers.endpoint_store import EndpointStore
 from poseidon_core.helpers.metadata import DNSResolver
 from poseidon_core.helpers.metadata import get_ether_vendor
 from poseidon_core.helpers.prometheus import Prometheus
+from poseidon_core.helpers.timers import EndpointTimers
+from poseidon_core.helpers.trunks import TrunkPorts
 
 
 class SDNConnect:
@@ -25,37 +31,51 @@ class SDNConnect:
         self.config = config
         self.r = None
         self.sdnc = None
-        self.endpoints = {}
+        self.endpoints = EndpointStore()
+        self.timers = EndpointTimers(
+            2 * self.config["reinvestigation_frequency"],
+            2 * self.config["coprocessing_frequency"],
+        )
         self.investigations = 0
         self.coprocessing = 0
-        trunk_ports = self.config["trunk_ports"]
-        if isinstance(trunk_ports, str):
-            self.trunk_ports = json.loads(trunk_ports)
-        else:
-            self.trunk_ports = trunk_ports
+        self.shard = 0
+        self.shards = 1
+        self.coordinator = None
+        self.trunk_ports = TrunkPorts(self.config["trunk_ports"])
         self.logger = logger
         self.prom = prom
+        self.actions = ActionExecutor(prom, max_workers=self.config["action_workers"])
         self.faucetconfgetsetter_cl = faucetconfgetsetter_cl
         self.get_sdn_context()
-        self.dns_resolver = DNSResolver()
+        self.dns_resolver = DNSResolver(
+            prom,
+            ttl=self.config["rdns_ttl"],
+            negative_ttl=self.config["rdns_negative_ttl"],
+            timeout=self.config["rdns_timeout"],
+            max_workers=self.config["rdns_workers"],
+        )
+        # name of the endpoint last discovered for each MAC.
+        self.mac_endpoints = {}
+        # IPs being looked up in the background, and their results to merge.
+        self.rdns_requested = set()
+        self.rdns_results = queue.Queue()
         self.get_stored_endpoints()
 
     def mirror_endpoint(self, endpoint):
-        """mirror an endpoint."""
-        status = Actions(endpoint, self.sdnc).mirror_endpoint()
-        if not status:
-            self.logger.warning(
-                "Unable to mirror the endpoint: {0}".format(endpoint.name)
-            )
+        """mirror an endpoint, on an action worker."""
+        actions = Actions(endpoint, self.sdnc)
+        self.actions.submit(
+            endpoint.name, "mirror", actions.mirror_endpoint, actions.updates
+        )
 
     def unmirror_endpoint(self, endpoint):
-        """unmirror an endpoint."""
+        """unmirror an endpoint, on an action worker."""
         if endpoint.operation_active():
-            status = Actions(endpoint, self.sdnc).unmirror_endpoint()
-            if not status:
-                self.logger.warning(
-                    "Unable to unmirror the endpoint: {0}".format(endpoint.name)
-                )
+            self.actions.submit(
+                endpoint.name,
+                "unmirror",
+                Actions(endpoint, self.sdnc).unmirror_endpoint,
+            )
             endpoint.force_unknown()
         else:
             self.logger.info(
@@ -66,9 +86,25 @@ class SDNConnect:
 
     def clear_filters(self):
         """clear any exisiting filters."""
-        if isinstance(self.sdnc, FaucetProxy):
+        # when sharded, mirrors are cleared once before the shards start.
+        if isinstance(self.sdnc, FaucetProxy) and self.coordinator is None:
             self.sdnc.clear_mirrors()
 
+    def use_shard(self, shard, shards, coordinator):
+        """keep only the endpoints this shard owns, and share the budget."""
+        self.shard = shard
+        self.shards = shards
+        self.coordinator = coordinator
+        if isinstance(self.sdnc, FaucetProxy):
+            self.sdnc.share_mirrors(coordinator.mirror_counts, coordinator.mirror_lock)
+        self.endpoints = EndpointStore(
+            {
+                name: endpoint
+                for name, endpoint in self.endpoints.items()
+                if machine_shard(endpoint.endpoint_data, shards) == shard
+            }
+        )
+
     def default_endpoints(self):
         """set endpoints to default state."""
         self.clear_filters()
@@ -82,36 +118,35 @@ class SDNConnect:
             self.logger.info(
                 f"Loaded {len(new_endpoints)} endpoints previously learned."
             )
-            self.endpoints = new_endpoints
+            self.endpoints = EndpointStore(new_endpoints)
+            for endpoint in self.endpoints.values():
+                self.timers.track(endpoint)
+
+    def reload_trunk_ports(self, trunk_ports):
+        """replace the trunk port config, for both discovery and the controller."""
+        self.trunk_ports.reload(trunk_ports)
+        self.logger.info("Loaded {0} trunk ports".format(len(self.trunk_ports)))
 
     def get_sdn_context(self):
         controller_type = self.config.get("TYPE", None)
         if controller_type == "faucet":
             self.sdnc = FaucetProxy(
-                self.config, faucetconfgetsetter_cl=self.faucetconfgetsetter_cl
+                self.config,
+                trunk_ports=self.trunk_ports,
+                faucetconfgetsetter_cl=self.faucetconfgetsetter_cl,
             )
         else:
             self.logger.error("Unknown SDN controller config: {0}".format(self.config))
 
     def not_ignored_endpoints(self, state=None):
-        endpoints = [
-            endpoint for endpoint in self.endpoints.values() if not endpoint.ignore
-        ]
-        if state:
-            endpoints = [endpoint for endpoint in endpoints if endpoint.state == state]
-        return endpoints
+        return self.endpoints.not_ignored(state)
 
     def not_copro_ignored_endpoints(self, state=None):
-        endpoints = [
-            endpoint
-            for endpoint in self.endpoints.values()
-            if not endpoint.copro_ignore
-        ]
-        if state:
-            endpoints = [
-                endpoint for endpoint in endpoints if endpoint.copro_state == state
-            ]
-        return endpoints
+        return self.endpoints.not_copro_ignored(state)
+
+    def due_endpoints(self, names):
+        """endpoints for names popped from self.timers, skipping removed ones."""
+        return [self.endpoints[name] for name in names if name in self.endpoints]
 
     def endpoint_by_name(self, name):
         return self.endpoints.get(name, None)
@@ -120,40 +155,42 @@ class SDNConnect:
         return self.endpoint_by_name(hash_id)
 
     def endpoints_by_ip(self, ip):
-        return [
-            endpoint
-            for endpoint in self.endpoints.values()
-            if ip == endpoint.endpoint_data.get("ipv4", None)
-            or ip == endpoint.endpoint_data.get("ipv6", None)
-        ]
+        return self.endpoints.by_ip(ip)
 
     def endpoints_by_mac(self, mac):
-        return [
-            endpoint
-            for endpoint in self.endpoints.values()
-            if mac == endpoint.endpoint_data["mac"]
-        ]
-
-    def investigation_budget(self):
-        self.investigations = len(
-            [
-                endpoint
-                for endpoint in self.not_ignored_endpoints()
-                if endpoint.operation_active()
-            ]
-        )
-        return max(
-            self.config["max_concurrent_reinvestigations"] - self.investigations, 0
-        )
+        return self.endpoints.by_mac(mac)
+
+    def check_endpoint_store(self):
+        """in debug mode, check budgets are counting from up to date indexes."""
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        unindexed = self.endpoints.unindexed()
+        if unindexed:
+            self.logger.error(
+                "Endpoint indexes out of date, reindexing: {0}".format(unindexed)
+            )
+            for name in unindexed:
+                if name in self.endpoints:
+                    self.endpoints.reindex(self.endpoints[name])
+
+    def investigation_budget(self, wanted=None):
+        """
+        how many more endpoints may be investigated. When sharded, wanted
+        investigations are reserved from the budget shared by all shards.
+        """
+        self.check_endpoint_store()
+        self.investigations = self.endpoints.count_active()
+        limit = self.config["max_concurrent_reinvestigations"]
+        budget = max(limit - self.investigations, 0)
+        if self.coordinator is not None and wanted is not None:
+            budget = self.coordinator.claim(
+                self.shard, self.investigations, min(budget, wanted), limit
+            )
+        return budget
 
     def coprocessing_budget(self):
-        self.coprocessing = len(
-            [
-                endpoint
-                for endpoint in self.not_ignored_endpoints()
-                if endpoint.copro_state == "copro_coprocessing"
-            ]
-        )
+        self.check_endpoint_store()
+        self.coprocessing = self.endpoints.count_coprocessing()
         return max(self.config["max_concurrent_coprocessing"] - self.coprocessing, 0)
 
     @staticmethod
@@ -230,7 +267,9 @@ class SDNConnect:
         parsed = None
 
         try:
-            current = self.sdnc.get_endpoints(messages=messages)
+            current = self.sdnc.get_endpoints(
+                messages=messages, changed_only=self.config["incremental_discovery"]
+            )
             parsed = self.sdnc.format_endpoints(current)
         except Exception as e:  # pragma: no cover
             self.logger.error(
@@ -238,6 +277,20 @@ class SDNConnect:
             )
 
         self.find_new_machines(parsed)
+        if parsed is not None and self.config["incremental_discovery"]:
+            self.touch_unchanged_machines(parsed)
+
+    def touch_unchanged_machines(self, changed_machines):
+        """
+        touch the endpoints of MACs that did not change, which a full sweep
+        would have passed to find_new_machines() and so touched too.
+        """
+        changed_macs = {machine["mac"] for machine in changed_machines}
+        now = time.time()
+        for mac in self.sdnc.visible_macs - changed_macs:
+            endpoint = self.endpoints.get(self.mac_endpoints.get(mac, None), None)
+            if endpoint is not None:
+                endpoint.touch(now)
 
     @staticmethod
     def _diff_machine(machine_a, machine_b):
@@ -300,6 +353,75 @@ class SDNConnect:
                     if field in old_machine:
                         new_machine[field] = old_machine[field]
 
+    def merge_machine_rdns(self, old_machine, new_machine):
+        """keep names already resolved for IPs being looked up again."""
+        for ip_field in MACHINE_IP_FIELDS:
+            ip = new_machine.get(ip_field, None)
+            if ip in self.rdns_requested and ip == old_machine.get(ip_field, None):
+                rdns_field = "_".join((ip_field, "rdns"))
+                if rdns_field in old_machine:
+                    new_machine[rdns_field] = old_machine[rdns_field]
+
+    def resolve_ips_cached(self, ips):
+        """
+        cached rDNS names for ips. Uncached IPs are NO_DATA for now, and
+        looked up in the background for handle_rdns_results() to merge.
+        """
+        resolved_ips = {}
+        for ip in ips:
+            result = None
+            if ip not in self.rdns_requested:
+                result = self.dns_resolver.resolve_ip_async(ip, self._rdns_result)
+                if result is None:
+                    self.rdns_requested.add(ip)
+            if result is None:
+                result = NO_DATA
+            resolved_ips[ip] = result
+        return resolved_ips
+
+    def _rdns_result(self, ip, result):
+        # called from a resolver thread.
+        self.rdns_results.put((ip, result))
+
+    def handle_rdns_results(self):
+        """merge rDNS names looked up in the background into their endpoints."""
+        self.dns_resolver.expire()
+        events = 0
+        while True:
+            try:
+                ip, result = self.rdns_results.get_nowait()
+            except queue.Empty:
+                break
+            self.rdns_requested.discard(ip)
+            for endpoint in self.endpoints.by_ip(ip):
+                if endpoint.ignore:
+                    continue
+                endpoint_data = endpoint.endpoint_data
+                for ip_field in MACHINE_IP_FIELDS:
+                    rdns_field = "_".join((ip_field, "rdns"))
+                    if (
+                        endpoint_data.get(ip_field, None) == ip
+                        and endpoint_data.get(rdns_field, None) != result
+                    ):
+                        endpoint_data[rdns_field] = result
+                        endpoint.mark_dirty()
+                        events += 1
+        return events
+
+    def update_endpoint_data(self, endpoint, machine):
+        """update an endpoint's endpoint_data in place, to match machine."""
+        endpoint_data = endpoint.endpoint_data
+        if self.logger.isEnabledFor(logging.INFO):
+            diff_txt = self._diff_machine(endpoint_data, machine)
+            self.logger.info(
+                "Endpoint changed: {0}:\n{1}".format(endpoint.name, diff_txt)
+            )
+        for field in endpoint_data.keys() - machine.keys():
+            del endpoint_data[field]
+        endpoint_data.update(machine)
+        self.endpoints.reindex(endpoint)
+        endpoint.mark_dirty()
+
     def find_new_machines(self, machines):
         """parse switch structure to find new machines added to network
         since last call"""
@@ -315,30 +437,25 @@ class SDNConnect:
             if "controller_type" not in machine:
                 machine.update({"controller_type": "none", "controller": ""})
 
-        if machine_ips:
-            self.logger.debug("resolving %s" % machine_ips)
-            resolved_machine_ips = self.dns_resolver.resolve_ips(list(machine_ips))
-            self.logger.debug("resolver results %s", resolved_machine_ips)
-            for machine in machines:
-                self._update_machine_rdns(machine, resolved_machine_ips)
-
+        # every machine gets its rdns fields, not only those batched with an
+        # IP, so a machine's data doesn't depend on which others changed with it.
+        resolved_machine_ips = self.resolve_ips_cached(machine_ips)
         for machine in machines:
-            trunk = False
-            for sw in self.trunk_ports:
-                if (
-                    sw == machine["segment"]
-                    and self.trunk_ports[sw].split(",")[1] == str(machine["port"])
-                    and self.trunk_ports[sw].split(",")[0] == machine["mac"]
-                ):
-                    trunk = True
+            self._update_machine_rdns(machine, resolved_machine_ips)
 
+        for machine in machines:
+            trunk = self.trunk_ports.is_trunk(
+                machine["segment"], machine["port"], machine["mac"]
+            )
             h = Endpoint.make_hash(machine, trunk=trunk)
+            self.mac_endpoints[machine["mac"]] = h
             ep = self.endpoints.get(h, None)
             if ep is None:
                 change_acls = True
                 m = endpoint_factory(h)
-                m.endpoint_data = deepcopy(machine)
+                m.endpoint_data = dict(machine)
                 m.touch()
+                self.timers.track(m)
                 self.endpoints[m.name] = m
                 self.logger.info(
                     "Detected new endpoint: {0}:{1}".format(m.name, machine)
@@ -346,11 +463,11 @@ class SDNConnect:
                 continue
 
             self.merge_machine_ip(ep.endpoint_data, machine)
-            if ep.endpoint_data != machine and not ep.ignore:
-                diff_txt = self._diff_machine(ep.endpoint_data, machine)
-                self.logger.info("Endpoint changed: {0}:\n{1}".format(h, diff_txt))
+            self.merge_machine_rdns(ep.endpoint_data, machine)
+            # machines are flat dicts, so this compares each field once, in C.
+            if not ep.ignore and ep.endpoint_data != machine:
                 change_acls = True
-                ep.endpoint_data = deepcopy(machine)
+                self.update_endpoint_data(ep, machine)
             ep.touch()
 
         if change_acls and self.config["AUTOMATED_ACLS"]:
@@ -369,6 +486,7 @@ class SDNConnect:
                         ep.acl_data.append(
                             ((item[0], item[4], item[5]), int(time.time()))
                         )
+                        ep.mark_dirty()
 
     @staticmethod
     def coprocess_endpoint(_endpoint):
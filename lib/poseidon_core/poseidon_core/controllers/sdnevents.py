@@ -1,44 +1,386 @@
-import json
+import asyncio
+import heapq
+import itertools
 import queue
+import re
+import threading
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
+from poseidon_core.controllers.faucet.faucet import FaucetProxy
 from poseidon_core.helpers.actions import Actions
+from poseidon_core.helpers.capture import CaptureWriter
 from poseidon_core.helpers.config import Config
+from poseidon_core.helpers.rabbit import AsyncRabbit
+from poseidon_core.helpers.rabbit import json_loads
 from poseidon_core.helpers.rabbit import Rabbit
 
 
+class Wakeup:
+    """threading.Event that remembers when it was first set."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.set_time = None
+
+    def set(self):
+        with self.lock:
+            if self.set_time is None:
+                self.set_time = time.time()
+            self.event.set()
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+    def clear(self):
+        with self.lock:
+            set_time = self.set_time
+            self.set_time = None
+            self.event.clear()
+        return set_time
+
+
+class AsyncWakeup(Wakeup):
+    """Wakeup that can also be awaited on an asyncio event loop."""
+
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+        self.async_event = asyncio.Event()
+
+    def set(self):
+        super().set()
+        # may be called from outside the event loop thread.
+        self.loop.call_soon_threadsafe(self.async_event.set)
+
+    async def async_wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.async_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def clear(self):
+        self.async_event.clear()
+        return super().clear()
+
+
+class WorkQueue(queue.Queue):
+    """queue.Queue that sets a shared Wakeup whenever an item is put."""
+
+    def __init__(self, wakeup, maxsize=0):
+        super().__init__(maxsize)
+        self.wakeup = wakeup
+
+    def _put(self, item):
+        super()._put(item)
+        self.wakeup.set()
+
+
+class MessageQueue(WorkQueue):
+    """
+    WorkQueue for RabbitMQ messages with an overload policy for when it is
+    full: block the producer, drop the oldest droppable message, or coalesce
+    with a queued message that has the same key. Messages are droppable
+    when message_key returns a key for them.
+    """
+
+    OVERLOAD_POLICIES = ("block", "drop_oldest", "coalesce")
+
+    def __init__(
+        self, wakeup, maxsize=0, overload_policy="block", message_key=None, on_drop=None
+    ):
+        if overload_policy not in self.OVERLOAD_POLICIES:
+            raise ValueError("Unknown overload policy: {0}".format(overload_policy))
+        self.overload_policy = overload_policy
+        self.message_key = message_key or (lambda _item: None)
+        self.on_drop = on_drop or (lambda _item, _reason: None)
+        super().__init__(wakeup, maxsize)
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self.keyed = {}
+
+    # items are queued in single element lists, so coalescing can swap them in place.
+    def _put(self, item):
+        holder = [item]
+        key = self.message_key(item)
+        if key is not None:
+            self.keyed[key] = holder
+        super()._put(holder)
+
+    def _get(self):
+        holder = super()._get()
+        key = self.message_key(holder[0])
+        if key is not None and self.keyed.get(key, None) is holder:
+            del self.keyed[key]
+        return holder[0]
+
+    def _drop_oldest(self):
+        for i, holder in enumerate(self.queue):
+            key = self.message_key(holder[0])
+            if key is not None:
+                del self.queue[i]
+                if self.keyed.get(key, None) is holder:
+                    del self.keyed[key]
+                return holder[0]
+        return None
+
+    def put(self, item, block=True, timeout=None):
+        key = self.message_key(item)
+        if key is not None and self.overload_policy != "block":
+            coalesced = False
+            dropped = None
+            with self.mutex:
+                if 0 < self.maxsize <= self._qsize():
+                    holder = None
+                    if self.overload_policy == "coalesce":
+                        holder = self.keyed.get(key, None)
+                    if holder is not None:
+                        dropped, holder[0] = holder[0], item
+                        coalesced = True
+                    elif self.overload_policy == "drop_oldest":
+                        dropped = self._drop_oldest()
+            if dropped is not None:
+                self.on_drop(dropped, self.overload_policy)
+            if coalesced:
+                self.wakeup.set()
+                return
+        super().put(item, block, timeout)
+
+
+def job_name(job):
+    return getattr(getattr(job, "func", job), "__name__", "job")
+
+
+class JobQueue(WorkQueue):
+    """
+    WorkQueue for scheduled jobs, run earliest due first. A job put while
+    the same job is still queued is coalesced into it, so a slow main loop
+    runs a periodic job once rather than once for every missed period.
+    """
+
+    def __init__(self, wakeup, maxsize=0, on_coalesce=None):
+        self.on_coalesce = on_coalesce or (lambda _job: None)
+        super().__init__(wakeup, maxsize)
+
+    def _init(self, maxsize):
+        self.queue = []
+        self.pending = set()
+        self.counter = itertools.count()
+
+    def _qsize(self):
+        return len(self.queue)
+
+    # items are (due_time, job), queued behind a counter so jobs are never compared.
+    def _put(self, item):
+        due_time, job = item
+        heapq.heappush(self.queue, (due_time, next(self.counter), job))
+        self.pending.add(job)
+        self.wakeup.set()
+
+    def _get(self):
+        due_time, _, job = heapq.heappop(self.queue)
+        self.pending.discard(job)
+        return (due_time, job)
+
+    def put(self, item, block=True, timeout=None, due_time=None):
+        if due_time is None:
+            due_time = time.time()
+        endtime = None
+        if timeout is not None:
+            endtime = time.monotonic() + timeout
+        # checked and pushed under one hold of the mutex, so two threads
+        # putting the same job can't both find it missing and queue it twice.
+        with self.not_full:
+            while item not in self.pending and 0 < self.maxsize <= self._qsize():
+                remaining = None
+                if endtime is not None:
+                    remaining = endtime - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise queue.Full
+                self.not_full.wait(remaining)
+            coalesced = item in self.pending
+            if not coalesced:
+                self._put((due_time, item))
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+        if coalesced:
+            self.on_coalesce(item)
+
+    def next_due(self):
+        """due time of the earliest queued job, or None."""
+        with self.mutex:
+            if self.queue:
+                return self.queue[0][0]
+        return None
+
+    def get_due(self, now):
+        """remove and return the earliest (due_time, job) due by now, or None."""
+        with self.mutex:
+            if not self.queue or self.queue[0][0] > now:
+                return None
+            item = self._get()
+            self.not_full.notify()
+            return item
+
+
 class SDNEvents:
     def __init__(self, logger, prom, sdnc):
         self.logger = logger
         self.prom = prom
-        self.m_queue = queue.Queue()
-        self.job_queue = queue.Queue()
+        self.wakeup = Wakeup()
         self.rabbits = []
         self.config = Config().get_config()
+        self.raw_queue = queue.Queue(maxsize=self.config["max_queue_size"])
+        # operator actions and tool results are decoded apart from FAUCET events,
+        # so they never wait behind a FAUCET backlog.
+        self.raw_action_queue = queue.Queue(maxsize=self.config["max_queue_size"])
+        self.decoder_threads = []
+        self.capture = None
+        if self.config["capture_file"]:
+            self.capture = CaptureWriter(self.config["capture_file"])
+        # operator actions and tool results get their own lane, drained before FAUCET events.
+        self.action_queue = WorkQueue(
+            self.wakeup, maxsize=self.config["max_queue_size"]
+        )
+        self.m_queue = MessageQueue(
+            self.wakeup,
+            maxsize=self.config["max_queue_size"],
+            overload_policy=self.config["overload_policy"],
+            message_key=self.faucet_message_key,
+            on_drop=self.drop_message,
+        )
+        self.job_queue = JobQueue(
+            self.wakeup,
+            maxsize=self.config["max_queue_size"],
+            on_coalesce=self.coalesce_job,
+        )
+        self.completion_queue = WorkQueue(self.wakeup)
+        self.rdns_queue = WorkQueue(self.wakeup)
+        self.pending_acks = []
+        self.max_loop_wait = self.config["max_loop_wait"]
+        self.max_batch_size = self.config["max_batch_size"]
+        self.batch_time_budget = self.config["batch_time_budget"]
+        self.handlers = {}
+        self.topic_handlers = []
+        self.resolved_handlers = {}
+        self.register_handlers()
         self.sdnc = sdnc
+        self.sdnc.actions.completions = self.completion_queue
+        self.sdnc.rdns_results = self.rdns_queue
         self.sdnc.default_endpoints()
-        self.prom.update_endpoint_metadata(self.sdnc.endpoints)
+        self.prom.export_endpoints(lambda: self.sdnc.endpoints)
+        self.prom.prom_metrics["queue_depth"].labels(queue="raw").set_function(
+            self.raw_queue.qsize
+        )
+        self.prom.prom_metrics["queue_depth"].labels(queue="raw_actions").set_function(
+            self.raw_action_queue.qsize
+        )
+        self.prom.prom_metrics["queue_depth"].labels(queue="actions").set_function(
+            self.action_queue.qsize
+        )
+        self.prom.prom_metrics["queue_depth"].labels(queue="messages").set_function(
+            self.m_queue.qsize
+        )
+        self.prom.prom_metrics["queue_depth"].labels(queue="jobs").set_function(
+            self.job_queue.qsize
+        )
 
     def create_message_queue(self, host, port, exchange, binding_key):
         waiting = True
         while waiting:
-            rabbit = Rabbit()
+            rabbit = Rabbit.from_config(self.config)
             rabbit.make_rabbit_connection(host, port, exchange, binding_key)
-            rabbit.start_channel(self.rabbit_callback, self.m_queue)
+            rabbit.start_channel(self.rabbit_callback, self.raw_queue)
             waiting = False
         self.rabbits.append(rabbit)
 
+    @staticmethod
+    def message_queues(config):
+        host = config["FA_RABBIT_HOST"]
+        port = int(config["FA_RABBIT_PORT"])
+        return [
+            (
+                host,
+                port,
+                "topic-poseidon-internal",
+                ["poseidon.algos.#", "poseidon.action.#"],
+            ),
+            (
+                host,
+                port,
+                config["FA_RABBIT_EXCHANGE"],
+                [config["FA_RABBIT_ROUTING_KEY"] + ".#"],
+            ),
+        ]
+
     def start_message_queues(self):
-        host = self.config["FA_RABBIT_HOST"]
-        port = int(self.config["FA_RABBIT_PORT"])
-        exchange = "topic-poseidon-internal"
-        binding_key = ["poseidon.algos.#", "poseidon.action.#"]
-        self.create_message_queue(host, port, exchange, binding_key)
-        exchange = self.config["FA_RABBIT_EXCHANGE"]
-        binding_key = [self.config["FA_RABBIT_ROUTING_KEY"] + ".#"]
-        self.create_message_queue(host, port, exchange, binding_key)
+        self.start_decoder()
+        for host, port, exchange, binding_key in self.message_queues(self.config):
+            self.create_message_queue(host, port, exchange, binding_key)
+
+    def use_asyncio(self, loop):
+        """switch wakeups over to the given asyncio event loop."""
+        self.wakeup = AsyncWakeup(loop)
+        self.action_queue.wakeup = self.wakeup
+        self.m_queue.wakeup = self.wakeup
+        self.completion_queue.wakeup = self.wakeup
+        self.rdns_queue.wakeup = self.wakeup
+        self.job_queue.wakeup = self.wakeup
+
+    async def start_message_queues_async(self):  # pragma: no cover
+        self.start_decoder()
+        for host, port, exchange, binding_key in self.message_queues(self.config):
+            rabbit = AsyncRabbit.from_config(self.config)
+            await rabbit.make_rabbit_connection(host, port, exchange, binding_key)
+            rabbit.start_channel(self.rabbit_callback, self.raw_queue)
+            self.rabbits.append(rabbit)
+
+    @staticmethod
+    def faucet_event_key(message):
+        """
+        (dp_name, eth_src, vid, l3_src_ip) of an L2_LEARN event, otherwise
+        None. The IP is part of the key because FaucetProxy keeps a history
+        of each MAC's addresses, so a dual stack host needs both its IPv4
+        and IPv6 events.
+        """
+        l2_learn = message.get("L2_LEARN", None)
+        if l2_learn:
+            return (
+                message.get("dp_name", None),
+                l2_learn.get("eth_src", None),
+                l2_learn.get("vid", None),
+                l2_learn.get("l3_src_ip", None),
+            )
+        return None
+
+    def faucet_message_key(self, item):
+        routing_key, body = item[:2]
+        if routing_key == self.config["FA_RABBIT_ROUTING_KEY"] and isinstance(
+            body, dict
+        ):
+            return self.faucet_event_key(body)
+        return None
+
+    def drop_message(self, item, reason):
+        self.prom.prom_metrics["queue_dropped"].labels(
+            queue="messages", reason=reason
+        ).inc()
+        self.ack_message(item)
+
+    @staticmethod
+    def ack_message(item):
+        if len(item) > 2 and item[2] is not None:
+            item[2]()
+
+    def ack_pending(self):
+        """ack messages only once they have been processed."""
+        for item in self.pending_acks:
+            self.ack_message(item)
+        self.pending_acks = []
 
     def merge_metadata(self, new_metadata):
         updated = set()
@@ -59,129 +401,195 @@ class SDNEvents:
                         endpoint.metadata[metadata_type][key].update(data)
                     else:
                         endpoint.metadata[metadata_type][key] = data
+                    endpoint.mark_dirty()
                     updated.add(endpoint)
         return updated
 
-    def format_rabbit_message(self, item, faucet_event, remove_list):
+    def register_handlers(self):
+        self.register_handler("poseidon.algos.decider", self.handler_algos_decider)
+        self.register_handler("poseidon.action.ignore", self.handler_action_ignore)
+        self.register_handler(
+            "poseidon.action.clear.ignored", self.handler_action_clear_ignored
+        )
+        self.register_handler("poseidon.action.change", self.handler_action_change)
+        self.register_handler(
+            "poseidon.action.update_acls", self.handler_action_update_acls
+        )
+        self.register_handler("poseidon.action.remove", self.handler_action_remove)
+        self.register_handler(
+            "poseidon.action.remove.ignored", self.handler_action_remove_ignored
+        )
+        self.register_handler(
+            self.config["FA_RABBIT_ROUTING_KEY"], self.handler_faucet_event
+        )
+
+    @staticmethod
+    def topic_regex(routing_key):
+        """regex for an AMQP topic, where * matches one word and # matches zero or more."""
+        words = []
+        for word in routing_key.split("."):
+            if word == "*":
+                words.append(r"[^.]+")
+            elif word == "#":
+                words.append(r".*")
+            else:
+                words.append(re.escape(word))
+        pattern = r"\.".join(words)
+        # a # also absorbs the separator next to it, so it can match no words.
+        pattern = pattern.replace(r".*\.", r"(?:.*\.)?")
+        if pattern.endswith(r"\..*"):
+            pattern = pattern[: -len(r"\..*")] + r"(?:\..*)?"
+        return re.compile(pattern + "$")
+
+    def register_handler(self, routing_key, handler):
         """
-        read a message off the rabbit_q
-        the message should be item = (routing_key,msg)
+        register a handler for messages with a routing key, which may be an AMQP
+        topic pattern. Exact keys take precedence over patterns, and patterns
+        are tried in the order they were registered. A handler is called as
+        handler(my_obj, faucet_event, remove_list) and returns what
+        format_rabbit_message should return for the message.
         """
-        routing_key, my_obj = item
-        self.logger.debug(
-            "routing_key: {0} rabbit_message: {1}".format(routing_key, my_obj)
-        )
+        if {"*", "#"} & set(routing_key.split(".")):
+            self.topic_handlers.append(
+                (self.topic_regex(routing_key), routing_key, handler)
+            )
+        else:
+            self.handlers[routing_key] = (routing_key, handler)
+        self.resolved_handlers = {}
 
-        def handler_algos_decider(my_obj):
-            self.logger.debug("decider value:{0}".format(my_obj))
-            tool = my_obj.get("tool", "unknown")
-            self.update_prom_var_time("last_tool_result_time", "tool", tool)
-            data = my_obj.get("data", None)
-            if isinstance(data, dict) and data:
-                updated = self.merge_metadata(data)
-                if updated:
-                    for endpoint in updated:
-                        if endpoint.operation_active():
-                            self.sdnc.unmirror_endpoint(endpoint)
-                    return data
-            return {}
-
-        def handler_action_ignore(my_obj):
-            for name in my_obj:
-                endpoint = self.sdnc.endpoints.get(name, None)
-                if endpoint:
-                    endpoint.ignore = True
-            return {}
-
-        def handler_action_clear_ignored(my_obj):
-            for name in my_obj:
-                endpoint = self.sdnc.endpoints.get(name, None)
-                if endpoint:
-                    endpoint.ignore = False
-            return {}
-
-        def handler_action_change(my_obj):
-            for name, state in my_obj:
-                endpoint = self.sdnc.endpoints.get(name, None)
-                if endpoint:
-                    try:
-                        if endpoint.operation_active():
-                            self.sdnc.unmirror_endpoint(endpoint)
-                        # pytype: disable=attribute-error
-                        endpoint.machine_trigger(state)
-                        # pytype: enable=attribute-error
-                        endpoint.p_next_state = None
-                        if endpoint.operation_active():
-                            self.sdnc.mirror_endpoint(endpoint)
-                            self.prom.prom_metrics["ncapture_count"].inc()
-                    except Exception as e:  # pragma: no cover
-                        self.logger.error(
-                            "Unable to change endpoint {0} because: {1}".format(
-                                endpoint.name, str(e)
-                            )
-                        )
-            return {}
+    def resolve_handler(self, routing_key):
+        """(handler, runtime metric) for a routing key, or None."""
+        try:
+            return self.resolved_handlers[routing_key]
+        except KeyError:
+            pass
+        registered = self.handlers.get(routing_key, None)
+        if registered is None:
+            for topic_re, topic, handler in self.topic_handlers:
+                if topic_re.match(routing_key):
+                    registered = (topic, handler)
+                    break
+        resolved = None
+        if registered is not None:
+            handler_key, handler = registered
+            resolved = (
+                handler,
+                self.prom.prom_metrics["handler_runtime_secs"].labels(
+                    routing_key=handler_key
+                ),
+            )
+        self.resolved_handlers[routing_key] = resolved
+        return resolved
 
-        def handler_action_update_acls(my_obj):
-            for ip in my_obj:
-                rules = my_obj[ip]
-                endpoints = self.sdnc.endpoints_by_ip(ip)
-                if endpoints:
-                    endpoint = endpoints[0]
-                    try:
-                        status = Actions(endpoint, self.sdnc.sdnc).update_acls(
-                            rules_file=self.config["RULES_FILE"],
-                            endpoints=endpoints,
-                            force_apply_rules=rules,
+    def handler_algos_decider(self, my_obj, _faucet_event, _remove_list):
+        self.logger.debug("decider value:%s", my_obj)
+        tool = my_obj.get("tool", "unknown")
+        self.update_prom_var_time("last_tool_result_time", "tool", tool)
+        data = my_obj.get("data", None)
+        if isinstance(data, dict) and data:
+            updated = self.merge_metadata(data)
+            if updated:
+                for endpoint in updated:
+                    if endpoint.operation_active():
+                        self.sdnc.unmirror_endpoint(endpoint)
+                return data
+        return {}
+
+    def handler_action_ignore(self, my_obj, _faucet_event, _remove_list):
+        for name in my_obj:
+            endpoint = self.sdnc.endpoints.get(name, None)
+            if endpoint:
+                endpoint.ignore = True
+                endpoint.mark_dirty()
+        return {}
+
+    def handler_action_clear_ignored(self, my_obj, _faucet_event, _remove_list):
+        for name in my_obj:
+            endpoint = self.sdnc.endpoints.get(name, None)
+            if endpoint:
+                endpoint.ignore = False
+                endpoint.mark_dirty()
+        return {}
+
+    def handler_action_change(self, my_obj, _faucet_event, _remove_list):
+        for name, state in my_obj:
+            endpoint = self.sdnc.endpoints.get(name, None)
+            if endpoint:
+                try:
+                    if endpoint.operation_active():
+                        self.sdnc.unmirror_endpoint(endpoint)
+                    # pytype: disable=attribute-error
+                    endpoint.machine_trigger(state)
+                    # pytype: enable=attribute-error
+                    endpoint.p_next_state = None
+                    endpoint.mark_dirty()
+                    if endpoint.operation_active():
+                        self.sdnc.mirror_endpoint(endpoint)
+                        self.prom.prom_metrics["ncapture_count"].inc()
+                except Exception as e:  # pragma: no cover
+                    self.logger.error(
+                        "Unable to change endpoint {0} because: {1}".format(
+                            endpoint.name, str(e)
                         )
-                        if not status:
-                            self.logger.warning(
-                                "Unable to apply rules: {0} to endpoint: {1}".format(
-                                    rules, endpoint.name
-                                )
-                            )
-                    except Exception as e:
-                        self.logger.error(
-                            "Unable to apply rules: {0} to endpoint: {1} because {2}".format(
-                                rules, endpoint.name, str(e)
+                    )
+        return {}
+
+    def handler_action_update_acls(self, my_obj, _faucet_event, _remove_list):
+        for ip in my_obj:
+            rules = my_obj[ip]
+            endpoints = self.sdnc.endpoints_by_ip(ip)
+            if endpoints:
+                endpoint = endpoints[0]
+                try:
+                    status = Actions(endpoint, self.sdnc.sdnc).update_acls(
+                        rules_file=self.config["RULES_FILE"],
+                        endpoints=endpoints,
+                        force_apply_rules=rules,
+                    )
+                    if not status:
+                        self.logger.warning(
+                            "Unable to apply rules: {0} to endpoint: {1}".format(
+                                rules, endpoint.name
                             )
                         )
-            return {}
-
-        def handler_action_remove(my_obj):
-            remove_list.extend([name for name in my_obj])
-            return {}
-
-        def handler_action_remove_ignored(_my_obj):
-            remove_list.extend(
-                [
-                    endpoint.name
-                    for endpoint in self.sdnc.endpoints.values()
-                    if endpoint.ignore
-                ]
-            )
-            return {}
+                except Exception as e:
+                    self.logger.error(
+                        "Unable to apply rules: {0} to endpoint: {1} because {2}".format(
+                            rules, endpoint.name, str(e)
+                        )
+                    )
+        return {}
 
-        def handler_faucet_event(my_obj):
-            if self.sdnc and self.sdnc.sdnc:
-                faucet_event.append(my_obj)
-                return my_obj
-            return {}
-
-        handlers = {
-            "poseidon.algos.decider": handler_algos_decider,
-            "poseidon.action.ignore": handler_action_ignore,
-            "poseidon.action.clear.ignored": handler_action_clear_ignored,
-            "poseidon.action.change": handler_action_change,
-            "poseidon.action.update_acls": handler_action_update_acls,
-            "poseidon.action.remove": handler_action_remove,
-            "poseidon.action.remove.ignored": handler_action_remove_ignored,
-            self.config["FA_RABBIT_ROUTING_KEY"]: handler_faucet_event,
-        }
+    def handler_action_remove(self, my_obj, _faucet_event, remove_list):
+        remove_list.extend([name for name in my_obj])
+        return {}
+
+    def handler_action_remove_ignored(self, _my_obj, _faucet_event, remove_list):
+        remove_list.extend(
+            [endpoint.name for endpoint in self.sdnc.endpoints.lookup("ignore", True)]
+        )
+        return {}
+
+    def handler_faucet_event(self, my_obj, faucet_event, _remove_list):
+        if self.sdnc and self.sdnc.sdnc:
+            faucet_event.append(my_obj)
+            return my_obj
+        return {}
+
+    def format_rabbit_message(self, item, faucet_event, remove_list):
+        """
+        read a message off the rabbit_q
+        the message should be item = (routing_key,msg) or (routing_key,msg,ack)
+        """
+        routing_key, my_obj = item[:2]
+        self.logger.debug("routing_key: %s rabbit_message: %s", routing_key, my_obj)
 
-        handler = handlers.get(routing_key, None)
-        if handler is not None:
-            ret_val = handler(my_obj)
+        resolved = self.resolve_handler(routing_key)
+        if resolved is not None:
+            handler, runtime = resolved
+            start_time = time.perf_counter()
+            ret_val = handler(my_obj, faucet_event, remove_list)
+            runtime.observe(time.perf_counter() - start_time)
             return ret_val, True
 
         self.logger.error("no handler for routing_key {0}".format(routing_key))
@@ -193,23 +601,65 @@ class SDNEvents:
                 time.time()
             )
 
-    def handle_rabbit(self):
-        events = 0
-        faucet_event = []
-        remove_list = []
-        while True:
-            found_work, rabbit_msg = self.prom.runtime_callable(
-                partial(self.get_q_item, self.m_queue)
+    @staticmethod
+    def coalesce_faucet_events(faucet_event):
+        """keep only the newest L2_LEARN per faucet_event_key(), in order."""
+        coalesced = {}
+        for i, message in enumerate(faucet_event):
+            key = SDNEvents.faucet_event_key(message)
+            if key is None:
+                key = i
+            else:
+                coalesced.pop(key, None)
+            coalesced[key] = message
+        return list(coalesced.values())
+
+    def observe_message_latency(self, lane, item):
+        if len(item) > 3:
+            self.prom.prom_metrics["message_latency_secs"].labels(lane=lane).observe(
+                time.time() - item[3]
             )
+
+    def handle_lane(self, lane, q, faucet_event, remove_list, limit, deadline=None):
+        events = 0
+        while events < limit and (deadline is None or time.monotonic() < deadline):
+            found_work, rabbit_msg = self.get_q_item(q)
             if not found_work:
                 break
             events += 1
-            # faucet_event and remove_list get updated as references because partial()
-            self.prom.runtime_callable(
-                partial(
-                    self.format_rabbit_message, rabbit_msg, faucet_event, remove_list
-                )
+            self.pending_acks.append(rabbit_msg)
+            # handlers are timed per routing key in format_rabbit_message.
+            self.format_rabbit_message(rabbit_msg, faucet_event, remove_list)
+            self.observe_message_latency(lane, rabbit_msg)
+        return events
+
+    def handle_rabbit(self):
+        """
+        handle queued messages. Operator actions and tool results are always
+        drained first, FAUCET events get what is left of the batch budget.
+        """
+        faucet_event = []
+        remove_list = []
+        deadline = time.monotonic() + self.batch_time_budget
+        events = self.handle_lane(
+            "actions", self.action_queue, faucet_event, remove_list, float("inf")
+        )
+        events += self.handle_lane(
+            "faucet",
+            self.m_queue,
+            faucet_event,
+            remove_list,
+            self.max_batch_size - events,
+            deadline,
+        )
+        if faucet_event:
+            received = len(faucet_event)
+            faucet_event = self.coalesce_faucet_events(faucet_event)
+            self.prom.prom_metrics["faucet_events_received"].inc(received)
+            self.prom.prom_metrics["faucet_events_coalesced"].inc(
+                received - len(faucet_event)
             )
+            self.prom.prom_metrics["faucet_events_applied"].inc(len(faucet_event))
         return (events, faucet_event, remove_list)
 
     def ignore_rabbit(self, routing_key, body):
@@ -220,53 +670,202 @@ class SDNEvents:
                     return True
         return False
 
-    def rabbit_callback(self, ch, method, _properties, body, q=None):
-        """callback, places rabbit data into internal queue"""
-        body = json.loads(body)
-        self.logger.debug(
-            "got a message: {0}:{1} (qsize {2})".format(
-                method.routing_key, body, q.qsize()
-            )
-        )
+    def ignore_raw_rabbit(self, routing_key, body):
+        """drop ignored messages before they are decoded."""
+        if routing_key == self.config["FA_RABBIT_ROUTING_KEY"]:
+            return FaucetProxy.ignore_raw_event(body)
+        return False
+
+    def rabbit_callback(self, ch, method, _properties, body, q=None, rabbit=None):
+        """
+        callback, places undecoded FAUCET events into the decoder queue, to
+        be acked once processed. This runs on the pika I/O thread, so anything
+        slower than a peek at the raw body is left to the decoder.
+        """
+        if rabbit is not None:
+            ack = partial(rabbit.ack, method.delivery_tag)
+        else:
+            ack = partial(Rabbit.threadsafe_ack, ch, method.delivery_tag)
+        received_time = time.time()
+        if self.capture is not None:
+            self.capture.write(received_time, method.routing_key, body)
         if q is not None:
-            self.update_prom_var_time(
-                "last_rabbitmq_routing_key_time", "routing_key", method.routing_key
+            item = (method.routing_key, body, ack, received_time)
+            if method.routing_key != self.config["FA_RABBIT_ROUTING_KEY"]:
+                self.put_raw(self.raw_action_queue, item)
+                return
+            if not self.ignore_raw_rabbit(method.routing_key, body):
+                self.put_raw(q, item)
+                return
+        if rabbit is not None:
+            ack()
+        else:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def put_raw(self, q, item):
+        """
+        queue a raw message for a decoder without blocking the pika I/O thread,
+        unless the overload policy is to block. Undecoded messages have no key
+        to coalesce by, so otherwise one that finds the decoder queue full is
+        dropped.
+        """
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            policy = self.config["overload_policy"]
+            if policy == "block":
+                q.put(item)
+                return
+            self.logger.warning(
+                "Decoder queue full, dropping message {0}".format(item[0])
             )
-            if not self.ignore_rabbit(method.routing_key, body):
-                q.put((method.routing_key, body))
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+            self.prom.prom_metrics["queue_dropped"].labels(
+                queue="raw", reason=policy
+            ).inc()
+            self.ack_message(item)
 
-    def process(self, monitor):
-        while True:
-            events, faucet_event, remove_list = self.prom.runtime_callable(
-                self.handle_rabbit
+    def lane_queue(self, routing_key):
+        if routing_key == self.config["FA_RABBIT_ROUTING_KEY"]:
+            return self.m_queue
+        return self.action_queue
+
+    def queue_message(self, item):
+        self.lane_queue(item[0]).put(item)
+
+    def decode_message(self, item):
+        """decode and filter a raw rabbit message, then queue it for the main loop."""
+        routing_key, body, ack = item[:3]
+        try:
+            body = json_loads(body)
+        except ValueError as e:
+            self.logger.error(
+                "Unable to decode message {0}: {1}".format(routing_key, e)
             )
-            if remove_list:
-                for endpoint_name in remove_list:
-                    if endpoint_name in self.sdnc.endpoints:
-                        del self.sdnc.endpoints[endpoint_name]
-            if faucet_event:
-                self.prom.runtime_callable(
-                    partial(self.sdnc.check_endpoints, faucet_event)
+            self.drop_message(item, "undecodable")
+            return
+        self.logger.debug("got a message: %s:%s", routing_key, body)
+        self.update_prom_var_time(
+            "last_rabbitmq_routing_key_time", "routing_key", routing_key
+        )
+        if self.ignore_rabbit(routing_key, body):
+            ack()
+            return
+        self.queue_message((routing_key, body) + item[2:])
+
+    def decode_messages(self, raw_queue):  # pragma: no cover
+        while True:
+            self.decode_message(raw_queue.get())
+
+    def start_decoder(self):
+        if not self.decoder_threads:
+            for name, raw_queue in (
+                ("decoder", self.raw_queue),
+                ("action-decoder", self.raw_action_queue),
+            ):
+                decoder_thread = threading.Thread(
+                    target=self.decode_messages,
+                    args=(raw_queue,),
+                    name=name,
+                    daemon=True,
                 )
-            # schedule_mirroring should be abstracted out
-            events += self.prom.runtime_callable(monitor.schedule_mirroring)
-            found_work, schedule_func = self.prom.runtime_callable(
-                partial(self.get_q_item, self.job_queue)
+                decoder_thread.start()
+                self.decoder_threads.append(decoder_thread)
+
+    def loop_timeout(self, monitor):
+        timeout = self.max_loop_wait
+        idle_seconds = monitor.schedule.idle_seconds
+        if idle_seconds is not None:
+            timeout = min(max(idle_seconds, 0), timeout)
+        next_due = self.job_queue.next_due()
+        if next_due is not None:
+            timeout = min(max(next_due - time.time(), 0), timeout)
+        return timeout
+
+    def wait_for_work(self, monitor):
+        """block until work is queued or the next scheduled job is due."""
+        self.wakeup.wait(self.loop_timeout(monitor))
+        return self.wakeup.clear()
+
+    def coalesce_job(self, job):
+        self.logger.debug("{0} already queued, coalescing".format(job_name(job)))
+        self.prom.prom_metrics["jobs_coalesced"].labels(job=job_name(job)).inc()
+
+    def handle_jobs(self):
+        """run jobs that are due, until the batch time budget runs out."""
+        events = 0
+        deadline = time.monotonic() + self.batch_time_budget
+        while True:
+            now = time.time()
+            item = self.job_queue.get_due(now)
+            if item is None:
+                break
+            due_time, job = item
+            self.prom.prom_metrics["job_lag_secs"].labels(job=job_name(job)).observe(
+                max(now - due_time, 0)
             )
-            if found_work and callable(schedule_func):
-                events += self.prom.runtime_callable(schedule_func)
-            if events:
-                self.prom.update_endpoint_metadata(self.sdnc.endpoints)
-            time.sleep(1)
+            if callable(job):
+                events += self.prom.runtime_callable(job)
+            if time.monotonic() >= deadline:
+                break
+        return events
+
+    def process_once(self, monitor):
+        monitor.schedule.run_pending()
+        events, faucet_event, remove_list = self.prom.runtime_callable(
+            self.handle_rabbit
+        )
+        if remove_list:
+            for endpoint_name in remove_list:
+                if endpoint_name in self.sdnc.endpoints:
+                    del self.sdnc.endpoints[endpoint_name]
+        if faucet_event:
+            self.prom.runtime_callable(partial(self.sdnc.check_endpoints, faucet_event))
+        # schedule_mirroring should be abstracted out
+        events += self.prom.runtime_callable(monitor.schedule_mirroring)
+        self.ack_pending()
+        events += self.handle_jobs()
+        self.sdnc.actions.handle_completions(self.sdnc.endpoints)
+        events += self.sdnc.handle_rdns_results()
+        next_due = self.job_queue.next_due()
+        jobs_due = next_due is not None and next_due <= time.time()
+        if jobs_due or not (self.action_queue.empty() and self.m_queue.empty()):
+            # batch limits left work behind, so come straight back for it.
+            self.wakeup.set()
+        return events
+
+    def observe_loop_latency(self, set_time):
+        if set_time is not None:
+            self.prom.prom_metrics["event_loop_latency_secs"].observe(
+                time.time() - set_time
+            )
+
+    def process(self, monitor):
+        while True:
+            set_time = self.wait_for_work(monitor)
+            self.process_once(monitor)
+            self.observe_loop_latency(set_time)
+
+    async def process_async(self, monitor):
+        """
+        asyncio version of process(). Endpoint processing runs on a single
+        worker thread, so slow controller and collector calls never block the
+        event loop that consumes RabbitMQ and runs the timers.
+        """
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="sdne") as executor:
+            while True:
+                await self.wakeup.async_wait(self.loop_timeout(monitor))
+                set_time = self.wakeup.clear()
+                await loop.run_in_executor(executor, self.process_once, monitor)
+                self.observe_loop_latency(set_time)
 
     @staticmethod
     def get_q_item(q):
         """
         attempt to get a work item from the queue
-        m_queue -> (routing_key, body)
+        m_queue -> (routing_key, body, ack, received_time)
         a read from get_q_item should be of the form
-        (boolean,(routing_key, body))
+        (boolean,(routing_key, body, ack, received_time))
         """
         try:
             item = q.get_nowait()
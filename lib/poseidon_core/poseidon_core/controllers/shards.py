@@ -0,0 +1,202 @@
+"""
+Sharded endpoint processing. Endpoints are split across worker processes
+by endpoint hash, a router feeds each shard its share of the RabbitMQ
+messages, and a coordinator shared by all shards enforces the global
+investigation budget. A message is acked once every shard it was sent to
+has handled it, so the RabbitMQ prefetch count bounds the shard queues and
+a crashed shard's backlog is redelivered.
+"""
+
+import logging
+import multiprocessing
+import threading
+from functools import partial
+
+import httpx
+from poseidon_core.controllers.faucet.faucet import FaucetProxy
+from poseidon_core.helpers.endpoint import Endpoint
+from poseidon_core.helpers.rabbit import json_loads
+from prometheus_client.metrics_core import Metric
+from prometheus_client.parser import text_string_to_metric_families
+
+
+def shard_metrics_port(shard, port=9304):
+    """port a shard exports its own metrics on, for ShardMetricsCollector."""
+    return port + 1 + shard
+
+
+def shard_for(hash_id, shards):
+    return int(hash_id[:16], 16) % shards
+
+
+def machine_shard(machine, shards):
+    """
+    shard owning a machine. The hash ignores trunk ports, so every entry
+    for a MAC on a segment/VLAN lands on the same shard.
+    """
+    return shard_for(Endpoint.make_hash(machine), shards)
+
+
+class ShardCoordinator:
+    """
+    tracks active investigations per shard in shared memory, and mirror
+    counts per switch port. Mirrors are per switch port, but MACs on the
+    same port may belong to different shards, so shards count mirrors in
+    a shared dict and change them under one lock, which also keeps shards
+    from writing the FAUCET config at the same time.
+    """
+
+    def __init__(self, shards, ctx=multiprocessing):
+        self.active = ctx.Array("i", shards)
+        self.manager = ctx.Manager()
+        self.mirror_counts = self.manager.dict()
+        self.mirror_lock = ctx.Lock()
+
+    def __getstate__(self):
+        # shards only need the manager's dict proxy, not the manager.
+        state = self.__dict__.copy()
+        state["manager"] = None
+        return state
+
+    def claim(self, shard, active, wanted, limit):
+        """
+        record this shard's active investigations and reserve up to wanted
+        more, without the sum over all shards exceeding limit.
+        """
+        with self.active.get_lock():
+            counts = self.active.get_obj()
+            counts[shard] = active
+            granted = max(min(wanted, limit - sum(counts)), 0)
+            counts[shard] += granted
+        return granted
+
+    def total(self):
+        with self.active.get_lock():
+            return sum(self.active.get_obj())
+
+
+class ShardRouter:
+    def __init__(self, config, shard_queues, done_queue=None):
+        self.logger = logging.getLogger("shards")
+        self.config = config
+        self.shard_queues = shard_queues
+        # shards put a message's ack id here once they have handled it.
+        self.done_queue = done_queue
+        self.lock = threading.Lock()
+        # ack id: [shards still handling the message, ack]
+        self.pending = {}
+
+    def shards_for_message(self, routing_key, body):
+        shards = len(self.shard_queues)
+        if routing_key == self.config["FA_RABBIT_ROUTING_KEY"]:
+            # shards only act on L2_LEARN, so other FAUCET events are dropped here.
+            l2_learn = body.get("L2_LEARN", None)
+            if not l2_learn:
+                return []
+            machine = {
+                "tenant": "VLAN%s" % l2_learn["vid"],
+                "mac": l2_learn["eth_src"],
+                "segment": str(body["dp_name"]),
+            }
+            return [machine_shard(machine, shards)]
+        # operator actions and tool results are rare and may name any endpoint.
+        return list(range(shards))
+
+    def rabbit_callback(self, ch, method, _properties, body, q=None, rabbit=None):
+        """callback, forwards rabbit data to the shards that need it"""
+        shards = []
+        try:
+            if not (
+                method.routing_key == self.config["FA_RABBIT_ROUTING_KEY"]
+                and FaucetProxy.ignore_raw_event(body)
+            ):
+                body = json_loads(body)
+                shards = self.shards_for_message(method.routing_key, body)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            self.logger.error(
+                "Unable to route message {0}: {1}".format(method.routing_key, e)
+            )
+        if rabbit is not None:
+            ack = partial(rabbit.ack, method.delivery_tag)
+        else:
+            ack = partial(ch.basic_ack, delivery_tag=method.delivery_tag)
+        if not shards:
+            ack()
+            return
+        # delivery tags are only unique per channel.
+        ack_id = (id(ch), method.delivery_tag)
+        with self.lock:
+            self.pending[ack_id] = [len(shards), ack]
+        for shard in shards:
+            self.shard_queues[shard].put((method.routing_key, body, ack_id))
+
+    def message_done(self, ack_id):
+        """a shard has handled a message, which is acked once all of them have."""
+        with self.lock:
+            pending = self.pending[ack_id]
+            pending[0] -= 1
+            if pending[0]:
+                return
+            del self.pending[ack_id]
+        pending[1]()
+
+    def handle_done(self):  # pragma: no cover
+        while True:
+            self.message_done(self.done_queue.get())
+
+
+class ShardMetricsCollector:
+    """
+    re-exports every shard's metrics, with a shard label, so Prometheus only
+    scrapes the parent process on the usual port. A shard that cannot be
+    scraped is left out, rather than failing the whole scrape.
+    """
+
+    def __init__(self, ports, host="localhost", timeout=5):
+        self.logger = logging.getLogger("shards")
+        self.ports = ports
+        self.host = host
+        self.timeout = timeout
+
+    def collect(self):
+        families = {}
+        for shard, port in enumerate(self.ports):
+            try:
+                response = httpx.get(
+                    "http://%s:%u/metrics" % (self.host, port), timeout=self.timeout
+                )
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                self.logger.warning(
+                    "Unable to scrape shard {0} metrics: {1}".format(shard, e)
+                )
+                continue
+            for family in text_string_to_metric_families(response.text):
+                # shards export the same metric names, which must be merged.
+                merged = families.get(family.name, None)
+                if merged is None:
+                    merged = Metric(
+                        family.name, family.documentation, family.type, family.unit
+                    )
+                    families[family.name] = merged
+                merged.samples.extend(
+                    sample._replace(labels=dict(sample.labels, shard=str(shard)))
+                    for sample in family.samples
+                )
+        return list(families.values())
+
+
+def forward_shard_message(sdne, done_queue, item):
+    """queue a message from the router, reporting it done once acked."""
+    routing_key, body, ack_id = item
+    ack = partial(done_queue.put, ack_id)
+    if sdne.ignore_rabbit(routing_key, body):
+        ack()
+    else:
+        sdne.queue_message((routing_key, body, ack))
+
+
+def forward_shard_queue(sdne, shard_queue, done_queue):  # pragma: no cover
+    """pump messages from the router into a shard's main loop."""
+    while True:
+        forward_shard_message(sdne, done_queue, shard_queue.get())
@@ -3,6 +3,13 @@
 Created on 9 December 2018
 @author: Charlie Lewis
 """
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from poseidon_core.helpers.collector import Collector
 from poseidon_core.operations.volos.acls import VolosAcl
 
@@ -11,6 +18,13 @@ class Actions:
     def __init__(self, endpoint, sdnc):
         self.endpoint = endpoint
         self.sdnc = sdnc
+        # taken by the caller, so operations may run on an action worker
+        # while the main loop goes on updating the endpoint.
+        self.endpoint_data = None
+        if endpoint is not None:
+            self.endpoint_data = dict(endpoint.endpoint_data)
+        # endpoint_data fields for the main loop to set once an operation is done.
+        self.updates = {}
 
     def mirror_endpoint(self):
         """
@@ -19,13 +33,17 @@ class Actions:
         """
         status = False
         if self.sdnc:
-            endpoint_data = self.endpoint.endpoint_data
+            endpoint_data = self.endpoint_data
             if self.sdnc.mirror_mac(
                 endpoint_data["mac"], endpoint_data["segment"], endpoint_data["port"]
             ):
-                collector = Collector(self.endpoint, endpoint_data["segment"])
+                collector = Collector(
+                    self.endpoint, endpoint_data["segment"], endpoint_data=endpoint_data
+                )
                 if collector.nic:
                     status = collector.start_collector()
+                    if status and "container_id" in endpoint_data:
+                        self.updates["container_id"] = endpoint_data["container_id"]
         else:
             status = True
         return status
@@ -34,11 +52,13 @@ class Actions:
         """tell the controller to unmirror traffic"""
         status = False
         if self.sdnc:
-            endpoint_data = self.endpoint.endpoint_data
+            endpoint_data = self.endpoint_data
             if self.sdnc.unmirror_mac(
                 endpoint_data["mac"], endpoint_data["segment"], endpoint_data["port"]
             ):
-                collector = Collector(self.endpoint, endpoint_data["segment"])
+                collector = Collector(
+                    self.endpoint, endpoint_data["segment"], endpoint_data=endpoint_data
+                )
                 if collector.nic:
                     status = collector.stop_collector()
         else:
@@ -51,7 +71,7 @@ class Actions:
         """
         status = False
         if self.sdnc:
-            endpoint_data = self.endpoint.endpoint_data
+            endpoint_data = self.endpoint_data
             if self.sdnc.volos and self.sdnc.volos.enabled:
                 acl = VolosAcl(
                     self.endpoint,
@@ -119,3 +139,100 @@ class Actions:
                 force_remove_rules=force_remove_rules,
             )
         return status
+
+
+class ActionExecutor:
+    """
+    Runs controller and collector side effects on a bounded thread pool, so
+    a slow switch or collector does not stall the main loop. Operations for
+    the same endpoint run one at a time, in the order they were submitted.
+    Results come back through a completion queue, drained by the main loop,
+    which also applies any endpoint_data updates an operation made, so
+    workers never write to an endpoint. With no workers, operations run
+    inline when submitted.
+    """
+
+    def __init__(self, prom, max_workers=4, completions=None):
+        self.logger = logging.getLogger("actions")
+        self.prom = prom
+        self.executor = None
+        if max_workers:
+            self.executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="actions"
+            )
+        self.completions = completions
+        if self.completions is None:
+            self.completions = queue.Queue()
+        self.lock = threading.Lock()
+        # endpoint name -> operations waiting behind the one running for it.
+        self.waiting = {}
+
+    def _update_metric(self, metric_name, operation, update, *args):
+        # metrics only exist once Prometheus.initialize_metrics() has run.
+        metric = self.prom.prom_metrics.get(metric_name, None)
+        if metric is not None:
+            getattr(metric.labels(action=operation), update)(*args)
+
+    def submit(self, name, operation, func, updates=None):
+        self._update_metric("actions_in_flight", operation, "inc")
+        work = (operation, func, updates)
+        if self.executor is None:
+            self._run(name, work)
+            return
+        with self.lock:
+            waiting = self.waiting.get(name, None)
+            if waiting is not None:
+                waiting.append(work)
+                return
+            self.waiting[name] = deque()
+        self.executor.submit(self._run_ordered, name, work)
+
+    def _run(self, name, work):
+        operation, func, updates = work
+        start_time = time.monotonic()
+        try:
+            status = func()
+        except Exception as e:  # pragma: no cover
+            self.logger.error(
+                "{0} of endpoint {1} failed: {2}".format(operation, name, str(e))
+            )
+            status = False
+        self.completions.put(
+            (name, operation, status, time.monotonic() - start_time, updates)
+        )
+
+    def _run_ordered(self, name, work):
+        while work is not None:
+            self._run(name, work)
+            with self.lock:
+                waiting = self.waiting[name]
+                if waiting:
+                    work = waiting.popleft()
+                else:
+                    del self.waiting[name]
+                    work = None
+
+    def handle_completions(self, endpoints=None):
+        """report completed operations and apply their updates, from the main loop."""
+        events = 0
+        while True:
+            try:
+                name, operation, status, runtime, updates = (
+                    self.completions.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if updates and endpoints is not None:
+                endpoint = endpoints.get(name, None)
+                if endpoint is not None:
+                    endpoint.endpoint_data.update(updates)
+                    endpoint.mark_dirty()
+            self._update_metric("actions_in_flight", operation, "dec")
+            self._update_metric("action_runtime_secs", operation, "observe", runtime)
+            if not status:
+                self._update_metric("actions_failed", operation, "inc")
+                self.logger.warning(
+                    "Unable to {0} the endpoint: {1}".format(operation, name)
+                )
+            events += 1
+        return events
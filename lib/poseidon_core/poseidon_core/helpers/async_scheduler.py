@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio timers standing in for the parts of schedule.Scheduler that
+Monitor uses.
+"""
+import asyncio
+from functools import partial
+
+
+class AsyncJob:
+    def __init__(self, scheduler, interval):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.job_func = None
+
+    @property
+    def seconds(self):
+        return self
+
+    def do(self, job_func, *args, **kwargs):
+        self.job_func = partial(job_func, *args, **kwargs)
+        self.scheduler.tasks.append(asyncio.get_running_loop().create_task(self.run()))
+        return self
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.job_func()
+
+
+class AsyncScheduler:
+    """Runs each job from its own timer task on the event loop."""
+
+    # timers wake the main loop themselves, so it never needs to wait on us.
+    idle_seconds = None
+
+    def __init__(self):
+        self.tasks = []
+
+    def every(self, interval=1):
+        return AsyncJob(self, interval)
+
+    def run_pending(self):
+        return
+
+    def clear(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
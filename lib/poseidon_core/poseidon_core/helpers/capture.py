@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Compact on-disk log of RabbitMQ messages, so production traffic can be
+replayed offline. Each record is a fixed header (timestamp, routing key
+length, body length) followed by the routing key and the undecoded body.
+"""
+import struct
+import threading
+
+RECORD_HEADER = struct.Struct("!dHI")
+
+
+class CaptureWriter:
+    """appends messages to a capture log, from any consumer thread."""
+
+    def __init__(self, path, flush_interval=1):
+        self.lock = threading.Lock()
+        self.capture_file = open(path, "ab")
+        self.flush_interval = flush_interval
+        self.flush_time = 0
+
+    def write(self, timestamp, routing_key, body):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        routing_key = routing_key.encode("utf-8")
+        record = (
+            RECORD_HEADER.pack(timestamp, len(routing_key), len(body))
+            + routing_key
+            + body
+        )
+        with self.lock:
+            self.capture_file.write(record)
+            if timestamp - self.flush_time > self.flush_interval:
+                self.capture_file.flush()
+                self.flush_time = timestamp
+
+    def close(self):
+        with self.lock:
+            self.capture_file.close()
+
+
+def read_capture(path):
+    """yield (timestamp, routing_key, body) records, ignoring a truncated last record."""
+    with open(path, "rb") as capture_file:
+        while True:
+            header = capture_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, key_len, body_len = RECORD_HEADER.unpack(header)
+            routing_key = capture_file.read(key_len)
+            body = capture_file.read(body_len)
+            if len(routing_key) < key_len or len(body) < body_len:
+                return
+            yield (timestamp, routing_key.decode("utf-8"), body)
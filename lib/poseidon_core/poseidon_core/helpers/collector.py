@@ -12,12 +12,16 @@ from poseidon_core.helpers.config import Config
 
 
 class Collector(object):
-    def __init__(self, endpoint, switch, iterations=1):
+    def __init__(self, endpoint, switch, iterations=1, endpoint_data=None):
         self.logger = logging.getLogger("collector")
         self.config = Config().get_config()
         self.endpoint = endpoint
+        # on an action worker, a copy of endpoint_data the main loop won't touch.
+        if endpoint_data is None:
+            endpoint_data = endpoint.endpoint_data
+        self.endpoint_data = endpoint_data
         self.id = endpoint.name
-        self.mac = endpoint.endpoint_data["mac"]
+        self.mac = endpoint_data["mac"]
         self.nic = None
         nic = self.config["collector_nic"]
         try:
@@ -45,7 +49,7 @@ class Collector(object):
             "interval": self.interval,
             "filter": "'ether host {0}'".format(self.mac),
             "iters": self.iterations,
-            "metadata": "{'endpoint_data': " + str(self.endpoint.endpoint_data) + "}",
+            "metadata": "{'endpoint_data': " + str(self.endpoint_data) + "}",
         }
 
         self.logger.debug("Payload: {0}".format(str(payload)))
@@ -64,7 +68,7 @@ class Collector(object):
                 self.logger.info(
                     "Successfully started the collector for: {0}".format(self.id)
                 )
-                self.endpoint.endpoint_data["container_id"] = (
+                self.endpoint_data["container_id"] = (
                     response[1].rsplit(":", 1)[-1].strip()
                 )
                 status = True
@@ -81,13 +85,13 @@ class Collector(object):
         Stops collector for a given endpoint.
         """
         status = False
-        if "container_id" not in self.endpoint.endpoint_data:
+        if "container_id" not in self.endpoint_data:
             self.logger.warning(
                 "No collector to stop because no container_id for endpoint"
             )
             return True
 
-        payload = {"id": [self.endpoint.endpoint_data["container_id"]]}
+        payload = {"id": [self.endpoint_data["container_id"]]}
         self.logger.debug("Payload: {0}".format(str(payload)))
 
         network_tap_addr = (
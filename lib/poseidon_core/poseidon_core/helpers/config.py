@@ -35,9 +35,27 @@ class Config:
             "MIRROR_PORTS": None,
             "AUTOMATED_ACLS": False,
             "LEARN_PUBLIC_ADDRESSES": False,
+            "incremental_discovery": True,
             "reinvestigation_frequency": 900,
+            "coprocessing_frequency": 900,
             "max_concurrent_reinvestigations": 2,
             "max_concurrent_coprocessing": 2,
+            "runtime": "threaded",
+            "shards": 1,
+            "max_loop_wait": 10,
+            "capture_file": "",
+            "action_workers": 4,
+            "rdns_ttl": 3600,
+            "rdns_negative_ttl": 300,
+            "rdns_timeout": 5,
+            "rdns_workers": 8,
+            "max_batch_size": 1000,
+            "max_queue_size": 10000,
+            "overload_policy": "block",
+            "rabbit_prefetch_count": 1000,
+            "rabbit_ack_batch_size": 100,
+            "rabbit_ack_interval_ms": 100,
+            "batch_time_budget": 0.5,
             "logger_level": "INFO",
             "faucetconfrpc_address": "faucetconfrpc:59999",
             "faucetconfrpc_client": "faucetconfrpc",
@@ -58,14 +76,28 @@ class Config:
             "tunnel_vlan": ("tunnel_vlan", [int]),
             "tunnel_name": ("tunnel_name", []),
             "automated_acls": ("AUTOMATED_ACLS", [util.strtobool]),
+            "incremental_discovery": ("incremental_discovery", [util.strtobool]),
             "FA_RABBIT_PORT": ("FA_RABBIT_PORT", [int]),
-            "scan_frequency": ("scan_frequency", [int]),
             "reinvestigation_frequency": ("reinvestigation_frequency", [int]),
             "max_concurrent_reinvestigations": (
                 "max_concurrent_reinvestigations",
                 [int],
             ),
+            "coprocessing_frequency": ("coprocessing_frequency", [int]),
             "max_concurrent_coprocessing": ("max_concurrent_coprocessing", [int]),
+            "max_loop_wait": ("max_loop_wait", [float]),
+            "shards": ("shards", [int]),
+            "action_workers": ("action_workers", [int]),
+            "rdns_ttl": ("rdns_ttl", [int]),
+            "rdns_negative_ttl": ("rdns_negative_ttl", [int]),
+            "rdns_timeout": ("rdns_timeout", [float]),
+            "rdns_workers": ("rdns_workers", [int]),
+            "max_batch_size": ("max_batch_size", [int]),
+            "max_queue_size": ("max_queue_size", [int]),
+            "rabbit_prefetch_count": ("rabbit_prefetch_count", [int]),
+            "rabbit_ack_batch_size": ("rabbit_ack_batch_size", [int]),
+            "rabbit_ack_interval_ms": ("rabbit_ack_interval_ms", [int]),
+            "batch_time_budget": ("batch_time_budget", [float]),
             "ignore_vlans": ("ignore_vlans", [json.loads]),
             "ignore_ports": ("ignore_ports", [json.loads]),
             "trunk_ports": ("trunk_ports", [json.loads]),
@@ -5,6 +5,7 @@ Created on 3 December 2018
 """
 import hashlib
 import json
+import math
 import time
 
 from poseidon_core.constants import NO_DATA
@@ -35,6 +36,37 @@ def endpoint_copro_transit_wrap(trigger, source, dest):
 
 
 class Endpoint:
+    """
+    an endpoint and its investigation and coprocessing states. Endpoints
+    are numerous, so they use __slots__ and share one state machine per
+    state attribute (see endpoint_factory()).
+    """
+
+    __slots__ = (
+        "store",
+        "name",
+        "_ignore",
+        "_copro_ignore",
+        "_endpoint_data",
+        "p_next_state",
+        "p_prev_state",
+        "p_next_copro_state",
+        "p_prev_copro_state",
+        "acl_data",
+        "metadata",
+        "_state",
+        "_copro_state",
+        "state_time",
+        "copro_state_time",
+        "observed_time",
+        "dirty",
+        "timers",
+    )
+
+    # shared transitions.Machine for state and copro_state, set below.
+    machine = None
+    copro_machine = None
+
     states = ["known", "unknown", "operating", "queued"]
 
     transitions = [
@@ -87,6 +119,8 @@ class Endpoint:
     ]
 
     def __init__(self, hashed_val):
+        # EndpointStore indexing this endpoint, if any.
+        self.store = None
         self.name = hashed_val.strip()
         self.ignore = False
         self.copro_ignore = False
@@ -102,12 +136,76 @@ class Endpoint:
         self.state_time = 0
         self.copro_state_time = 0
         self.observed_time = 0
+        # set when anything exported to Prometheus changes.
+        self.dirty = True
+        # EndpointTimers tracking this endpoint's timeouts, if any.
+        self.timers = None
+
+    def _reindex(self):
+        if self.store is not None:
+            self.store.reindex(self)
+
+    @property
+    def endpoint_data(self):
+        return self._endpoint_data
+
+    @endpoint_data.setter
+    def endpoint_data(self, endpoint_data):
+        self._endpoint_data = endpoint_data
+        self._reindex()
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+        self._reindex()
+
+    @property
+    def copro_state(self):
+        return self._copro_state
+
+    @copro_state.setter
+    def copro_state(self, copro_state):
+        self._copro_state = copro_state
+        self._reindex()
+
+    @property
+    def ignore(self):
+        return self._ignore
+
+    @ignore.setter
+    def ignore(self, ignore):
+        self._ignore = ignore
+        self._reindex()
+
+    @property
+    def copro_ignore(self):
+        return self._copro_ignore
+
+    @copro_ignore.setter
+    def copro_ignore(self, copro_ignore):
+        self._copro_ignore = copro_ignore
+        self._reindex()
+
+    def _schedule_timers(self):
+        if self.timers is not None:
+            self.timers.schedule(self)
 
     def _update_state_time(self, *args, **kwargs):
         self.state_time = time.time()
+        self.dirty = True
+        self._schedule_timers()
 
     def _update_copro_state_time(self, *args, **kwargs):
         self.copro_state_time = time.time()
+        self.dirty = True
+        self._schedule_timers()
+
+    def mark_dirty(self):
+        self.dirty = True
 
     def encode(self):
         endpoint_d = {
@@ -159,24 +257,40 @@ class Endpoint:
                         return ip_metadata["short_os"]
         return NO_DATA
 
-    def touch(self):
-        self.observed_time = time.time()
+    def touch(self, now=None):
+        if now is None:
+            now = time.time()
+        self.observed_time = now
+        self._schedule_timers()
 
     def observed_timeout(self, timeout):
         return time.time() - self.observed_time > timeout
 
+    def observed_deadline(self, timeout):
+        """time after which observed_timeout(timeout) is true."""
+        return self.observed_time + timeout
+
     def state_age(self):
         return int(time.time()) - self.state_time
 
     def state_timeout(self, timeout):
         return self.state_age() > timeout
 
+    def state_deadline(self, timeout):
+        """time after which state_timeout(timeout) is true."""
+        # state_age() counts whole seconds.
+        return math.floor(self.state_time + timeout) + 1
+
     def copro_state_age(self):
         return int(time.time()) - self.copro_state_time
 
     def copro_state_timeout(self, timeout):
         return self.copro_state_age() > timeout
 
+    def copro_state_deadline(self, timeout):
+        """time after which copro_state_timeout(timeout) is true."""
+        return math.floor(self.copro_state_time + timeout) + 1
+
     def queue_next(self, next_state):
         self.p_next_state = next_state
         self.queue()  # pytype: disable=attribute-error
@@ -188,6 +302,7 @@ class Endpoint:
 
     def trigger_next(self):
         self.p_prev_state = self.state
+        self.dirty = True
         if self.p_next_state:
             self.machine_trigger(self.p_next_state)
             self.p_next_state = None
@@ -243,28 +358,46 @@ class Endpoint:
         return post_h
 
 
+def _machine_trigger(machine_attr, trigger):
+    def trigger_method(self):
+        return getattr(self, machine_attr).events[trigger].trigger(self)
+
+    trigger_method.__name__ = trigger
+    return trigger_method
+
+
+# The machines hold no models: triggers pass the endpoint to Event.trigger(),
+# so each endpoint costs only its slots and is not kept alive by the machine.
+Endpoint.machine = Machine(
+    model=None,
+    model_attribute="state",
+    states=Endpoint.states,
+    transitions=Endpoint.transitions,
+    initial="unknown",
+    send_event=True,
+)
+Endpoint.machine.name = "endpoint "
+Endpoint.copro_machine = Machine(
+    model=None,
+    model_attribute="copro_state",
+    states=Endpoint.copro_states,
+    transitions=Endpoint.copro_transitions,
+    initial="copro_unknown",
+    send_event=True,
+)
+Endpoint.copro_machine.name = "endpoint_copro "
+for _machine_attr, _transitions in (
+    ("machine", Endpoint.transitions),
+    ("copro_machine", Endpoint.copro_transitions),
+):
+    for _trigger in sorted({transition["trigger"] for transition in _transitions}):
+        setattr(Endpoint, _trigger, _machine_trigger(_machine_attr, _trigger))
+
+
 def endpoint_factory(hashed_val):
     endpoint = Endpoint(hashed_val)
-    machine = Machine(
-        model=endpoint,
-        model_attribute="state",
-        states=Endpoint.states,
-        transitions=Endpoint.transitions,
-        initial="unknown",
-        send_event=True,
-    )
-    machine.name = endpoint.name[:8] + " "
-    endpoint.machine = machine
-    copro_machine = Machine(
-        model=endpoint,
-        model_attribute="copro_state",
-        states=Endpoint.copro_states,
-        transitions=Endpoint.copro_transitions,
-        initial="copro_unknown",
-        send_event=True,
-    )
-    copro_machine.name = endpoint.name[:8] + "_copro"
-    endpoint.copro_machine = copro_machine
+    endpoint.state = Endpoint.machine.initial
+    endpoint.copro_state = Endpoint.copro_machine.initial
     return endpoint
 
 
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Endpoints by name, with secondary indexes so lookups by MAC, IP, state
+and ignore flags do not scan every endpoint.
+"""
+
+
+class EndpointStore(dict):
+    """
+    dict of endpoints by name, indexed by MAC, IP, state, copro_state and
+    ignore flags. Endpoints reindex themselves when their endpoint_data,
+    state or ignore flags are assigned (see Endpoint.store), so the size of
+    an index is a count that is always up to date.
+    """
+
+    def __init__(self, endpoints=None):
+        super().__init__()
+        self.index = {}
+        self.endpoint_keys = {}
+        if endpoints:
+            for name, endpoint in endpoints.items():
+                self[name] = endpoint
+
+    @staticmethod
+    def index_keys(endpoint):
+        keys = {
+            ("ignore", endpoint.ignore),
+            ("copro_ignore", endpoint.copro_ignore),
+            ("state", endpoint.ignore, endpoint.state),
+            ("copro_state", endpoint.copro_ignore, endpoint.copro_state),
+            # coprocessing budgets count endpoints that are not ignored.
+            ("ignore_copro_state", endpoint.ignore, endpoint.copro_state),
+        }
+        endpoint_data = endpoint.endpoint_data
+        if endpoint_data:
+            keys.add(("mac", endpoint_data.get("mac", None)))
+            for ip_field in ("ipv4", "ipv6"):
+                ip = endpoint_data.get(ip_field, None)
+                if ip:
+                    keys.add(("ip", ip))
+        return frozenset(keys)
+
+    def _unindex(self, name, keys):
+        for key in keys:
+            indexed = self.index[key]
+            del indexed[name]
+            if not indexed:
+                del self.index[key]
+
+    def reindex(self, endpoint):
+        name = endpoint.name
+        old_keys = self.endpoint_keys.get(name, frozenset())
+        new_keys = self.index_keys(endpoint)
+        if old_keys == new_keys:
+            return
+        self._unindex(name, old_keys - new_keys)
+        for key in new_keys - old_keys:
+            self.index.setdefault(key, {})[name] = endpoint
+        self.endpoint_keys[name] = new_keys
+
+    def __setitem__(self, name, endpoint):
+        if name in self:
+            del self[name]
+        super().__setitem__(name, endpoint)
+        endpoint.store = self
+        self.reindex(endpoint)
+
+    def __delitem__(self, name):
+        endpoint = self[name]
+        super().__delitem__(name)
+        self._unindex(name, self.endpoint_keys.pop(name, frozenset()))
+        if endpoint.store is self:
+            endpoint.store = None
+
+    def pop(self, name, *default):
+        if name not in self:
+            return super().pop(name, *default)
+        endpoint = self[name]
+        del self[name]
+        return endpoint
+
+    def clear(self):
+        for name in list(self):
+            del self[name]
+
+    def update(self, *args, **kwargs):
+        for name, endpoint in dict(*args, **kwargs).items():
+            self[name] = endpoint
+
+    def setdefault(self, name, endpoint=None):
+        if name not in self:
+            self[name] = endpoint
+        return self[name]
+
+    def unindexed(self):
+        """
+        names of endpoints whose indexes are out of date, because their
+        indexed attributes changed without being assigned. Slow, for
+        debugging.
+        """
+        expected = {}
+        for name, endpoint in self.items():
+            for key in self.index_keys(endpoint):
+                expected.setdefault(key, set()).add(name)
+        names = set()
+        for key in expected.keys() | self.index.keys():
+            names.update(expected.get(key, set()) ^ self.index.get(key, {}).keys())
+        return sorted(names)
+
+    def lookup(self, *key):
+        """endpoints with the given index key, as a list."""
+        return list(self.index.get(key, {}).values())
+
+    def count(self, *key):
+        return len(self.index.get(key, ()))
+
+    def by_mac(self, mac):
+        return self.lookup("mac", mac)
+
+    def by_ip(self, ip):
+        return self.lookup("ip", ip)
+
+    def not_ignored(self, state=None):
+        if state:
+            return self.lookup("state", False, state)
+        return self.lookup("ignore", False)
+
+    def not_copro_ignored(self, copro_state=None):
+        if copro_state:
+            return self.lookup("copro_state", False, copro_state)
+        return self.lookup("copro_ignore", False)
+
+    def count_active(self):
+        """number of endpoints, not ignored, being investigated."""
+        return self.count("state", False, "operating")
+
+    def count_coprocessing(self):
+        """number of endpoints, not ignored, being coprocessed."""
+        return self.count("ignore_copro_state", False, "copro_coprocessing")
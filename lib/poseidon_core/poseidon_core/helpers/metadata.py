@@ -3,46 +3,278 @@
 Created on 19 February 2019
 @author: Charlie Lewis
 """
-import functools
+import os
 import socket
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
 from poseidon_core.constants import NO_DATA
 
 
-@functools.lru_cache()
+class OUIIndex:
+    """
+    vendors by MAC prefix, loaded from an nmap-mac-prefixes style file of
+    hex prefixes and vendor names. Prefixes may be longer than an OUI (for
+    MA-M and MA-S assignments), and the longest matching prefix wins. The
+    file is reloaded when it changes, checked at most every check_interval
+    seconds.
+    """
+
+    def __init__(self, lookup_path, check_interval=60):
+        self.lookup_path = lookup_path
+        self.check_interval = check_interval
+        self.check_time = None
+        self.file_id = None
+        self.vendors = {}
+        self.prefix_lens = ()
+
+    def _file_id(self):
+        try:
+            stat = os.stat(self.lookup_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load(self):
+        vendors = {}
+        with open(self.lookup_path, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 2 or line.startswith("#"):
+                    continue
+                prefix = fields[0].upper()
+                # the first file entry for a prefix wins.
+                vendors.setdefault(prefix, fields[1].strip())
+        self.vendors = vendors
+        self.prefix_lens = tuple(
+            sorted({len(prefix) for prefix in vendors}, reverse=True)
+        )
+
+    def check(self, now):
+        if self.check_time is not None and now - self.check_time < self.check_interval:
+            return
+        self.check_time = now
+        file_id = self._file_id()
+        if file_id != self.file_id:
+            self.file_id = file_id
+            try:
+                self.load()
+            except OSError:
+                self.file_id = None
+
+    def lookup(self, mac):
+        self.check(time.monotonic())
+        if not self.file_id:
+            return NO_DATA
+        mac = "".join(mac.split(":")).upper()
+        for prefix_len in self.prefix_lens:
+            vendor = self.vendors.get(mac[:prefix_len], None)
+            if vendor is not None:
+                return vendor
+        return None
+
+
+OUI_INDEXES = {}
+
+
 def get_ether_vendor(mac, lookup_path):
     """
     Takes a MAC address and looks up and returns the vendor for it.
     """
-    mac = "".join(mac.split(":"))[:6].upper()
-    try:
-        with open(lookup_path, "r") as f:
-            for line in f:
-                if line.startswith(mac):
-                    return line.split()[1].strip()
-    except Exception:  # pragma: no cover
-        return NO_DATA
+    oui_index = OUI_INDEXES.get(lookup_path, None)
+    if oui_index is None:
+        oui_index = OUI_INDEXES.setdefault(lookup_path, OUIIndex(lookup_path))
+    return oui_index.lookup(mac)
 
 
 class DNSResolver:
+    """
+    long lived reverse DNS resolver, with lookups on a bounded thread pool.
+    Results are cached for ttl seconds, and lookups that find no name (no
+    PTR record) for negative_ttl. Transient failures are retried after a
+    short backoff, and other failures are not cached, so they are looked up
+    again next time. resolve_ips() waits at most timeout seconds, and
+    expire() reports lookups for resolve_ip_async() still running after
+    timeout seconds. Either way a lookup still running is reported as
+    NO_DATA but cached when it completes, for the next call.
+    """
+
     TIMEOUT = 5
 
+    def __init__(
+        self,
+        prom=None,
+        ttl=3600,
+        negative_ttl=300,
+        timeout=TIMEOUT,
+        max_workers=8,
+        max_entries=100000,
+        retries=2,
+        retry_backoff=0.1,
+    ):
+        self.prom = prom
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.pending = {}
+        # ip -> [(deadline, callback)] for resolve_ip_async() lookups.
+        self.waiters = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="rdns"
+        )
+
     @staticmethod
     def _resolve_ip(ip):
+        """
+        name for ip, or NO_DATA if it has none. Lookups that may succeed
+        if tried again raise, e.g. gaierror with EAI_AGAIN or a timeout.
+        """
         try:
             result = socket.getnameinfo((ip, 0), 0)[0]
-            if result == ip:
+        except socket.gaierror as e:
+            if e.errno == socket.EAI_NONAME:
                 return NO_DATA
-            return result
-        except socket.gaierror:
+            raise
+        except ValueError:  # e.g. an unencodable name, which never resolves.
+            return NO_DATA
+        if result == ip:
             return NO_DATA
+        return result
 
-    def resolve_ips(self, ips):
-        with ThreadPoolExecutor() as executor:
-            return {
-                ip: result
-                for ip, result in zip(
-                    ips, executor.map(DNSResolver()._resolve_ip, list(ips))
+    def _update_metric(self, metric_name, update, *args, **labels):
+        # metrics only exist once Prometheus.initialize_metrics() has run.
+        if self.prom is None:
+            return
+        metric = self.prom.prom_metrics.get(metric_name, None)
+        if metric is not None:
+            if labels:
+                metric = metric.labels(**labels)
+            getattr(metric, update)(*args)
+
+    def _cache_result(self, ip, result):
+        ttl = self.negative_ttl if result == NO_DATA else self.ttl
+        # dicts keep insertion order, so the oldest entries are evicted first.
+        self.cache.pop(ip, None)
+        self.cache[ip] = (result, time.monotonic() + ttl)
+        while len(self.cache) > self.max_entries:
+            del self.cache[next(iter(self.cache))]
+
+    def _lookup(self, ip):
+        start_time = time.perf_counter()
+        result = NO_DATA
+        resolved = False
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+                try:
+                    result = self._resolve_ip(ip)
+                    resolved = True
+                    break
+                except socket.gaierror as e:
+                    if e.errno != socket.EAI_AGAIN:
+                        break
+            self._update_metric(
+                "rdns_lookup_secs", "observe", time.perf_counter() - start_time
+            )
+        finally:
+            # a lookup left pending would never be retried.
+            with self.lock:
+                if resolved:
+                    self._cache_result(ip, result)
+                del self.pending[ip]
+                waiters = self.waiters.pop(ip, [])
+            for _deadline, callback in waiters:
+                callback(ip, result)
+        return result
+
+    def cached(self, ip):
+        """cached result for ip, or None if not cached or expired."""
+        entry = self.cache.get(ip, None)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def submit(self, ip):
+        """start looking up ip, unless already in progress, returning a future."""
+        with self.lock:
+            future = self.pending.get(ip, None)
+            if future is None:
+                future = self.executor.submit(self._lookup, ip)
+                self.pending[ip] = future
+        return future
+
+    def lookup_cache(self, ip):
+        """cached result for ip, or None, counting cache hits and misses."""
+        result = self.cached(ip)
+        if result is None:
+            cache_result = "miss"
+        elif result == NO_DATA:
+            cache_result = "negative_hit"
+        else:
+            cache_result = "hit"
+        self._update_metric("rdns_cache", "inc", result=cache_result)
+        return result
+
+    def resolve_ip_async(self, ip, callback):
+        """
+        cached result for ip, or None after starting a lookup that calls
+        callback(ip, result) from a resolver thread when it completes, or
+        callback(ip, NO_DATA) from expire() if that takes over timeout seconds.
+        """
+        result = self.lookup_cache(ip)
+        if result is None:
+            with self.lock:
+                self.waiters.setdefault(ip, []).append(
+                    (time.monotonic() + self.timeout, callback)
                 )
-            }
+            self.submit(ip)
+        return result
+
+    def expire(self, now=None):
+        """report resolve_ip_async() lookups over their timeout as NO_DATA."""
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        with self.lock:
+            for ip, waiters in list(self.waiters.items()):
+                live = []
+                for deadline, callback in waiters:
+                    if deadline <= now:
+                        expired.append((ip, callback))
+                    else:
+                        live.append((deadline, callback))
+                if live:
+                    self.waiters[ip] = live
+                else:
+                    del self.waiters[ip]
+        for ip, callback in expired:
+            self._update_metric("rdns_cache", "inc", result="timeout")
+            callback(ip, NO_DATA)
+        return len(expired)
+
+    def resolve_ips(self, ips):
+        results = {}
+        futures = {}
+        for ip in ips:
+            result = self.lookup_cache(ip)
+            if result is None:
+                futures[ip] = self.submit(ip)
+            else:
+                results[ip] = result
+        if futures:
+            wait(futures.values(), timeout=self.timeout)
+            for ip, future in futures.items():
+                if future.done():
+                    results[ip] = NO_DATA if future.exception() else future.result()
+                else:
+                    self._update_metric("rdns_cache", "inc", result="timeout")
+                    results[ip] = NO_DATA
+        return results
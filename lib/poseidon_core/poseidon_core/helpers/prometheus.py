@@ -7,6 +7,7 @@ import datetime
 import ipaddress
 import logging
 import re
+import threading
 import time
 from collections import defaultdict
 
@@ -18,15 +19,377 @@ from poseidon_core.helpers.endpoint import Endpoint
 from poseidon_core.helpers.endpoint import EndpointDecoder
 from prometheus_client import Counter
 from prometheus_client import Gauge
+from prometheus_client import Histogram
 from prometheus_client import Info
+from prometheus_client import REGISTRY
 from prometheus_client import start_http_server
 from prometheus_client import Summary
+from prometheus_client.core import GaugeMetricFamily
+
+
+ENDPOINT_LABELS = ["mac", "tenant", "segment", "ether_vendor", "name", "port"]
+ROLE_LABELS = [
+    "mac",
+    "name",
+    "role",
+    "pcap_labels",
+    "ipv4_os",
+    "ipv4_address",
+    "ipv6_address",
+    "hash_id",
+]
+
+# key: (metric name, documentation, labels), exported by EndpointCollector.
+ENDPOINT_METRICS = {
+    "ipv4_table": (
+        "poseidon_endpoint_ip_table",
+        "IP Table",
+        ["mac", "tenant", "segment", "port", "role", "ipv4_os", "hash_id"],
+    ),
+    "roles": ("poseidon_endpoint_roles", "Number of endpoints by role", ["role"]),
+    "oses": ("poseidon_endpoint_oses", "Number of endpoints by OS", ["ipv4_os"]),
+    "current_states": (
+        "poseidon_endpoint_current_states",
+        "Number of endpoints by current state",
+        ["current_state"],
+    ),
+    "vlans": ("poseidon_endpoint_vlans", "Number of endpoints by VLAN", ["tenant"]),
+    "port_tenants": (
+        "poseidon_endpoint_port_tenants",
+        "Number of tenants by port",
+        ["port", "tenant"],
+    ),
+    "port_hosts": (
+        "poseidon_endpoint_port_hosts",
+        "Number of hosts by port",
+        ["port"],
+    ),
+    "endpoint_role_confidence_top": (
+        "poseidon_role_confidence_top",
+        "Confidence of top role prediction",
+        ROLE_LABELS,
+    ),
+    "endpoint_role_confidence_second": (
+        "poseidon_role_confidence_second",
+        "Confidence of second role prediction",
+        ROLE_LABELS,
+    ),
+    "endpoint_role_confidence_third": (
+        "poseidon_role_confidence_third",
+        "Confidence of third role prediction",
+        ROLE_LABELS,
+    ),
+    "endpoints": (
+        "poseidon_endpoints",
+        "All endpoints",
+        ENDPOINT_LABELS[:4]
+        + ["controller_type", "controller"]
+        + ENDPOINT_LABELS[4:]
+        + ["hash_id"],
+    ),
+    "endpoint_state": (
+        "poseidon_endpoint_state",
+        "State for all endpoints",
+        ENDPOINT_LABELS + ["state", "hash_id"],
+    ),
+    "endpoint_os": (
+        "poseidon_endpoint_os",
+        "Operating System for all endpoints",
+        ENDPOINT_LABELS + ["ipv4_os", "hash_id"],
+    ),
+    "endpoint_role": (
+        "poseidon_endpoint_role",
+        "Top role for all endpoints",
+        ENDPOINT_LABELS + ["top_role", "hash_id"],
+    ),
+    "endpoint_ip": (
+        "poseidon_endpoint_ip",
+        "IP Address for all endpoints",
+        ENDPOINT_LABELS
+        + [
+            "ipv4_address",
+            "ipv6_address",
+            "ipv4_subnet",
+            "ipv6_subnet",
+            "ipv4_rdns",
+            "ipv6_rdns",
+            "hash_id",
+        ],
+    ),
+    "endpoint_metadata": (
+        "poseidon_endpoint_metadata",
+        "Metadata for all endpoints",
+        [
+            "mac",
+            "tenant",
+            "segment",
+            "ether_vendor",
+            "prev_state",
+            "next_state",
+            "acls",
+            "ignore",
+            "ipv4_subnet",
+            "ipv6_subnet",
+            "ipv4_rdns",
+            "ipv6_rdns",
+            "controller_type",
+            "controller",
+            "name",
+            "state",
+            "port",
+            "top_role",
+            "ipv4_os",
+            "ipv4_address",
+            "ipv6_address",
+            "hash_id",
+        ],
+    ),
+    "exported_series": (
+        "poseidon_exported_series",
+        "Number of endpoint series exported by the last scrape",
+        ["metric"],
+    ),
+}
+
+
+class EndpointCollector:
+    """
+    exports endpoint metrics when Prometheus scrapes, rather than setting
+    gauges as endpoints change. Samples are built from a snapshot of the
+    endpoints, so removed endpoints and old label values disappear with
+    the next scrape. Each endpoint's samples are cached until it is next
+    marked dirty. Per-endpoint gauges (other than role confidences) are
+    set to the scrape time, so the most recently asserted series for an
+    endpoint is the one with the highest value.
+    """
+
+    def __init__(self, get_endpoints=None):
+        self.get_endpoints = get_endpoints
+        # scrapes may run concurrently, on the metrics server's threads.
+        self.lock = threading.Lock()
+        self.endpoint_samples = {}
+
+    @staticmethod
+    def families():
+        return {
+            key: GaugeMetricFamily(name, documentation, labels=labels)
+            for key, (name, documentation, labels) in ENDPOINT_METRICS.items()
+        }
+
+    def describe(self):
+        return list(self.families().values())
+
+    @staticmethod
+    def endpoint_host(hash_id, endpoint):
+        """summary of an endpoint, for the aggregate metrics."""
+        roles, _, _ = endpoint.get_roles_confidences_pcap_labels()
+        endpoint_data = endpoint.endpoint_data
+        return {
+            "mac": endpoint_data["mac"],
+            "id": hash_id,
+            "role": roles[0],
+            "ipv4_os": endpoint.get_ipv4_os(),
+            "state": endpoint.state,
+            "tenant": endpoint_data["tenant"],
+            "port": endpoint_data["port"],
+            "segment": endpoint_data["segment"],
+            "ipv4": endpoint_data["ipv4"],
+        }
+
+    @staticmethod
+    def endpoint_samples_for(hash_id, endpoint):
+        """(metric key, labels, value) for an endpoint, value None for scrape time."""
+        endpoint_data = endpoint.endpoint_data
+        ipv4 = endpoint_data["ipv4"]
+        ipv6 = endpoint_data["ipv6"]
+        ipv4_subnet = endpoint_data["ipv4_subnet"]
+        ipv6_subnet = endpoint_data["ipv6_subnet"]
+        ipv4_rdns = endpoint_data["ipv4_rdns"]
+        ipv6_rdns = endpoint_data["ipv6_rdns"]
+        controller = endpoint_data["controller"]
+        controller_type = endpoint_data["controller_type"]
+        mac = endpoint_data["mac"]
+        name = endpoint_data["name"]
+        roles, confidences, pcap_labels = endpoint.get_roles_confidences_pcap_labels()
+        top_role = roles[0]
+        ipv4_os = endpoint.get_ipv4_os()
+        endpoint_labels = [
+            mac,
+            endpoint_data["tenant"],
+            endpoint_data["segment"],
+            endpoint_data["ether_vendor"],
+            name,
+            endpoint_data["port"],
+        ]
+        samples = [
+            (key, [mac, name, role, pcap_labels, ipv4_os, ipv4, ipv6, hash_id], conf)
+            for key, role, conf in zip(
+                (
+                    "endpoint_role_confidence_top",
+                    "endpoint_role_confidence_second",
+                    "endpoint_role_confidence_third",
+                ),
+                roles,
+                confidences,
+            )
+        ]
+        samples.extend(
+            [
+                (
+                    "endpoints",
+                    endpoint_labels[:4]
+                    + [controller_type, controller]
+                    + endpoint_labels[4:]
+                    + [hash_id],
+                    None,
+                ),
+                ("endpoint_state", endpoint_labels + [endpoint.state, hash_id], None),
+                ("endpoint_os", endpoint_labels + [ipv4_os, hash_id], None),
+                ("endpoint_role", endpoint_labels + [top_role, hash_id], None),
+                (
+                    "endpoint_ip",
+                    endpoint_labels
+                    + [
+                        ipv4,
+                        ipv6,
+                        ipv4_subnet,
+                        ipv6_subnet,
+                        ipv4_rdns,
+                        ipv6_rdns,
+                        hash_id,
+                    ],
+                    None,
+                ),
+                (
+                    "endpoint_metadata",
+                    endpoint_labels[:4]
+                    + [
+                        endpoint.p_prev_state,
+                        endpoint.p_next_state,
+                        endpoint.acl_data,
+                        endpoint.ignore,
+                        ipv4_subnet,
+                        ipv6_subnet,
+                        ipv4_rdns,
+                        ipv6_rdns,
+                        controller_type,
+                        controller,
+                        name,
+                        endpoint.state,
+                        endpoint_data["port"],
+                        top_role,
+                        ipv4_os,
+                        ipv4,
+                        ipv6,
+                        hash_id,
+                    ],
+                    None,
+                ),
+            ]
+        )
+        converted = []
+        for key, labels, value in samples:
+            if value is not None:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    # NO_DATA for a missing confidence, which cannot be exported.
+                    continue
+            converted.append((key, [str(label) for label in labels], value))
+        return converted
+
+    @staticmethod
+    def host_samples(hosts):
+        """(metric key, labels, value) aggregated over hosts from endpoint_host()."""
+        counts = defaultdict(int)
+        samples = []
+        for host in hosts:
+            counts[("roles", host["role"])] += 1
+            counts[("oses", host["ipv4_os"])] += 1
+            counts[("vlans", host["tenant"])] += 1
+            counts[("port_hosts", host["port"])] += 1
+            counts[("port_tenants", host["port"], host["tenant"])] += 1
+            counts[("current_states", host["state"])] += 1
+            if host["ipv4"]:
+                try:
+                    ip = int(ipaddress.ip_address(host["ipv4"]))
+                except ValueError:
+                    continue
+                samples.append(
+                    (
+                        "ipv4_table",
+                        [
+                            str(host[label])
+                            for label in (
+                                "mac",
+                                "tenant",
+                                "segment",
+                                "port",
+                                "role",
+                                "ipv4_os",
+                                "id",
+                            )
+                        ],
+                        ip,
+                    )
+                )
+        samples.extend(
+            (key[0], [str(label) for label in key[1:]], count)
+            for key, count in counts.items()
+        )
+        return samples
+
+    def cached_samples(self, hash_id, endpoint):
+        samples = self.endpoint_samples.get(hash_id, None)
+        if samples is None or endpoint.dirty:
+            # cleared before reading, so a change made while reading marks it again.
+            endpoint.dirty = False
+            try:
+                samples = (
+                    self.endpoint_samples_for(hash_id, endpoint),
+                    self.endpoint_host(hash_id, endpoint),
+                )
+            except (KeyError, RuntimeError):
+                # the main loop changed the endpoint while it was read, or has not
+                # finished filling in its endpoint_data: keep any previous samples.
+                endpoint.dirty = True
+        return samples
+
+    def collect(self):
+        families = self.families()
+        endpoints = {}
+        if self.get_endpoints is not None:
+            endpoints = self.get_endpoints()
+        scrape_time = time.time()
+        with self.lock:
+            endpoint_samples = {}
+            for hash_id, endpoint in list(endpoints.items()):
+                samples = self.cached_samples(hash_id, endpoint)
+                if samples is not None:
+                    endpoint_samples[hash_id] = samples
+            # endpoints no longer present are dropped from the cache.
+            self.endpoint_samples = endpoint_samples
+        hosts = []
+        for samples, host in endpoint_samples.values():
+            for key, labels, value in samples:
+                if value is None:
+                    value = scrape_time
+                families[key].add_metric(labels, value)
+            hosts.append(host)
+        for key, labels, value in self.host_samples(hosts):
+            families[key].add_metric(labels, value)
+        # exporter size, which should track the number of endpoints, not churn.
+        exported_series = families.pop("exported_series")
+        for family in families.values():
+            exported_series.add_metric([family.name], len(family.samples))
+        return list(families.values()) + [exported_series]
 
 
 class Prometheus:
     def __init__(self):
         self.logger = logging.getLogger("prometheus")
         self.prom_metrics = {}
+        self.endpoint_collector = EndpointCollector()
         self.config = Config().get_config()
         self.prometheus_addr = (
             self.config["prometheus_ip"] + ":" + self.config["prometheus_port"]
@@ -34,33 +397,8 @@ class Prometheus:
 
     def initialize_metrics(self):
         self.prom_metrics["info"] = Info("poseidon_version", "Info about Poseidon")
-        self.prom_metrics["ipv4_table"] = Gauge(
-            "poseidon_endpoint_ip_table",
-            "IP Table",
-            ["mac", "tenant", "segment", "port", "role", "ipv4_os", "hash_id"],
-        )
-        self.prom_metrics["roles"] = Gauge(
-            "poseidon_endpoint_roles", "Number of endpoints by role", ["role"]
-        )
-        self.prom_metrics["oses"] = Gauge(
-            "poseidon_endpoint_oses", "Number of endpoints by OS", ["ipv4_os"]
-        )
-        self.prom_metrics["current_states"] = Gauge(
-            "poseidon_endpoint_current_states",
-            "Number of endpoints by current state",
-            ["current_state"],
-        )
-        self.prom_metrics["vlans"] = Gauge(
-            "poseidon_endpoint_vlans", "Number of endpoints by VLAN", ["tenant"]
-        )
-        self.prom_metrics["port_tenants"] = Gauge(
-            "poseidon_endpoint_port_tenants",
-            "Number of tenants by port",
-            ["port", "tenant"],
-        )
-        self.prom_metrics["port_hosts"] = Gauge(
-            "poseidon_endpoint_port_hosts", "Number of hosts by port", ["port"]
-        )
+        self.prom_metrics["info"].info({"version": __version__})
+        REGISTRY.register(self.endpoint_collector)
         self.prom_metrics["last_rabbitmq_routing_key_time"] = Gauge(
             "poseidon_last_rabbitmq_routing_key_time",
             "Epoch time when last received a RabbitMQ message",
@@ -74,217 +412,80 @@ class Prometheus:
         self.prom_metrics["ncapture_count"] = Counter(
             "poseidon_ncapture_count", "Number of times ncapture ran"
         )
+        self.prom_metrics["faucet_events_received"] = Counter(
+            "poseidon_faucet_events_received",
+            "Number of FAUCET events received by the main loop",
+        )
+        self.prom_metrics["faucet_events_coalesced"] = Counter(
+            "poseidon_faucet_events_coalesced",
+            "Number of FAUCET events dropped because a newer event superseded them",
+        )
+        self.prom_metrics["faucet_events_applied"] = Counter(
+            "poseidon_faucet_events_applied",
+            "Number of FAUCET events applied to the endpoint table",
+        )
+        self.prom_metrics["queue_depth"] = Gauge(
+            "poseidon_queue_depth", "Number of items in an internal queue", ["queue"]
+        )
+        self.prom_metrics["queue_dropped"] = Counter(
+            "poseidon_queue_dropped",
+            "Number of items dropped or coalesced because an internal queue was full",
+            ["queue", "reason"],
+        )
         self.prom_metrics["method_runtime_secs"] = Summary(
             "poseidon_method_runtime_secs", "Time spent in Monitor methods", ["method"]
         )
-        self.prom_metrics["endpoint_role_confidence_top"] = Gauge(
-            "poseidon_role_confidence_top",
-            "Confidence of top role prediction",
-            [
-                "mac",
-                "name",
-                "role",
-                "pcap_labels",
-                "ipv4_os",
-                "ipv4_address",
-                "ipv6_address",
-                "hash_id",
-            ],
+        self.prom_metrics["actions_in_flight"] = Gauge(
+            "poseidon_actions_in_flight",
+            "Number of controller and collector operations queued or running",
+            ["action"],
         )
-        self.prom_metrics["endpoint_role_confidence_second"] = Gauge(
-            "poseidon_role_confidence_second",
-            "Confidence of second role prediction",
-            [
-                "mac",
-                "name",
-                "role",
-                "pcap_labels",
-                "ipv4_os",
-                "ipv4_address",
-                "ipv6_address",
-                "hash_id",
-            ],
+        self.prom_metrics["action_runtime_secs"] = Histogram(
+            "poseidon_action_runtime_secs",
+            "Time spent running controller and collector operations",
+            ["action"],
         )
-        self.prom_metrics["endpoint_role_confidence_third"] = Gauge(
-            "poseidon_role_confidence_third",
-            "Confidence of third role prediction",
-            [
-                "mac",
-                "name",
-                "role",
-                "pcap_labels",
-                "ipv4_os",
-                "ipv4_address",
-                "ipv6_address",
-                "hash_id",
-            ],
+        self.prom_metrics["actions_failed"] = Counter(
+            "poseidon_actions_failed",
+            "Number of controller and collector operations that failed",
+            ["action"],
         )
-        self.prom_metrics["endpoints"] = Gauge(
-            "poseidon_endpoints",
-            "All endpoints",
-            [
-                "mac",
-                "tenant",
-                "segment",
-                "ether_vendor",
-                "controller_type",
-                "controller",
-                "name",
-                "port",
-                "hash_id",
-            ],
+        self.prom_metrics["handler_runtime_secs"] = Summary(
+            "poseidon_handler_runtime_secs",
+            "Time spent handling RabbitMQ messages",
+            ["routing_key"],
         )
-        self.prom_metrics["endpoint_state"] = Gauge(
-            "poseidon_endpoint_state",
-            "State for all endpoints",
-            [
-                "mac",
-                "tenant",
-                "segment",
-                "ether_vendor",
-                "name",
-                "port",
-                "state",
-                "hash_id",
-            ],
+        self.prom_metrics["event_loop_latency_secs"] = Histogram(
+            "poseidon_event_loop_latency_secs",
+            "Time from work being queued to the main loop finishing processing it",
         )
-        self.prom_metrics["endpoint_os"] = Gauge(
-            "poseidon_endpoint_os",
-            "Operating System for all endpoints",
-            [
-                "mac",
-                "tenant",
-                "segment",
-                "ether_vendor",
-                "name",
-                "port",
-                "ipv4_os",
-                "hash_id",
-            ],
+        self.prom_metrics["message_latency_secs"] = Histogram(
+            "poseidon_message_latency_secs",
+            "Time from a RabbitMQ message being received to it being handled",
+            ["lane"],
         )
-        self.prom_metrics["endpoint_role"] = Gauge(
-            "poseidon_endpoint_role",
-            "Top role for all endpoints",
-            [
-                "mac",
-                "tenant",
-                "segment",
-                "ether_vendor",
-                "name",
-                "port",
-                "top_role",
-                "hash_id",
-            ],
+        self.prom_metrics["job_lag_secs"] = Histogram(
+            "poseidon_job_lag_secs",
+            "Time from a scheduled job being due to it starting to run",
+            ["job"],
         )
-        self.prom_metrics["endpoint_ip"] = Gauge(
-            "poseidon_endpoint_ip",
-            "IP Address for all endpoints",
-            [
-                "mac",
-                "tenant",
-                "segment",
-                "ether_vendor",
-                "name",
-                "port",
-                "ipv4_address",
-                "ipv6_address",
-                "ipv4_subnet",
-                "ipv6_subnet",
-                "ipv4_rdns",
-                "ipv6_rdns",
-                "hash_id",
-            ],
+        self.prom_metrics["jobs_coalesced"] = Counter(
+            "poseidon_jobs_coalesced",
+            "Number of scheduled jobs skipped because the same job was still queued",
+            ["job"],
         )
-        self.prom_metrics["endpoint_metadata"] = Gauge(
-            "poseidon_endpoint_metadata",
-            "Metadata for all endpoints",
-            [
-                "mac",
-                "tenant",
-                "segment",
-                "ether_vendor",
-                "prev_state",
-                "next_state",
-                "acls",
-                "ignore",
-                "ipv4_subnet",
-                "ipv6_subnet",
-                "ipv4_rdns",
-                "ipv6_rdns",
-                "controller_type",
-                "controller",
-                "name",
-                "state",
-                "port",
-                "top_role",
-                "ipv4_os",
-                "ipv4_address",
-                "ipv6_address",
-                "hash_id",
-            ],
+        self.prom_metrics["rdns_cache"] = Counter(
+            "poseidon_rdns_cache",
+            "Number of reverse DNS lookups by cache result",
+            ["result"],
+        )
+        self.prom_metrics["rdns_lookup_secs"] = Histogram(
+            "poseidon_rdns_lookup_secs", "Time spent resolving reverse DNS uncached"
         )
 
-    @staticmethod
-    def get_metrics():
-        metrics = {
-            "info": defaultdict(int),
-            "roles": defaultdict(int),
-            "oses": defaultdict(int),
-            "current_states": defaultdict(int),
-            "vlans": defaultdict(int),
-            "port_tenants": defaultdict(int),
-            "port_hosts": defaultdict(int),
-            "ncapture_count": 0,
-        }
-        return metrics
-
-    def update_metrics(self, hosts):
-        metrics = Prometheus.get_metrics()
-        metrics["info"]["version"] = __version__
-
-        for host in hosts:
-            metrics["roles"][host["role"]] += 1
-            metrics["oses"][host["ipv4_os"]] += 1
-            metrics["vlans"][host["tenant"]] += 1
-            metrics["port_hosts"][host["port"]] += 1
-            metrics["port_tenants"][(host["port"], host["tenant"])] += 1
-            metrics["current_states"][host["state"]] += 1
-
-        if self.prom_metrics:
-            for host in hosts:
-                if host["ipv4"]:
-                    self.prom_metrics["ipv4_table"].labels(
-                        mac=host["mac"],
-                        tenant=host["tenant"],
-                        segment=host["segment"],
-                        port=host["port"],
-                        role=host["role"],
-                        ipv4_os=host["ipv4_os"],
-                        hash_id=host["id"],
-                    ).set(int(ipaddress.ip_address(host["ipv4"])))
-            for role in metrics["roles"]:
-                self.prom_metrics["roles"].labels(role=role).set(metrics["roles"][role])
-            for os_t in metrics["oses"]:
-                self.prom_metrics["oses"].labels(ipv4_os=os_t).set(
-                    metrics["oses"][os_t]
-                )
-            for current_state in metrics["current_states"]:
-                self.prom_metrics["current_states"].labels(
-                    current_state=current_state
-                ).set(metrics["current_states"][current_state])
-            for vlan in metrics["vlans"]:
-                self.prom_metrics["vlans"].labels(tenant=vlan).set(
-                    metrics["vlans"][vlan]
-                )
-            for port_tenant in metrics["port_tenants"]:
-                self.prom_metrics["port_tenants"].labels(
-                    port=port_tenant[0], tenant=port_tenant[1]
-                ).set(metrics["port_tenants"][port_tenant])
-            for port_host in metrics["port_hosts"]:
-                self.prom_metrics["port_hosts"].labels(port=port_host).set(
-                    metrics["port_hosts"][port_host]
-                )
-            self.prom_metrics["info"].info(metrics["info"])
+    def export_endpoints(self, get_endpoints):
+        """export the endpoints returned by get_endpoints(), when scraped."""
+        self.endpoint_collector.get_endpoints = get_endpoints
 
     @staticmethod
     def latest_metric(metric):
@@ -481,102 +682,6 @@ class Prometheus:
         with self.prom_metrics["method_runtime_secs"].labels(method=method_name).time():
             return method()
 
-    def update_endpoint_metadata(self, endpoints):
-        update_time = time.time()
-        for hash_id, endpoint in endpoints.items():
-            ipv4 = endpoint.endpoint_data["ipv4"]
-            ipv6 = endpoint.endpoint_data["ipv6"]
-            ipv4_subnet = endpoint.endpoint_data["ipv4_subnet"]
-            ipv6_subnet = endpoint.endpoint_data["ipv6_subnet"]
-            ipv4_rdns = endpoint.endpoint_data["ipv4_rdns"]
-            ipv6_rdns = endpoint.endpoint_data["ipv6_rdns"]
-            port = endpoint.endpoint_data["port"]
-            tenant = endpoint.endpoint_data["tenant"]
-            segment = endpoint.endpoint_data["segment"]
-            ether_vendor = endpoint.endpoint_data["ether_vendor"]
-            controller = endpoint.endpoint_data["controller"]
-            controller_type = endpoint.endpoint_data["controller_type"]
-            (
-                roles,
-                confidences,
-                pcap_labels,
-            ) = endpoint.get_roles_confidences_pcap_labels()
-            top_role, second_role, third_role = roles
-            top_conf, second_conf, third_conf = confidences
-            ipv4_os = endpoint.get_ipv4_os()
-
-            def set_prom(var, val, **prom_labels):
-                prom_labels.update(
-                    {
-                        "mac": endpoint.endpoint_data["mac"],
-                        "name": endpoint.endpoint_data["name"],
-                        "hash_id": hash_id,
-                    }
-                )
-                try:
-                    self.prom_metrics[var].labels(**prom_labels).set(val)
-                except ValueError:
-                    pass
-
-            def set_prom_role(var, val, role):
-                set_prom(
-                    var,
-                    val,
-                    role=role,
-                    ipv4_os=ipv4_os,
-                    ipv4_address=ipv4,
-                    ipv6_address=ipv6,
-                    pcap_labels=pcap_labels,
-                )
-
-            def update_prom(var, **prom_labels):
-                prom_labels.update(
-                    {
-                        "tenant": tenant,
-                        "segment": segment,
-                        "ether_vendor": ether_vendor,
-                        "port": port,
-                    }
-                )
-                set_prom(var, update_time, **prom_labels)
-
-            set_prom_role("endpoint_role_confidence_top", top_conf, top_role)
-            set_prom_role("endpoint_role_confidence_second", second_conf, second_role)
-            set_prom_role("endpoint_role_confidence_third", third_conf, third_role)
-            update_prom(
-                "endpoints", controller_type=controller_type, controller=controller
-            )
-            update_prom("endpoint_state", state=endpoint.state)
-            update_prom("endpoint_os", ipv4_os=ipv4_os)
-            update_prom("endpoint_role", top_role=top_role)
-            update_prom(
-                "endpoint_ip",
-                ipv4_subnet=ipv4_subnet,
-                ipv6_subnet=ipv6_subnet,
-                ipv4_rdns=ipv4_rdns,
-                ipv6_rdns=ipv6_rdns,
-                ipv4_address=ipv4,
-                ipv6_address=ipv6,
-            )
-            update_prom(
-                "endpoint_metadata",
-                prev_state=endpoint.p_prev_state,
-                next_state=endpoint.p_next_state,
-                acls=endpoint.acl_data,
-                ignore=str(endpoint.ignore),
-                ipv4_subnet=ipv4_subnet,
-                ipv6_subnet=ipv6_subnet,
-                ipv4_rdns=ipv4_rdns,
-                ipv6_rdns=ipv6_rdns,
-                controller_type=controller_type,
-                controller=controller,
-                state=endpoint.state,
-                top_role=top_role,
-                ipv4_os=ipv4_os,
-                ipv4_address=ipv4,
-                ipv6_address=ipv6,
-            )
-
     @staticmethod
-    def start(port=9304):
-        start_http_server(port)
+    def start(port=9304, registry=REGISTRY):
+        start_http_server(port, registry=registry)
@@ -3,12 +3,19 @@
 Created on 21 August 2017
 @author: dgrossman
 """
+import asyncio
 import logging
 import threading
 import time
 from functools import partial
 
 import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # pragma: no cover
+    from json import loads as json_loads
 
 
 class Rabbit:
@@ -16,12 +23,28 @@ class Rabbit:
     Base Class for RabbitMQ
     """
 
-    def __init__(self):
+    def __init__(self, prefetch_count=0, ack_batch_size=1, ack_interval=0):
         self.logger = logging.getLogger("rabbit")
         self.connection = None
         self.channel = None
         self.mq_recv_thread = None
         self.queue_name = "poseidon_main"
+        self.prefetch_count = prefetch_count
+        self.ack_batch_size = ack_batch_size
+        self.ack_interval = ack_interval
+        self.ack_lock = threading.Lock()
+        self.done_tags = set()
+        self.done_tag = 0
+        self.acked_tag = 0
+        self.ack_timer = False
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            prefetch_count=config["rabbit_prefetch_count"],
+            ack_batch_size=config["rabbit_ack_batch_size"],
+            ack_interval=config["rabbit_ack_interval_ms"] / 1000,
+        )
 
     def close(self):
         if self.connection:
@@ -76,9 +99,169 @@ class Rabbit:
 
         return do_rabbit
 
+    @staticmethod
+    def call_threadsafe(channel, callback):
+        """run callback on the thread that owns the channel's connection."""
+        connection = channel.connection
+        if hasattr(connection, "add_callback_threadsafe"):
+            connection.add_callback_threadsafe(callback)
+        else:
+            connection.ioloop.call_soon_threadsafe(callback)
+
+    @staticmethod
+    def call_later(channel, delay, callback):
+        """must be called from the thread that owns the channel's connection."""
+        connection = channel.connection
+        if hasattr(connection, "add_callback_threadsafe"):
+            connection.call_later(delay, callback)
+        else:
+            connection.ioloop.call_later(delay, callback)
+
+    @staticmethod
+    def threadsafe_ack(channel, delivery_tag):
+        """ack from any thread, on the thread that owns the connection."""
+        Rabbit.call_threadsafe(
+            channel, partial(channel.basic_ack, delivery_tag=delivery_tag)
+        )
+
+    def ack(self, delivery_tag):
+        """
+        ack a delivery from any thread. Acks are sent cumulatively, up to the
+        highest tag below which every delivery is done, once ack_batch_size
+        deliveries are waiting or ack_interval seconds have passed.
+        """
+        with self.ack_lock:
+            self.done_tags.add(delivery_tag)
+            while self.done_tag + 1 in self.done_tags:
+                self.done_tag += 1
+                self.done_tags.remove(self.done_tag)
+            waiting = self.done_tag - self.acked_tag
+            if not waiting:
+                return
+            if waiting < self.ack_batch_size:
+                if self.ack_timer:
+                    return
+                self.ack_timer = True
+                callback = partial(
+                    self.call_later, self.channel, self.ack_interval, self.flush_acks
+                )
+            else:
+                callback = self.flush_acks
+        self.call_threadsafe(self.channel, callback)
+
+    def flush_acks(self):
+        """send any waiting acks, on the thread that owns the connection."""
+        with self.ack_lock:
+            self.ack_timer = False
+            delivery_tag = self.done_tag
+            if delivery_tag <= self.acked_tag:
+                return
+            self.acked_tag = delivery_tag
+        self.channel.basic_ack(delivery_tag=delivery_tag, multiple=True)
+
     def start_channel(self, mycallback, m_queue):
         """Handle threading for messagetype"""
         self.logger.debug(f"About to start channel {self.channel}")
-        self.channel.basic_consume(self.queue_name, partial(mycallback, q=m_queue))
+        if self.prefetch_count:
+            self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        self.channel.basic_consume(
+            self.queue_name, partial(mycallback, q=m_queue, rabbit=self)
+        )
         self.mq_recv_thread = threading.Thread(target=self.channel.start_consuming)
         self.mq_recv_thread.start()
+
+
+class AsyncRabbit(Rabbit):
+    """
+    RabbitMQ consumer running on the asyncio event loop
+    """
+
+    @staticmethod
+    def _pika_call(func, callback_arg="callback", **kwargs):
+        """call a callback style pika method and return a future for its result."""
+        future = asyncio.get_running_loop().create_future()
+
+        def callback(result):
+            if not future.done():
+                future.set_result(result)
+
+        kwargs[callback_arg] = callback
+        func(**kwargs)
+        return future
+
+    async def _open_connection(self, host, port):  # pragma: no cover
+        future = asyncio.get_running_loop().create_future()
+
+        def on_open(connection):
+            if not future.done():
+                future.set_result(connection)
+
+        def on_open_error(_connection, err):
+            if not future.done():
+                future.set_exception(Exception(err))
+
+        AsyncioConnection(
+            pika.ConnectionParameters(host=host, port=port),
+            on_open_callback=on_open,
+            on_open_error_callback=on_open_error,
+            custom_ioloop=asyncio.get_running_loop(),
+        )
+        return await future
+
+    async def make_rabbit_connection(
+        self, host, port, exchange, keys, total_sleep=float("inf")
+    ):  # pragma: no cover
+        """
+        Connects to rabbitmq using the given hostname,
+        exchange, and queue. Retries on failure until success.
+        Binds routing keys appropriate for module.
+        """
+        wait = True
+
+        while wait and total_sleep > 0:
+            try:
+                self.connection = await self._open_connection(host, port)
+                self.channel = await self._pika_call(
+                    self.connection.channel, callback_arg="on_open_callback"
+                )
+                await self._pika_call(
+                    self.channel.exchange_declare,
+                    exchange=exchange,
+                    exchange_type="topic",
+                )
+                await self._pika_call(
+                    self.channel.queue_declare,
+                    queue=self.queue_name,
+                    exclusive=False,
+                    durable=True,
+                )
+                self.logger.info(f"Connected to {host} rabbitmq...")
+                wait = False
+            except Exception as e:
+                self.logger.debug(f"Waiting for connection to {host} rabbitmq...")
+                await asyncio.sleep(2)
+                total_sleep -= 2
+
+        if wait:
+            return False
+
+        if isinstance(keys, str):
+            keys = [keys]
+        for key in keys:
+            self.logger.debug(f"Array adding key:{key} to rabbitmq channel")
+            await self._pika_call(
+                self.channel.queue_bind,
+                exchange=exchange,
+                queue=self.queue_name,
+                routing_key=key,
+            )
+        return True
+
+    def start_channel(self, mycallback, m_queue):
+        """Start consuming on the running event loop, no thread needed"""
+        self.logger.debug(f"About to start channel {self.channel}")
+        if self.prefetch_count:
+            self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        self.channel.basic_consume(
+            self.queue_name, partial(mycallback, q=m_queue, rabbit=self)
+        )
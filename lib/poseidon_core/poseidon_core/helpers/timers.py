@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Deadline tracking for endpoint timeouts, so periodic jobs only visit
+endpoints whose timeout may have passed instead of scanning them all.
+"""
+import heapq
+
+
+class DeadlineHeap:
+    """
+    heap holding at most one live deadline per key. A deadline may be
+    earlier than the key's real one (it is then checked and rescheduled),
+    but never later, so scheduling a later deadline over an earlier one
+    is a cheap no-op.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def schedule(self, key, deadline):
+        current = self.deadlines.get(key, None)
+        if current is not None and current <= deadline:
+            return
+        # any entry for the old, later deadline is now stale and is skipped when popped.
+        self.deadlines[key] = deadline
+        heapq.heappush(self.heap, (deadline, key))
+
+    def pop_due(self, now):
+        """remove and return the keys with deadlines before now."""
+        due = []
+        while self.heap and self.heap[0][0] < now:
+            deadline, key = heapq.heappop(self.heap)
+            if self.deadlines.get(key, None) == deadline:
+                del self.deadlines[key]
+                due.append(key)
+        return due
+
+
+class EndpointTimers:
+    """
+    next reinvestigation and coprocessing timeouts for endpoints, fed by
+    Endpoint.touch() and state transitions.
+    """
+
+    def __init__(self, reinvestigation_timeout, coprocessing_timeout):
+        self.reinvestigation_timeout = reinvestigation_timeout
+        self.coprocessing_timeout = coprocessing_timeout
+        self.reinvestigation = DeadlineHeap()
+        self.coprocessing = DeadlineHeap()
+
+    def track(self, endpoint):
+        endpoint.timers = self
+        self.schedule(endpoint)
+
+    def schedule(self, endpoint):
+        deadline = endpoint.observed_deadline(self.reinvestigation_timeout)
+        if endpoint.operation_active():
+            deadline = min(
+                deadline, endpoint.state_deadline(self.reinvestigation_timeout)
+            )
+        self.reinvestigation.schedule(endpoint.name, deadline)
+        if endpoint.copro_state == "copro_coprocessing":
+            self.coprocessing.schedule(
+                endpoint.name, endpoint.copro_state_deadline(self.coprocessing_timeout)
+            )
+
+    def due_reinvestigation(self, now):
+        return self.reinvestigation.pop_due(now)
+
+    def due_coprocessing(self, now):
+        return self.coprocessing.pop_due(now)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Trunk port configuration, parsed once for constant time lookups.
+"""
+import json
+import logging
+
+
+class TrunkPorts:
+    """
+    trunk ports from the trunk_ports config, a dict of switch to
+    "mac,port". One instance is shared by SDNConnect and FaucetProxy, so
+    reload() updates both.
+    """
+
+    def __init__(self, trunk_ports=None):
+        self.logger = logging.getLogger("trunks")
+        # (trunks, switch_ports), swapped as one so lookups never mix configs.
+        self.tables = (frozenset(), frozenset())
+        self.reload(trunk_ports)
+
+    def parse(self, trunk_ports):
+        """
+        frozenset of (switch, port, mac) from the trunk_ports config.
+        Entries not in "mac,port" form are skipped.
+        """
+        if isinstance(trunk_ports, str):
+            trunk_ports = json.loads(trunk_ports)
+        trunks = set()
+        for switch, mac_port in (trunk_ports or {}).items():
+            fields = [field.strip() for field in str(mac_port).split(",")]
+            if len(fields) != 2 or not all(fields):
+                self.logger.warning(
+                    'Ignoring trunk port for {0}: {1} is not "mac,port"'.format(
+                        switch, mac_port
+                    )
+                )
+                continue
+            mac, port = fields
+            trunks.add((switch, port, mac))
+        return frozenset(trunks)
+
+    def reload(self, trunk_ports):
+        trunks = self.parse(trunk_ports)
+        switch_ports = frozenset((switch, port) for switch, port, _ in trunks)
+        self.tables = (trunks, switch_ports)
+
+    @property
+    def trunks(self):
+        return self.tables[0]
+
+    @property
+    def switch_ports(self):
+        return self.tables[1]
+
+    def __len__(self):
+        return len(self.trunks)
+
+    def is_trunk(self, switch, port, mac):
+        return (switch, str(port), mac) in self.trunks
+
+    def is_trunk_port(self, switch, port):
+        return (switch, str(port)) in self.switch_ports
@@ -6,39 +6,117 @@ The main entrypoint for Poseidon
 Created on 3 December 2018
 @author: Charlie Lewis
 """
+import asyncio
 import logging
+import multiprocessing
+import multiprocessing.connection
 import sys
 import threading
-import time
 from functools import partial
 
 import schedule
 from poseidon_core.controllers.faucet.config import FaucetRemoteConfGetSetter
+from poseidon_core.controllers.faucet.faucet import FaucetProxy
 from poseidon_core.controllers.sdnconnect import SDNConnect
 from poseidon_core.controllers.sdnevents import SDNEvents
+from poseidon_core.controllers.shards import forward_shard_queue
+from poseidon_core.controllers.shards import shard_metrics_port
+from poseidon_core.controllers.shards import ShardCoordinator
+from poseidon_core.controllers.shards import ShardMetricsCollector
+from poseidon_core.controllers.shards import ShardRouter
+from poseidon_core.helpers.async_scheduler import AsyncScheduler
 from poseidon_core.helpers.config import Config
 from poseidon_core.helpers.log import Logger
 from poseidon_core.helpers.prometheus import Prometheus
+from poseidon_core.helpers.rabbit import Rabbit
 from poseidon_core.operations.monitor import Monitor
+from prometheus_client import CollectorRegistry
 
 
-def start_prometheus(logger):
+def start_prometheus(logger, port=9304):
     prom = Prometheus()
     try:
         prom.initialize_metrics()
     except Exception as e:  # pragma: no cover
         logger.debug(f"Prometheus metrics are already initialized: {e}")
-    Prometheus.start()
+    Prometheus.start(port)
     return prom
 
 
-def schedule_thread_worker(logger, scheduler=schedule):
-    """schedule thread, takes care of running processes in the future"""
-    logger.debug("Starting thread_worker")
-    while True:
-        sys.stdout.flush()
-        scheduler.run_pending()
-        time.sleep(1)
+async def run_asyncio(logger, config, sdne, sdnc, prom):  # pragma: no cover
+    """run consumers, timers and the main loop on one asyncio event loop."""
+    sdne.use_asyncio(asyncio.get_running_loop())
+    await sdne.start_message_queues_async()
+    monitor = Monitor(logger, config, AsyncScheduler(), sdne.job_queue, sdnc, prom)
+    await sdne.process_async(monitor)
+
+
+def run_shard(shard, shards, coordinator, shard_queue, done_queue):  # pragma: no cover
+    """one endpoint shard, fed by the router instead of RabbitMQ."""
+    logging.getLogger("pika").setLevel(logging.CRITICAL)
+    Logger()
+    logger = logging.getLogger(f"shard{shard}")
+    config = Config().get_config()
+    # each shard exports its own endpoints, which the parent re-exports.
+    prom = start_prometheus(logger, port=shard_metrics_port(shard))
+    sdnc = SDNConnect(
+        config=config,
+        logger=logger,
+        prom=prom,
+        faucetconfgetsetter_cl=FaucetRemoteConfGetSetter,
+    )
+    sdnc.use_shard(shard, shards, coordinator)
+    sdne = SDNEvents(logger, prom, sdnc)
+    threading.Thread(
+        target=partial(forward_shard_queue, sdne, shard_queue, done_queue),
+        name="shard_queue",
+        daemon=True,
+    ).start()
+    monitor = Monitor(
+        logger, config, schedule.default_scheduler, sdne.job_queue, sdnc, prom
+    )
+    sdne.process(monitor)
+
+
+def run_sharded(logger, config):  # pragma: no cover
+    """route RabbitMQ messages to endpoint shards in worker processes."""
+    shards = config["shards"]
+    ctx = multiprocessing.get_context("spawn")
+    FaucetProxy(
+        config, faucetconfgetsetter_cl=FaucetRemoteConfGetSetter
+    ).clear_mirrors()
+    coordinator = ShardCoordinator(shards, ctx=ctx)
+    shard_queues = [ctx.Queue() for _ in range(shards)]
+    done_queue = ctx.Queue()
+    processes = [
+        ctx.Process(
+            target=run_shard,
+            args=(shard, shards, coordinator, shard_queues[shard], done_queue),
+            name=f"shard{shard}",
+        )
+        for shard in range(shards)
+    ]
+    for process in processes:
+        process.start()
+    registry = CollectorRegistry()
+    registry.register(
+        ShardMetricsCollector([shard_metrics_port(shard) for shard in range(shards)])
+    )
+    Prometheus.start(registry=registry)
+    router = ShardRouter(config, shard_queues, done_queue)
+    threading.Thread(target=router.handle_done, name="shard_done", daemon=True).start()
+    rabbits = []
+    for host, port, exchange, binding_key in SDNEvents.message_queues(config):
+        rabbit = Rabbit.from_config(config)
+        rabbit.make_rabbit_connection(host, port, exchange, binding_key)
+        rabbit.start_channel(router.rabbit_callback, None)
+        rabbits.append(rabbit)
+    # exiting closes the RabbitMQ connections, so unacked messages are redelivered.
+    multiprocessing.connection.wait([process.sentinel for process in processes])
+    for process in processes:
+        if not process.is_alive():
+            logger.error(f"{process.name} exited with {process.exitcode}")
+    sys.exit(1)
 
 
 def main():  # pragma: no cover
@@ -46,6 +124,8 @@ def main():  # pragma: no cover
     Logger()
     logger = logging.getLogger("main")
     config = Config().get_config()
+    if config["shards"] > 1:
+        run_sharded(logger, config)
     prom = start_prometheus(logger)
 
     # TODO option that doesn't require an sdn connection?
@@ -57,21 +137,18 @@ def main():  # pragma: no cover
     )
 
     sdne = SDNEvents(logger, prom, sdnc)
-    sdne.start_message_queues()
-
-    # TODO this should be the default operation, but can be overridden with config to do other operations instead or additionally
-    monitor = Monitor(logger, config, schedule, sdne.job_queue, sdnc, prom)
-
-    # schedule all threads
-    schedule_thread = threading.Thread(
-        target=partial(schedule_thread_worker, logger, scheduler=schedule),
-        name="st_worker",
-    )
-    schedule_thread.start()
 
     try:
-        # TODO each operation should have its own thread running its own "process" and this is just a main infinite loop
-        sdne.process(monitor)
+        if config["runtime"] == "asyncio":
+            asyncio.run(run_asyncio(logger, config, sdne, sdnc, prom))
+        else:
+            sdne.start_message_queues()
+            # TODO this should be the default operation, but can be overridden with config to do other operations instead or additionally
+            monitor = Monitor(
+                logger, config, schedule.default_scheduler, sdne.job_queue, sdnc, prom
+            )
+            # TODO each operation should have its own thread running its own "process" and this is just a main infinite loop
+            sdne.process(monitor)
     except Exception as e:
         logger.exception(e)
         logger.error("restarting because of exception")
@@ -15,49 +15,13 @@ class Monitor:
         self.job_queue = job_queue
         self.sdnc = sdnc
         self.prom = prom
+        self.schedule = schedule
 
         # timer class to call things periodically in own thread
-        schedule.every(self.config["scan_frequency"]).seconds.do(
-            self.schedule_job_update_metrics
-        )
         schedule.every(self.config["reinvestigation_frequency"]).seconds.do(
             self.schedule_job_reinvestigation_timeout
         )
 
-    def get_hosts(self):
-        # TODO consolidate with update_endpoint_metadata
-        hosts = []
-        for hash_id, endpoint in self.sdnc.endpoints.items():
-            roles, _, _ = endpoint.get_roles_confidences_pcap_labels()
-            role = roles[0]
-            ipv4_os = endpoint.get_ipv4_os()
-            host = {
-                "mac": endpoint.endpoint_data["mac"],
-                "id": hash_id,
-                "role": role,
-                "ipv4_os": ipv4_os,
-                "state": endpoint.state,
-                "tenant": endpoint.endpoint_data["tenant"],
-                "port": endpoint.endpoint_data["port"],
-                "segment": endpoint.endpoint_data["segment"],
-                "ipv4": endpoint.endpoint_data["ipv4"],
-            }
-            hosts.append(host)
-        return hosts
-
-    def job_update_metrics(self):
-        self.logger.debug("updating metrics")
-        try:
-            hosts = self.get_hosts()
-            self.prom.update_metrics(hosts)
-        except Exception as e:  # pragma: no cover
-            self.logger.error(
-                "Unable to get current state and send it to Prometheus because: {0}".format(
-                    str(e)
-                )
-            )
-        return 0
-
     def job_recoprocess(self):
         if not self.sdnc.sdnc:
             for endpoint in self.sdnc.not_copro_ignored_endpoints():
@@ -65,14 +29,22 @@ class Monitor:
                     endpoint.copro_nominal()  # pytype: disable=attribute-error
             return 0
         events = 0
-        for endpoint in self.sdnc.not_copro_ignored_endpoints("copro_coprocessing"):
-            if endpoint.copro_state_timeout(2 * self.config["coprocessing_frequency"]):
+        timeout = 2 * self.config["coprocessing_frequency"]
+        # only endpoints whose coprocessing deadline has passed need checking.
+        due = self.sdnc.timers.due_coprocessing(time.time())
+        for endpoint in self.sdnc.due_endpoints(due):
+            if (
+                not endpoint.copro_ignore
+                and endpoint.copro_state == "copro_coprocessing"
+                and endpoint.copro_state_timeout(timeout)
+            ):
                 self.logger.debug(
                     "timing out: {0} and setting to unknown".format(endpoint.name)
                 )
                 self.sdnc.uncoprocess_endpoint(endpoint)
                 endpoint.copro_unknown()  # pytype: disable=attribute-error
                 events += 1
+            self.sdnc.timers.schedule(endpoint)
         return events
 
     def job_reinvestigation_timeout(self):
@@ -84,8 +56,12 @@ class Monitor:
             return 0
         events = 0
         timeout = 2 * self.config["reinvestigation_frequency"]
-        for endpoint in self.sdnc.not_ignored_endpoints():
-            if endpoint.observed_timeout(timeout):
+        # only endpoints whose observation or mirror deadline has passed need checking.
+        due = self.sdnc.timers.due_reinvestigation(time.time())
+        for endpoint in self.sdnc.due_endpoints(due):
+            if endpoint.ignore:
+                pass
+            elif endpoint.observed_timeout(timeout):
                 self.logger.info("observation timing out: {0}".format(endpoint.name))
                 endpoint.force_unknown()
                 events += 1
@@ -93,19 +69,28 @@ class Monitor:
                 self.logger.info("mirror timing out: {0}".format(endpoint.name))
                 self.sdnc.unmirror_endpoint(endpoint)
                 events += 1
-        budget = self.sdnc.investigation_budget()
+            # still timed out endpoints stay due, and are checked again next time.
+            self.sdnc.timers.schedule(endpoint)
         candidates = self.sdnc.not_ignored_endpoints("queued")
         if not candidates:
             candidates = self.sdnc.not_ignored_endpoints("known")
+        budget = self.sdnc.investigation_budget(len(candidates))
         return events + self._schedule_queued_work(
             candidates, budget, "operate", self.sdnc.mirror_endpoint, shuffle=True
         )
 
-    def schedule_job_update_metrics(self):
-        self.job_queue.put(self.job_update_metrics)
+    def _schedule_job(self, job):
+        # jobs are scheduled from the main loop, so must never block on a full queue.
+        try:
+            self.job_queue.put_nowait(job)
+        except queue.Full:
+            self.logger.warning("job queue full, dropping {0}".format(job.__name__))
+            self.prom.prom_metrics["queue_dropped"].labels(
+                queue="jobs", reason="full"
+            ).inc()
 
     def schedule_job_reinvestigation_timeout(self):
-        self.job_queue.put(self.job_reinvestigation_timeout)
+        self._schedule_job(self.job_reinvestigation_timeout)
 
     def _schedule_queued_work(
         self, queued_endpoints, budget, endpoint_state, endpoint_work, shuffle=False
@@ -127,13 +112,13 @@ class Monitor:
     def schedule_mirroring(self):
         for endpoint in self.sdnc.not_ignored_endpoints("unknown"):
             endpoint.queue_next("operate")
-        budget = self.sdnc.investigation_budget()
         queued_endpoints = [
             endpoint
             for endpoint in self.sdnc.not_ignored_endpoints("queued")
             if endpoint.operation_requested()
         ]
         queued_endpoints = sorted(queued_endpoints, key=lambda x: x.state_time)
+        budget = self.sdnc.investigation_budget(len(queued_endpoints))
         self.logger.debug(
             "operations {0}, budget {1}, queued {2}".format(
                 str(self.sdnc.investigations), str(budget), str(len(queued_endpoints))
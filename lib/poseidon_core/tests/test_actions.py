@@ -4,11 +4,15 @@ Test module for actions
 @author: Charlie Lewis
 """
 import logging
+import threading
+import time
 
 from faucetconfgetsetter import get_sdn_connect
+from poseidon_core.helpers.actions import ActionExecutor
 from poseidon_core.helpers.actions import Actions
 from poseidon_core.helpers.config import Config
 from poseidon_core.helpers.endpoint import endpoint_factory
+from poseidon_core.helpers.prometheus import Prometheus
 
 logger = logging.getLogger("test")
 
@@ -40,3 +44,64 @@ def test_actions_nosdn():
     a.unmirror_endpoint()
     a.coprocess_endpoint()
     a.uncoprocess_endpoint()
+
+
+def test_action_executor():
+    """
+    Tests ActionExecutor runs an endpoint's operations in order
+    """
+    executor = ActionExecutor(Prometheus(), max_workers=2)
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def slow():
+        started.set()
+        release.wait(5)
+        ran.append("slow")
+        return True
+
+    executor.submit("foo", "mirror", slow)
+    started.wait(5)
+    executor.submit("foo", "unmirror", lambda: ran.append("foo") or False)
+    # other endpoints are not held up by a slow one.
+    executor.submit("bar", "mirror", lambda: ran.append("bar") or True)
+    deadline = time.time() + 5
+    while "bar" not in ran and time.time() < deadline:
+        time.sleep(0.01)
+    assert ran == ["bar"]
+    release.set()
+    completions = []
+    while len(completions) < 3 and time.time() < deadline + 5:
+        completions.append(executor.completions.get(timeout=5))
+    assert [completion[:3] for completion in completions] == [
+        ("bar", "mirror", True),
+        ("foo", "mirror", True),
+        ("foo", "unmirror", False),
+    ]
+    assert ran == ["bar", "slow", "foo"]
+
+    # with no workers, operations run inline.
+    executor = ActionExecutor(Prometheus(), max_workers=0)
+    executor.submit("foo", "mirror", lambda: True)
+    assert executor.handle_completions() == 1
+
+
+def test_action_executor_updates():
+    """
+    Tests ActionExecutor applies endpoint_data updates from the main loop
+    """
+    endpoint = endpoint_factory("foo")
+    endpoint.endpoint_data = {"mac": "00:00:00:00:00:00", "segment": "foo", "port": "1"}
+    a = Actions(endpoint, None)
+    # the worker only sees a copy of endpoint_data.
+    assert a.endpoint_data == endpoint.endpoint_data
+    assert a.endpoint_data is not endpoint.endpoint_data
+    executor = ActionExecutor(Prometheus(), max_workers=0)
+    executor.submit(
+        "foo", "mirror", lambda: a.updates.update(container_id="bar") or True, a.updates
+    )
+    assert "container_id" not in endpoint.endpoint_data
+    assert executor.handle_completions({"foo": endpoint}) == 1
+    assert endpoint.endpoint_data["container_id"] == "bar"
+    assert endpoint.dirty
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Test module for the RabbitMQ capture log.
+"""
+import os
+import tempfile
+
+from poseidon_core.helpers.capture import CaptureWriter
+from poseidon_core.helpers.capture import read_capture
+
+
+def test_capture():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        capture_path = os.path.join(tmpdir, "capture.log")
+        capture = CaptureWriter(capture_path)
+        capture.write(1.5, "FAUCET.Event", b'{"dp_name": "switch1"}')
+        capture.write(2.5, "poseidon.action.ignore", '["foo"]')
+        capture.close()
+        records = [
+            (1.5, "FAUCET.Event", b'{"dp_name": "switch1"}'),
+            (2.5, "poseidon.action.ignore", b'["foo"]'),
+        ]
+        assert list(read_capture(capture_path)) == records
+
+        # a record cut short by a crash is skipped.
+        with open(capture_path, "ab") as capture_file:
+            capture_file.write(b"\0" * 10)
+        assert list(read_capture(capture_path)) == records
@@ -5,9 +5,11 @@ Test module for endpoints.
 """
 import time
 
+import pytest
 from poseidon_core.helpers.endpoint import Endpoint
 from poseidon_core.helpers.endpoint import endpoint_factory
 from poseidon_core.helpers.endpoint import EndpointDecoder
+from transitions import MachineError
 
 
 def test_Endpoint():
@@ -29,3 +31,70 @@ def test_times_next():
     assert endpoint.copro_state_timeout(0)
     endpoint.trigger_next()
     endpoint.copro_trigger_next()
+
+
+def test_endpoint_triggers():
+    class Timers:
+        def __init__(self):
+            self.scheduled = []
+
+        def schedule(self, endpoint):
+            self.scheduled.append((endpoint.state, endpoint.copro_state))
+
+    endpoint = endpoint_factory("foo")
+    endpoint.timers = Timers()
+    assert (endpoint.state, endpoint.copro_state) == ("unknown", "copro_unknown")
+    states = []
+    for trigger in ("queue", "operate", "known", "operate", "unknown", "known"):
+        endpoint.dirty = False
+        endpoint.state_time = 0
+        getattr(endpoint, trigger)()
+        # after-callbacks update the state time, dirty flag and timers.
+        assert endpoint.state_time
+        assert endpoint.dirty
+        states.append(endpoint.state)
+    assert states == ["queued", "operating", "known", "operating", "unknown", "known"]
+    copro_states = []
+    for trigger in ("copro_queue", "copro_coprocess", "copro_suspicious"):
+        endpoint.copro_state_time = 0
+        getattr(endpoint, trigger)()
+        assert endpoint.copro_state_time
+        copro_states.append(endpoint.copro_state)
+    assert copro_states == ["copro_queued", "copro_coprocessing", "copro_suspicious"]
+    assert endpoint.timers.scheduled[-1] == ("known", "copro_suspicious")
+    assert len(endpoint.timers.scheduled) == 9
+
+
+def test_endpoint_invalid_trigger():
+    endpoint = endpoint_factory("foo")
+    endpoint.operate()
+    with pytest.raises(MachineError):
+        endpoint.queue()
+    assert endpoint.state == "operating"
+    with pytest.raises(MachineError):
+        endpoint.copro_nominal()
+    assert endpoint.copro_state == "copro_unknown"
+
+
+def test_endpoint_slots():
+    endpoint = endpoint_factory("foo")
+    assert not hasattr(endpoint, "__dict__")
+    with pytest.raises(AttributeError):
+        endpoint.unexpected = True
+
+
+def test_endpoint_shared_machine():
+    endpoint1 = endpoint_factory("foo")
+    endpoint2 = endpoint_factory("bar")
+    assert endpoint1.machine is endpoint2.machine is Endpoint.machine
+    assert endpoint1.copro_machine is endpoint2.copro_machine
+    # the machines hold no references to endpoints.
+    assert Endpoint.machine.models == []
+    endpoint1.queue()
+    endpoint2.operate()
+    endpoint1.copro_queue()
+    assert (endpoint1.state, endpoint2.state) == ("queued", "operating")
+    assert (endpoint1.copro_state, endpoint2.copro_state) == (
+        "copro_queued",
+        "copro_unknown",
+    )
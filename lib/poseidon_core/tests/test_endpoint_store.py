@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Test module for the indexed endpoint store.
+"""
+from poseidon_core.helpers.endpoint import endpoint_factory
+from poseidon_core.helpers.endpoint_store import EndpointStore
+
+
+def make_endpoint(name, mac, ipv4):
+    endpoint = endpoint_factory(name)
+    endpoint.endpoint_data = {"mac": mac, "ipv4": ipv4, "ipv6": ""}
+    return endpoint
+
+
+def test_endpoint_store():
+    foo = make_endpoint("foo", "00:00:00:00:00:01", "10.0.0.1")
+    bar = make_endpoint("bar", "00:00:00:00:00:02", "10.0.0.2")
+    endpoints = EndpointStore({"foo": foo})
+    endpoints["bar"] = bar
+    assert endpoints.by_mac("00:00:00:00:00:01") == [foo]
+    assert endpoints.by_ip("10.0.0.2") == [bar]
+    assert endpoints.by_ip("") == []
+    assert endpoints.not_ignored("unknown") == [foo, bar]
+
+    # assignments and transitions reindex.
+    foo.endpoint_data = {"mac": "00:00:00:00:00:03", "ipv4": "10.0.0.3"}
+    assert endpoints.by_mac("00:00:00:00:00:01") == []
+    assert endpoints.by_ip("10.0.0.3") == [foo]
+    foo.queue_next("operate")
+    foo.trigger_next()
+    assert endpoints.not_ignored("operating") == [foo]
+    assert endpoints.count_active() == 1
+    bar.ignore = True
+    assert endpoints.not_ignored() == [foo]
+    assert endpoints.lookup("ignore", True) == [bar]
+    bar.copro_queue()  # pytype: disable=attribute-error
+    assert endpoints.not_copro_ignored("copro_queued") == [bar]
+    bar.copro_coprocess()  # pytype: disable=attribute-error
+    assert endpoints.count_coprocessing() == 0
+    bar.ignore = False
+    assert endpoints.count_coprocessing() == 1
+
+    # changes made in place are not indexed until checked.
+    assert endpoints.unindexed() == []
+    bar.endpoint_data["ipv4"] = "10.0.0.4"
+    assert endpoints.unindexed() == ["bar"]
+    endpoints.reindex(bar)
+    assert endpoints.unindexed() == []
+    assert endpoints.by_ip("10.0.0.4") == [bar]
+
+    # removed endpoints leave the indexes.
+    del endpoints["foo"]
+    assert foo.store is None
+    assert endpoints.by_ip("10.0.0.3") == []
+    assert endpoints.not_ignored("operating") == []
+    assert endpoints.pop("bar") is bar
+    assert not endpoints
+    assert not endpoints.index
@@ -106,6 +106,39 @@ def test_format_endpoints():
         ],
     ]
     output = FaucetProxy.format_endpoints(data)
+    assert output[1]["ipv4"] == "0.0.0.0"
+    assert output[1]["ipv6"] == "::1"
+    assert data[1][0] == {"ip-state": "foo", "ip-address": "0.0.0.0"}
+
+
+def test_get_changed_endpoints():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        faucetconfgetsetter_cl = FaucetLocalConfGetSetter
+        faucetconfgetsetter_cl.DEFAULT_CONFIG_FILE = os.path.join(tmpdir, "faucet.yaml")
+        shutil.copy(SAMPLE_CONFIG, faucetconfgetsetter_cl.DEFAULT_CONFIG_FILE)
+        proxy = _get_proxy(faucetconfgetsetter_cl)
+
+        def l2_learn(mac):
+            return {
+                "dp_name": "switch",
+                "L2_LEARN": {
+                    "l3_src_ip": "10.0.0.1",
+                    "eth_src": mac,
+                    "port_no": 1,
+                    "vid": "100",
+                },
+            }
+
+        proxy.get_endpoints(
+            messages=[l2_learn("00:00:00:00:00:01"), l2_learn("00:00:00:00:00:02")],
+            changed_only=True,
+        )
+        changed = proxy.get_endpoints(
+            messages=[l2_learn("00:00:00:00:00:02")], changed_only=True
+        )
+        assert [d[0]["mac"] for d in changed] == ["00:00:00:00:00:02"]
+        assert proxy.get_endpoints(changed_only=True) == []
+        assert len(proxy.get_endpoints()) == 2
 
 
 def test_ignore_events():
@@ -5,21 +5,30 @@ Test module for poseidon.py
 Created on 28 June 2016
 @author: Charlie Lewis, dgrossman, MShel
 """
+import asyncio
 import json
 import logging
 import queue
+import threading
 import time
+from functools import partial
 
+import pytest
 import schedule
 from faucetconfgetsetter import FaucetLocalConfGetSetter
 from faucetconfgetsetter import get_sdn_connect
 from faucetconfgetsetter import get_test_config
 from poseidon_core.constants import NO_DATA
 from poseidon_core.controllers.sdnconnect import SDNConnect
+from poseidon_core.controllers.sdnevents import JobQueue
+from poseidon_core.controllers.sdnevents import MessageQueue
 from poseidon_core.controllers.sdnevents import SDNEvents
+from poseidon_core.controllers.sdnevents import Wakeup
+from poseidon_core.helpers.async_scheduler import AsyncScheduler
 from poseidon_core.helpers.config import Config
 from poseidon_core.helpers.endpoint import endpoint_factory
 from poseidon_core.helpers.metadata import DNSResolver
+from poseidon_core.helpers.prometheus import EndpointCollector
 from poseidon_core.helpers.prometheus import Prometheus
 from poseidon_core.helpers.rabbit import Rabbit
 from poseidon_core.operations.monitor import Monitor
@@ -280,6 +289,40 @@ def test_format_rabbit_message():
     assert msg_valid
 
 
+def test_register_handler():
+    sdne = SDNEvents(logger, prom, get_sdn_connect(logger))
+    seen = []
+
+    def plugin_handler(my_obj, _faucet_event, _remove_list):
+        seen.append(my_obj)
+        return my_obj
+
+    sdne.register_handler("poseidon.plugin.#", plugin_handler)
+    sdne.register_handler("poseidon.*.remove", plugin_handler)
+    faucet_event = []
+    remove_list = []
+    for routing_key in ("poseidon.plugin", "poseidon.plugin.foo.bar"):
+        assert sdne.format_rabbit_message(
+            (routing_key, {"foo": 1}), faucet_event, remove_list
+        ) == ({"foo": 1}, True)
+    assert seen == [{"foo": 1}, {"foo": 1}]
+    # exact routing keys take precedence over patterns.
+    sdne.format_rabbit_message(
+        ("poseidon.action.remove", ["bar"]), faucet_event, remove_list
+    )
+    assert remove_list == ["bar"]
+    assert len(seen) == 2
+    assert sdne.format_rabbit_message(
+        ("poseidon.other", {}), faucet_event, remove_list
+    ) == ({}, False)
+    assert (
+        REGISTRY.get_sample_value(
+            "poseidon_handler_runtime_secs_count", {"routing_key": "poseidon.plugin.#"}
+        )
+        >= 2
+    )
+
+
 def test_rabbit_callback():
     def mock_method():
         return True
@@ -300,9 +343,8 @@ def test_rabbit_callback():
         def qsize(self):
             return 1
 
-        def put(self, item):
+        def put_nowait(self, item):
             self.item = item
-            return True
 
         # used for testing to verify that we put right stuff there
         def get_item(self):
@@ -313,10 +355,58 @@ def test_rabbit_callback():
     sdne = SDNEvents(logger, prom, get_sdn_connect(logger))
     rabbit_callback = sdne.rabbit_callback
 
+    # operator actions get their own decoder, so they skip any FAUCET backlog.
     rabbit_callback(mock_channel, mock_method, "properties", '{"body": 0}', mock_queue)
-    assert mock_queue.get_item() == (mock_method.routing_key, {"body": 0})
+    assert mock_queue.get_item() is None
+    assert sdne.action_queue.empty()
+    item = sdne.raw_action_queue.get_nowait()
+    assert item[:2] == (mock_method.routing_key, '{"body": 0}')
+    sdne.decode_message(item)
+    assert sdne.action_queue.get_nowait()[:2] == (mock_method.routing_key, {"body": 0})
+
+    mock_method.routing_key = sdne.config["FA_RABBIT_ROUTING_KEY"]
+    body = b'{"dp_name": "switch1", "L2_LEARN": {}}'
+    rabbit_callback(mock_channel, mock_method, "properties", body, mock_queue)
+    assert mock_queue.get_item()[:2] == (mock_method.routing_key, body)
+
+    # only L2_LEARN FAUCET events get as far as the decoder.
+    mock_queue.item = None
+    rabbit_callback(
+        mock_channel, mock_method, "properties", b'{"dp_name": "switch1"}', mock_queue
+    )
+    assert mock_queue.get_item() is None
 
-    rabbit_callback(mock_channel, mock_method, "properties", '{"body": 0}', mock_queue)
+
+def test_put_raw():
+    sdne = SDNEvents(logger, prom, get_sdn_connect(logger))
+    acked = []
+    raw_queue = queue.Queue(maxsize=1)
+    sdne.put_raw(raw_queue, ("poseidon.action.ignore", b"[]", partial(acked.append, 1)))
+    # the pika I/O thread is never blocked on a full queue, unless the policy is to block.
+    sdne.config["overload_policy"] = "drop_oldest"
+    sdne.put_raw(raw_queue, ("poseidon.action.ignore", b"[]", partial(acked.append, 2)))
+    assert raw_queue.qsize() == 1
+    assert acked == [2]
+    assert (
+        REGISTRY.get_sample_value(
+            "poseidon_queue_dropped_total", {"queue": "raw", "reason": "drop_oldest"}
+        )
+        >= 1
+    )
+
+
+def test_decode_message():
+    sdne = SDNEvents(logger, prom, get_sdn_connect(logger))
+    acked = []
+
+    sdne.decode_message(
+        ("poseidon.action.ignore", b'["foo"]', partial(acked.append, 1))
+    )
+    assert sdne.action_queue.get_nowait()[:2] == ("poseidon.action.ignore", ["foo"])
+
+    sdne.decode_message(("poseidon.action.ignore", b"{", partial(acked.append, 2)))
+    assert sdne.action_queue.empty()
+    assert acked == [2]
 
 
 def test_find_new_machines():
@@ -422,6 +512,123 @@ def test_find_new_machines():
     s.find_new_machines(machines)
 
 
+def test_find_new_machines_changed():
+    s = get_sdn_connect(logger)
+    machine = {
+        "tenant": "vlan1",
+        "mac": "00:00:00:00:00:01",
+        "segment": "switch1",
+        "port": 1,
+        "ipv4": "10.0.0.1",
+        "ipv6": 0,
+    }
+    s.find_new_machines([dict(machine)])
+    (endpoint,) = s.endpoints.values()
+    endpoint_data = endpoint.endpoint_data
+    endpoint.dirty = False
+    s.find_new_machines([dict(machine)])
+    assert not endpoint.dirty
+
+    # changes are made in place, and reindexed.
+    machine.update({"port": 2, "ipv4": "10.0.0.2"})
+    s.find_new_machines([dict(machine)])
+    assert endpoint.dirty
+    assert endpoint.endpoint_data is endpoint_data
+    assert endpoint_data["port"] == 2
+    assert s.endpoints_by_ip("10.0.0.1") == []
+    assert s.endpoints_by_ip("10.0.0.2") == [endpoint]
+
+
+def test_find_new_machines_rdns():
+    release = threading.Event()
+
+    class FakeDNSResolver(DNSResolver):
+        @staticmethod
+        def _resolve_ip(_ip):
+            release.wait(5)
+            return "host1"
+
+    s = get_sdn_connect(logger)
+    s.dns_resolver = FakeDNSResolver()
+    machine = {
+        "tenant": "vlan1",
+        "mac": "00:00:00:00:00:01",
+        "segment": "switch1",
+        "port": 1,
+        "ipv4": "10.0.0.1",
+        "ipv6": 0,
+    }
+    # endpoints are created without waiting for rDNS.
+    s.find_new_machines([dict(machine)])
+    (endpoint,) = s.endpoints.values()
+    assert endpoint.endpoint_data["ipv4_rdns"] == NO_DATA
+    assert s.handle_rdns_results() == 0
+    release.set()
+    s.rdns_results.get(timeout=5)
+    s.rdns_results.put(("10.0.0.1", "host1"))
+    endpoint.dirty = False
+    assert s.handle_rdns_results() == 1
+    assert endpoint.dirty
+    assert endpoint.endpoint_data["ipv4_rdns"] == "host1"
+    assert not s.rdns_requested
+
+    # later passes use the cached name.
+    s.find_new_machines([dict(machine)])
+    assert endpoint.endpoint_data["ipv4_rdns"] == "host1"
+
+
+def test_check_endpoints_incremental():
+    def l2_learn(mac, ip):
+        return {
+            "dp_name": "switch1",
+            "L2_LEARN": {
+                "l3_src_ip": ip,
+                "eth_src": mac,
+                "port_no": 1,
+                "vid": "100",
+            },
+        }
+
+    messages = [
+        [l2_learn("00:00:00:00:00:01", "None"), l2_learn("00:00:00:00:00:02", "None")],
+        [l2_learn("00:00:00:00:00:02", "None")],
+        [l2_learn("00:00:00:00:00:03", "None"), l2_learn("00:00:00:00:00:01", "None")],
+        # a public address hides the MAC, so its endpoint is no longer touched.
+        [l2_learn("00:00:00:00:00:03", "8.8.8.8")],
+        [l2_learn("00:00:00:00:00:02", "None")],
+    ]
+    results = []
+    touched = []
+    for incremental in (False, True):
+        s = get_sdn_connect(logger)
+        s.config["incremental_discovery"] = incremental
+        s.sdnc.learn_pub_adds = False
+        mode_touched = []
+        for batch in messages:
+            for endpoint in s.endpoints.values():
+                endpoint.observed_time = 0
+            s.check_endpoints(batch)
+            mode_touched.append(
+                sorted(
+                    endpoint.endpoint_data["mac"]
+                    for endpoint in s.endpoints.values()
+                    if endpoint.observed_time
+                )
+            )
+        results.append({name: ep.endpoint_data for name, ep in s.endpoints.items()})
+        touched.append(mode_touched)
+    assert len(results[0]) == 3
+    assert results[0] == results[1]
+    # every endpoint still seen by the controller is touched, in both modes.
+    assert touched[0] == touched[1]
+    assert touched[0][2] == [
+        "00:00:00:00:00:01",
+        "00:00:00:00:00:02",
+        "00:00:00:00:00:03",
+    ]
+    assert touched[0][4] == ["00:00:00:00:00:01", "00:00:00:00:00:02"]
+
+
 def test_Monitor_init():
     config = get_test_config()
     sdnc = SDNConnect(
@@ -501,7 +708,7 @@ def test_Monitor_init():
             "ipv6": "0",
         },
     ]
-    monitor.prom.update_metrics(hosts)
+    assert EndpointCollector.host_samples(hosts)
     sdne.update_prom_var_time("last_rabbitmq_routing_key_time", "routing_key", "foo")
 
 
@@ -639,7 +846,6 @@ def test_process():
     assert mock_monitor.sdnc.investigation_budget()
     assert mock_monitor.sdnc.coprocessing_budget()
     handlers = [
-        mock_monitor.job_update_metrics,
         mock_monitor.job_reinvestigation_timeout,
         mock_monitor.job_recoprocess,
         mock_monitor.schedule_mirroring,
@@ -712,3 +918,381 @@ def test_merge_machine():
     s.merge_machine_ip(old_machine, new_machine)
     assert old_machine["ipv4"] == new_machine["ipv4"]
     assert new_machine["ipv6"] == new_machine["ipv6"]
+
+
+def test_process_once():
+    config = get_test_config()
+    sdnc = SDNConnect(
+        config, logger, prom, faucetconfgetsetter_cl=FaucetLocalConfGetSetter
+    )
+    sdne = SDNEvents(logger, prom, sdnc)
+    monitor = Monitor(logger, config, schedule.Scheduler(), sdne.job_queue, sdnc, prom)
+    sdne.max_loop_wait = 0.1
+    assert sdne.wait_for_work(monitor) is None
+
+    jobs = []
+    for _ in range(3):
+        sdne.job_queue.put(lambda: jobs.append(1) or 1)
+    start_time = time.time()
+    set_time = sdne.wait_for_work(monitor)
+    assert set_time is not None
+    assert time.time() - start_time < 1
+    assert sdne.process_once(monitor) == 3
+    assert len(jobs) == 3
+    assert sdne.job_queue.empty()
+
+
+def test_job_queue():
+    config = get_test_config()
+    sdnc = SDNConnect(
+        config, logger, prom, faucetconfgetsetter_cl=FaucetLocalConfGetSetter
+    )
+    sdne = SDNEvents(logger, prom, sdnc)
+    monitor = Monitor(logger, config, schedule.Scheduler(), sdne.job_queue, sdnc, prom)
+    jobs = []
+
+    def job_a():
+        jobs.append("a")
+        return 1
+
+    def job_b():
+        jobs.append("b")
+        return 1
+
+    # a job already queued is coalesced, rather than run again.
+    sdne.job_queue.put(job_a)
+    sdne.job_queue.put(job_b)
+    sdne.job_queue.put_nowait(job_a)
+    assert sdne.job_queue.qsize() == 2
+    # jobs not yet due wait, and shorten the loop timeout.
+    sdne.job_queue.put(lambda: jobs.append("later") or 1, due_time=time.time() + 1)
+    assert sdne.loop_timeout(monitor) <= 1
+    assert sdne.process_once(monitor) == 2
+    assert jobs == ["a", "b"]
+    assert sdne.job_queue.qsize() == 1
+
+    # jobs left over when the time budget runs out are run next time.
+    sdne.batch_time_budget = 0
+    sdne.job_queue.put(job_a)
+    sdne.job_queue.put(job_b)
+    assert sdne.handle_jobs() == 1
+    assert sdne.handle_jobs() == 1
+    assert jobs == ["a", "b", "a", "b"]
+
+    # a full queue still coalesces a job already queued.
+    job_queue = JobQueue(Wakeup(), maxsize=1)
+    job_queue.put(job_a)
+    job_queue.put(job_a, timeout=0)
+    assert job_queue.qsize() == 1
+    with pytest.raises(queue.Full):
+        job_queue.put(job_b, timeout=0)
+    with pytest.raises(queue.Full):
+        job_queue.put_nowait(job_b)
+
+
+def test_job_queue_concurrent_put():
+    job_queue = JobQueue(Wakeup())
+    jobs = [partial(time.time) for _ in range(100)]
+    barrier = threading.Barrier(4)
+
+    def put_jobs():
+        barrier.wait()
+        for job in jobs:
+            job_queue.put(job)
+
+    threads = [threading.Thread(target=put_jobs) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # each job is queued once, however many threads put it.
+    assert job_queue.qsize() == len(jobs)
+
+
+def test_check_endpoint_store():
+    sdnc = get_sdn_connect(logger)
+    endpoint = endpoint_factory("foo")
+    endpoint.endpoint_data = {"mac": "00:00:00:00:00:01", "ipv4": "10.0.0.1"}
+    sdnc.endpoints[endpoint.name] = endpoint
+    endpoint.endpoint_data["ipv4"] = "10.0.0.2"
+    # self checks only run in debug mode.
+    sdnc.investigation_budget()
+    assert sdnc.endpoints.unindexed() == ["foo"]
+    sdnc.logger = logging.getLogger("test_debug")
+    sdnc.logger.setLevel(logging.DEBUG)
+    sdnc.investigation_budget()
+    assert sdnc.endpoints.unindexed() == []
+    assert sdnc.endpoints_by_ip("10.0.0.2") == [endpoint]
+
+
+def test_endpoint_collector():
+    def samples(collector, metric_name):
+        return [
+            sample
+            for metric in collector.collect()
+            if metric.name == metric_name
+            for sample in metric.samples
+        ]
+
+    sdnc = get_sdn_connect(logger)
+    collector = EndpointCollector(lambda: sdnc.endpoints)
+    assert samples(collector, "poseidon_endpoint_state") == []
+    sdnc.check_endpoints(
+        [
+            {
+                "dp_name": "switch1",
+                "L2_LEARN": {
+                    "l3_src_ip": "10.0.0.%u" % i,
+                    "eth_src": "00:00:00:00:00:0%u" % i,
+                    "port_no": i,
+                    "vid": 100,
+                },
+            }
+            for i in (1, 2)
+        ]
+    )
+    endpoints = list(sdnc.endpoints.values())
+    assert len(endpoints) == 2
+    assert all(endpoint.dirty for endpoint in endpoints)
+    states = samples(collector, "poseidon_endpoint_state")
+    assert {sample.labels["state"] for sample in states} == {"unknown"}
+    assert len(states) == 2
+    assert not any(endpoint.dirty for endpoint in endpoints)
+    assert samples(collector, "poseidon_endpoint_port_hosts")
+
+    # clean endpoints are exported from the cache.
+    cached = collector.endpoint_samples[endpoints[1].name]
+    endpoints[0].queue_next("operate")
+    endpoints[0].operate()  # pytype: disable=attribute-error
+    assert endpoints[0].dirty
+    assert not endpoints[1].dirty
+    states = samples(collector, "poseidon_endpoint_state")
+    assert sorted(sample.labels["state"] for sample in states) == [
+        "operating",
+        "unknown",
+    ]
+    assert collector.endpoint_samples[endpoints[1].name] is cached
+
+    # label changes replace series, so the exporter does not grow with churn.
+    exported_series = samples(collector, "poseidon_exported_series")
+    for _ in range(3):
+        endpoints[0].known()  # pytype: disable=attribute-error
+        endpoints[0].queue_next("operate")
+        endpoints[0].operate()  # pytype: disable=attribute-error
+        assert samples(collector, "poseidon_exported_series") == exported_series
+    series = {sample.labels["metric"]: sample.value for sample in exported_series}
+    assert series["poseidon_endpoint_metadata"] == 2
+
+    # a removed endpoint's series disappear with the next scrape.
+    sdne = SDNEvents(logger, prom, sdnc)
+    sdne.m_queue.put(("poseidon.action.remove", [endpoints[0].name]))
+    sdne.process_once(
+        Monitor(logger, sdnc.config, schedule.Scheduler(), sdne.job_queue, sdnc, prom)
+    )
+    assert endpoints[0].name not in sdnc.endpoints
+    states = samples(collector, "poseidon_endpoint_state")
+    assert [sample.labels["hash_id"] for sample in states] == [endpoints[1].name]
+    assert list(collector.endpoint_samples) == [endpoints[1].name]
+    series = {
+        sample.labels["metric"]: sample.value
+        for sample in samples(collector, "poseidon_exported_series")
+    }
+    assert series["poseidon_endpoint_metadata"] == 1
+
+
+def test_reinvestigation_timeout():
+    sdnc = get_sdn_connect(logger)
+    monitor = Monitor(
+        logger, sdnc.config, schedule.Scheduler(), queue.Queue(), sdnc, prom
+    )
+    sdnc.check_endpoints(
+        [
+            {
+                "dp_name": "switch1",
+                "L2_LEARN": {
+                    "l3_src_ip": "10.0.0.%u" % i,
+                    "eth_src": "00:00:00:00:00:0%u" % i,
+                    "port_no": i,
+                    "vid": 100,
+                },
+            }
+            for i in (1, 2)
+        ]
+    )
+    stale, fresh = sdnc.endpoints.values()
+    stale.known()
+    fresh.known()
+    stale.observed_time = 0
+    sdnc.timers.schedule(stale)
+    monitor.job_reinvestigation_timeout()
+    assert stale.state == "unknown"
+    assert fresh.state != "unknown"
+    # the timed out endpoint is still tracked, and is checked again next time.
+    assert len(sdnc.timers.reinvestigation) == 2
+
+
+def test_handle_rabbit_coalesce():
+    sdne = SDNEvents(logger, prom, get_sdn_connect(logger))
+    sdne.max_batch_size = 4
+
+    def l2_learn(mac, port, ip="10.0.0.1"):
+        return {
+            "dp_name": "switch1",
+            "L2_LEARN": {
+                "l3_src_ip": ip,
+                "eth_src": mac,
+                "port_no": port,
+                "vid": 100,
+            },
+        }
+
+    for port in (1, 2, 3):
+        sdne.m_queue.put(("FAUCET.Event", l2_learn("00:00:00:00:00:01", port)))
+    sdne.m_queue.put(("FAUCET.Event", l2_learn("00:00:00:00:00:02", 1)))
+    sdne.m_queue.put(("FAUCET.Event", l2_learn("00:00:00:00:00:03", 1)))
+    events, faucet_event, _ = sdne.handle_rabbit()
+    assert events == 4
+    assert faucet_event == [
+        l2_learn("00:00:00:00:00:01", 3),
+        l2_learn("00:00:00:00:00:02", 1),
+    ]
+    assert sdne.m_queue.qsize() == 1
+
+    # a dual stack host keeps both addresses.
+    sdne.m_queue.get_nowait()
+    sdne.m_queue.put(("FAUCET.Event", l2_learn("00:00:00:00:00:04", 1)))
+    sdne.m_queue.put(("FAUCET.Event", l2_learn("00:00:00:00:00:04", 1, "fe80::1")))
+    sdne.m_queue.put(("FAUCET.Event", l2_learn("00:00:00:00:00:04", 2)))
+    _, faucet_event, _ = sdne.handle_rabbit()
+    assert faucet_event == [
+        l2_learn("00:00:00:00:00:04", 1, "fe80::1"),
+        l2_learn("00:00:00:00:00:04", 2),
+    ]
+
+
+def test_process_async():
+    config = get_test_config()
+    config["reinvestigation_frequency"] = 0.1
+    sdnc = SDNConnect(
+        config, logger, prom, faucetconfgetsetter_cl=FaucetLocalConfGetSetter
+    )
+    sdne = SDNEvents(logger, prom, sdnc)
+    jobs = []
+
+    async def run():
+        sdne.use_asyncio(asyncio.get_running_loop())
+        scheduler = AsyncScheduler()
+        monitor = Monitor(logger, config, scheduler, sdne.job_queue, sdnc, prom)
+        monitor.job_reinvestigation_timeout = lambda: jobs.append(1) or 0
+        process = asyncio.create_task(sdne.process_async(monitor))
+        await asyncio.sleep(0.5)
+        process.cancel()
+        scheduler.clear()
+
+    asyncio.run(run())
+    assert len(jobs) >= 2
+
+
+def test_message_queue_overload():
+    def message(mac, port, ip=None):
+        l2_learn = {"eth_src": mac, "port_no": port, "vid": 100}
+        if ip:
+            l2_learn["l3_src_ip"] = ip
+        return ("FAUCET.Event", {"dp_name": "switch1", "L2_LEARN": l2_learn})
+
+    sdne = SDNEvents(logger, prom, get_sdn_connect(logger))
+    dropped = []
+
+    def on_drop(item, reason):
+        dropped.append((item, reason))
+
+    q = MessageQueue(
+        Wakeup(),
+        maxsize=2,
+        overload_policy="drop_oldest",
+        message_key=sdne.faucet_message_key,
+        on_drop=on_drop,
+    )
+    q.put(("poseidon.action.ignore", ["foo"]))
+    q.put(message("00:00:00:00:00:01", 1))
+    q.put(message("00:00:00:00:00:02", 1))
+    assert dropped == [(message("00:00:00:00:00:01", 1), "drop_oldest")]
+    assert [q.get_nowait() for _ in range(q.qsize())] == [
+        ("poseidon.action.ignore", ["foo"]),
+        message("00:00:00:00:00:02", 1),
+    ]
+
+    dropped.clear()
+    q = MessageQueue(
+        Wakeup(),
+        maxsize=2,
+        overload_policy="coalesce",
+        message_key=sdne.faucet_message_key,
+        on_drop=on_drop,
+    )
+    q.put(message("00:00:00:00:00:01", 1))
+    q.put(message("00:00:00:00:00:02", 1))
+    q.put(message("00:00:00:00:00:01", 2))
+    assert dropped == [(message("00:00:00:00:00:01", 1), "coalesce")]
+    assert [q.get_nowait() for _ in range(q.qsize())] == [
+        message("00:00:00:00:00:01", 2),
+        message("00:00:00:00:00:02", 1),
+    ]
+
+    # events for another address of the same MAC are not coalesced.
+    dropped.clear()
+    q.put(message("00:00:00:00:00:01", 1, "10.0.0.1"))
+    q.put(message("00:00:00:00:00:01", 1, "fe80::1"))
+    q.put(message("00:00:00:00:00:01", 2, "10.0.0.1"))
+    assert dropped == [(message("00:00:00:00:00:01", 1, "10.0.0.1"), "coalesce")]
+    assert [q.get_nowait() for _ in range(q.qsize())] == [
+        message("00:00:00:00:00:01", 2, "10.0.0.1"),
+        message("00:00:00:00:00:01", 1, "fe80::1"),
+    ]
+
+
+def test_handle_rabbit_priority():
+    sdne = SDNEvents(logger, prom, get_sdn_connect(logger))
+    sdne.max_batch_size = 3
+    endpoint = endpoint_factory("foo")
+    endpoint.endpoint_data = {
+        "tenant": "foo",
+        "mac": "00:00:00:00:00:00",
+        "segment": "foo",
+        "port": "1",
+    }
+    sdne.sdnc.endpoints[endpoint.name] = endpoint
+    for i in range(5):
+        sdne.m_queue.put(
+            (
+                "FAUCET.Event",
+                {"dp_name": "switch1", "L2_LEARN": {"eth_src": str(i), "vid": 1}},
+                None,
+                time.time(),
+            )
+        )
+    sdne.decode_message(("poseidon.action.ignore", b'["foo"]', None, time.time()))
+
+    events, faucet_event, _ = sdne.handle_rabbit()
+    assert events == 3
+    assert endpoint.ignore
+    assert len(faucet_event) == 2
+    assert sdne.m_queue.qsize() == 3
+    assert (
+        REGISTRY.get_sample_value(
+            "poseidon_message_latency_secs_count", {"lane": "actions"}
+        )
+        >= 1
+    )
+
+
+def test_deferred_ack():
+    sdne = SDNEvents(logger, prom, get_sdn_connect(logger))
+    monitor = Monitor(
+        logger, get_test_config(), schedule.Scheduler(), sdne.job_queue, sdne.sdnc, prom
+    )
+    acked = []
+    sdne.m_queue.put(("poseidon.action.ignore", ["foo"], lambda: acked.append(1)))
+    assert not acked
+    sdne.process_once(monitor)
+    assert acked == [1]
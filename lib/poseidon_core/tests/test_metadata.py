@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Test module for endpoint metadata lookups.
+"""
+import os
+import socket
+import tempfile
+import threading
+
+from poseidon_core.constants import NO_DATA
+from poseidon_core.helpers.metadata import DNSResolver
+from poseidon_core.helpers.metadata import get_ether_vendor
+from poseidon_core.helpers.metadata import OUIIndex
+
+
+def test_get_ether_vendor():
+    lookup_path = os.path.join(
+        os.path.dirname(__file__),
+        "..",
+        "poseidon_core",
+        "metadata",
+        "nmap-mac-prefixes.txt",
+    )
+    assert get_ether_vendor("3c:d9:2b:00:00:01", lookup_path) == "HP"
+    assert get_ether_vendor("00:00:00:00:00:01", "/nonexistent") == NO_DATA
+
+
+def test_oui_index():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        lookup_path = os.path.join(tmpdir, "prefixes.txt")
+        with open(lookup_path, "w") as f:
+            f.write("0E0000\tShortVendor\n0E00001\tLongVendor Inc\n")
+        oui_index = OUIIndex(lookup_path, check_interval=0)
+        # longer MA-M/MA-S prefixes win over the OUI.
+        assert oui_index.lookup("0e:00:00:10:00:00") == "LongVendor"
+        assert oui_index.lookup("0e:00:00:20:00:00") == "ShortVendor"
+        assert oui_index.lookup("0e:00:01:00:00:00") is None
+
+        # a changed file is reloaded.
+        with open(lookup_path, "w") as f:
+            f.write("0E0001\tOtherVendor\n")
+        assert oui_index.lookup("0e:00:01:00:00:00") == "OtherVendor"
+        os.remove(lookup_path)
+        assert oui_index.lookup("0e:00:01:00:00:00") == NO_DATA
+
+
+def test_dns_resolver_cache():
+    lookups = []
+    release = threading.Event()
+
+    class FakeDNSResolver(DNSResolver):
+        @staticmethod
+        def _resolve_ip(ip):
+            lookups.append(ip)
+            if ip == "10.0.0.3":
+                release.wait(5)
+            if ip == "10.0.0.1":
+                return "host1"
+            return NO_DATA
+
+    resolver = FakeDNSResolver(timeout=0.5)
+    assert resolver.resolve_ips(["10.0.0.1", "10.0.0.2"]) == {
+        "10.0.0.1": "host1",
+        "10.0.0.2": NO_DATA,
+    }
+    # hits are cached, and negative results for negative_ttl.
+    assert resolver.resolve_ips(["10.0.0.1", "10.0.0.2"]) == {
+        "10.0.0.1": "host1",
+        "10.0.0.2": NO_DATA,
+    }
+    assert sorted(lookups) == ["10.0.0.1", "10.0.0.2"]
+
+    # slow lookups time out, but are cached when they complete.
+    assert resolver.resolve_ips(["10.0.0.3"]) == {"10.0.0.3": NO_DATA}
+    assert resolver.resolve_ips(["10.0.0.3"]) == {"10.0.0.3": NO_DATA}
+    assert lookups.count("10.0.0.3") == 1
+    future = resolver.submit("10.0.0.3")
+    release.set()
+    future.result()
+    assert resolver.cached("10.0.0.3") == NO_DATA
+
+
+def test_dns_resolver_errors():
+    class FailingDNSResolver(DNSResolver):
+        @staticmethod
+        def _resolve_ip(ip):
+            if ip == "10.0.0.2":
+                raise RuntimeError("unexpected")
+            return DNSResolver._resolve_ip(ip)
+
+    resolver = FailingDNSResolver()
+    # a name that cannot be encoded fails in getnameinfo, not with gaierror.
+    assert DNSResolver._resolve_ip("\ud800") == NO_DATA
+    results = []
+    done = threading.Event()
+
+    def callback(ip, result):
+        results.append((ip, result))
+        done.set()
+
+    assert resolver.resolve_ip_async("10.0.0.2", callback) is None
+    assert done.wait(5)
+    assert results == [("10.0.0.2", NO_DATA)]
+    # the failed lookup is no longer pending, and is not cached, to be retried.
+    assert resolver.pending == {}
+    assert resolver.cached("10.0.0.2") is None
+    assert resolver.resolve_ips(["10.0.0.2"]) == {"10.0.0.2": NO_DATA}
+
+
+def test_dns_resolver_retries():
+    lookups = []
+
+    class FlakyDNSResolver(DNSResolver):
+        @staticmethod
+        def _resolve_ip(ip):
+            lookups.append(ip)
+            if ip == "10.0.0.1" and lookups.count(ip) < 3:
+                raise socket.gaierror(socket.EAI_AGAIN, "try again")
+            if ip == "10.0.0.2":
+                raise socket.gaierror(socket.EAI_AGAIN, "try again")
+            return "host1"
+
+    resolver = FlakyDNSResolver(retry_backoff=0)
+    # transient failures are retried.
+    assert resolver.resolve_ips(["10.0.0.1"]) == {"10.0.0.1": "host1"}
+    assert lookups.count("10.0.0.1") == 3
+    # but not cached when retries run out.
+    assert resolver.resolve_ips(["10.0.0.2"]) == {"10.0.0.2": NO_DATA}
+    assert lookups.count("10.0.0.2") == 3
+    assert resolver.cached("10.0.0.2") is None
+
+
+def test_dns_resolver_negative(monkeypatch):
+    def getnameinfo(sockaddr, _flags):
+        raise socket.gaierror(socket.EAI_NONAME, "unknown")
+
+    monkeypatch.setattr(socket, "getnameinfo", getnameinfo)
+    resolver = DNSResolver()
+    # a name that does not exist is cached as negative.
+    assert resolver.resolve_ips(["10.0.0.3"]) == {"10.0.0.3": NO_DATA}
+    assert resolver.cached("10.0.0.3") == NO_DATA
+
+
+def test_dns_resolver_expire():
+    release = threading.Event()
+
+    class SlowDNSResolver(DNSResolver):
+        @staticmethod
+        def _resolve_ip(_ip):
+            release.wait(5)
+            return "host1"
+
+    resolver = SlowDNSResolver(timeout=0)
+    results = []
+    assert (
+        resolver.resolve_ip_async("10.0.0.1", lambda *args: results.append(args))
+        is None
+    )
+    # lookups still running after timeout are reported as NO_DATA.
+    assert resolver.expire() == 1
+    assert results == [("10.0.0.1", NO_DATA)]
+    assert resolver.expire() == 0
+    # and are cached when they complete, but not reported again.
+    future = resolver.submit("10.0.0.1")
+    release.set()
+    future.result()
+    assert results == [("10.0.0.1", NO_DATA)]
+    assert resolver.cached("10.0.0.1") == "host1"
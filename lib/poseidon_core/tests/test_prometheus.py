@@ -3,14 +3,16 @@
 Test module for prometheus
 @author: Charlie Lewis
 """
+from poseidon_core.helpers.prometheus import EndpointCollector
 from poseidon_core.helpers.prometheus import Prometheus
+from prometheus_client import CollectorRegistry
+from prometheus_client import generate_latest
 
 
 def test_Prometheus():
     """
     Tests Prometheus
     """
-    p = Prometheus.get_metrics()
     hosts = [
         {
             "active": 0,
@@ -78,8 +80,11 @@ def test_Prometheus():
             "id": "foo5",
         },
     ]
-    p = Prometheus()
-    p.update_metrics(hosts)
+    samples = EndpointCollector.host_samples(hosts)
+    assert ("roles", ["unknown"], 5) in samples
+    assert ("port_hosts", ["1"], 4) in samples
+    assert ("port_tenants", ["2", "vlan1"], 1) in samples
+    assert len([sample for sample in samples if sample[0] == "ipv4_table"]) == 5
 
 
 def test_decode_endpoints():
@@ -131,3 +136,43 @@ def test_decode_endpoints():
     assert roles == ("Administrator workstation", "GPU laptop", "Developer workstation")
     assert confidences == (1.0, 0.0006269307506632729, 0.000399485844886532)
     assert pcap_labels == "foo"
+
+
+def test_endpoint_collector_no_data():
+    hashes = {
+        "foo": {
+            "hash_id": "foo",
+            "mac": "00:00:00:00:00:01",
+            "name": "None",
+            "port": "1",
+            "segment": "switch1",
+            "tenant": "VLAN100",
+            "state": "operating",
+            "ether_vendor": "Micro-Star",
+            "controller_type": "faucet",
+            "ipv4_address": "192.168.3.131",
+        }
+    }
+    # a restored endpoint, with no second or third role confidence.
+    role_hashes = {
+        "foo": {
+            "mac": "00:00:00:00:00:01",
+            "pcap_labels": "foo",
+            "top_confidence": 1.0,
+            "top_role": "Administrator workstation",
+        }
+    }
+    endpoints = Prometheus.prom_endpoints(hashes, role_hashes)
+    registry = CollectorRegistry()
+    registry.register(EndpointCollector(lambda: endpoints))
+    assert b"poseidon_role_confidence_top{" in generate_latest(registry)
+    confidences = {
+        metric.name: [sample.value for sample in metric.samples]
+        for metric in registry.collect()
+        if metric.name.startswith("poseidon_role_confidence")
+    }
+    assert confidences == {
+        "poseidon_role_confidence_top": [1.0],
+        "poseidon_role_confidence_second": [],
+        "poseidon_role_confidence_third": [],
+    }
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Test module for the RabbitMQ helper.
+"""
+from poseidon_core.helpers.rabbit import Rabbit
+
+
+class MockConnection:
+    def __init__(self):
+        self.timers = []
+
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+    def call_later(self, delay, callback):
+        self.timers.append((delay, callback))
+
+
+class MockChannel:
+    def __init__(self):
+        self.connection = MockConnection()
+        self.acks = []
+        self.prefetch_count = None
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+    def basic_qos(self, prefetch_count=0):
+        self.prefetch_count = prefetch_count
+
+    def basic_consume(self, queue_name, callback):
+        return
+
+    def start_consuming(self):
+        return
+
+
+def test_start_channel_prefetch():
+    rabbit = Rabbit(prefetch_count=50)
+    rabbit.channel = MockChannel()
+    rabbit.start_channel(lambda *args, **kwargs: None, None)
+    assert rabbit.channel.prefetch_count == 50
+    rabbit.mq_recv_thread.join()
+
+
+def test_batched_ack():
+    rabbit = Rabbit(ack_batch_size=3, ack_interval=0.1)
+    rabbit.channel = MockChannel()
+    rabbit.ack(2)
+    rabbit.ack(3)
+    # 1 is still outstanding, so nothing may be acked yet.
+    assert rabbit.channel.acks == []
+    assert not rabbit.channel.connection.timers
+    rabbit.ack(1)
+    assert rabbit.channel.acks == [(3, True)]
+    rabbit.ack(4)
+    assert rabbit.channel.acks == [(3, True)]
+    delay, flush = rabbit.channel.connection.timers.pop()
+    assert delay == 0.1
+    rabbit.ack(5)
+    assert not rabbit.channel.connection.timers
+    flush()
+    assert rabbit.channel.acks == [(3, True), (5, True)]
+    flush()
+    assert rabbit.channel.acks == [(3, True), (5, True)]
+
+
+def test_unbatched_ack():
+    rabbit = Rabbit()
+    rabbit.channel = MockChannel()
+    for delivery_tag in range(1, 4):
+        rabbit.ack(delivery_tag)
+    assert rabbit.channel.acks == [(1, True), (2, True), (3, True)]
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Test module for sharded endpoint processing.
+"""
+import json
+import logging
+import queue
+import socket
+
+from faucetconfgetsetter import FaucetLocalConfGetSetter
+from faucetconfgetsetter import get_sdn_connect
+from poseidon_core.controllers.faucet.faucet import FaucetProxy
+from poseidon_core.controllers.shards import forward_shard_message
+from poseidon_core.controllers.shards import machine_shard
+from poseidon_core.controllers.shards import shard_for
+from poseidon_core.controllers.shards import ShardCoordinator
+from poseidon_core.controllers.shards import ShardMetricsCollector
+from poseidon_core.controllers.shards import ShardRouter
+from poseidon_core.helpers.config import Config
+from poseidon_core.helpers.endpoint import Endpoint
+from poseidon_core.helpers.endpoint import endpoint_factory
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import start_http_server
+
+logger = logging.getLogger("test")
+
+
+def test_shard_for():
+    hashes = [
+        Endpoint.make_hash({"tenant": "VLAN100", "mac": "0e:00:00:00:00:%02x" % i})
+        for i in range(256)
+    ]
+    shards = [shard_for(h, 4) for h in hashes]
+    assert shards == [shard_for(h, 4) for h in hashes]
+    assert set(shards) == {0, 1, 2, 3}
+
+
+def test_shard_router():
+    class MockMethod:
+        routing_key = "FAUCET.Event"
+        delivery_tag = "test_delivery_tag"
+
+    class MockChannel:
+        acked = []
+
+        def basic_ack(self, delivery_tag):
+            self.acked.append(delivery_tag)
+
+    shard_queues = [queue.Queue() for _ in range(4)]
+    router = ShardRouter(Config().get_config(), shard_queues)
+    message = {
+        "dp_name": "switch1",
+        "L2_LEARN": {
+            "l3_src_ip": "10.0.0.1",
+            "eth_src": "00:00:00:00:00:01",
+            "port_no": 1,
+            "vid": 100,
+        },
+    }
+    channel = MockChannel()
+    router.rabbit_callback(channel, MockMethod(), None, json.dumps(message))
+    shard = machine_shard(
+        {"tenant": "VLAN100", "mac": "00:00:00:00:00:01", "segment": "switch1"}, 4
+    )
+    assert [q.qsize() for q in shard_queues] == [int(i == shard) for i in range(4)]
+    # acked only once the shard has handled it.
+    assert channel.acked == []
+    routing_key, body, ack_id = shard_queues[shard].get_nowait()
+    assert routing_key == "FAUCET.Event"
+    router.message_done(ack_id)
+    assert channel.acked == ["test_delivery_tag"]
+
+    # messages for every shard are acked once all of them are done.
+    MockMethod.routing_key = "poseidon.action.ignore"
+    router.rabbit_callback(channel, MockMethod(), None, json.dumps(["foo"]))
+    done_queue = queue.Queue()
+
+    class MockSDNEvents:
+        queued = []
+
+        @staticmethod
+        def ignore_rabbit(_routing_key, _body):
+            return False
+
+        def queue_message(self, item):
+            self.queued.append(item)
+
+    sdne = MockSDNEvents()
+    for shard_queue in shard_queues:
+        forward_shard_message(sdne, done_queue, shard_queue.get_nowait())
+    assert [item[:2] for item in sdne.queued] == [
+        ("poseidon.action.ignore", ["foo"])
+    ] * 4
+    for item in sdne.queued:
+        assert channel.acked == ["test_delivery_tag"]
+        item[2]()
+        router.message_done(done_queue.get_nowait())
+    assert channel.acked == ["test_delivery_tag"] * 2
+    assert router.pending == {}
+
+    assert router.shards_for_message("FAUCET.Event", {"dp_name": "switch1"}) == []
+    assert router.shards_for_message("poseidon.action.ignore", ["foo"]) == [
+        0,
+        1,
+        2,
+        3,
+    ]
+
+
+def test_shard_coordinator():
+    coordinator = ShardCoordinator(2)
+    assert coordinator.claim(0, 0, 5, 3) == 3
+    assert coordinator.claim(1, 0, 5, 3) == 0
+    assert coordinator.claim(0, 1, 0, 3) == 0
+    assert coordinator.claim(1, 0, 5, 3) == 2
+    assert coordinator.total() == 3
+
+
+def test_shard_investigation_budget():
+    coordinator = ShardCoordinator(2)
+    s = get_sdn_connect(logger)
+    endpoint = endpoint_factory("foo")
+    endpoint.endpoint_data = {
+        "tenant": "foo",
+        "mac": "00:00:00:00:00:00",
+        "segment": "foo",
+        "port": "1",
+    }
+    s.endpoints[endpoint.name] = endpoint
+    shard = machine_shard(endpoint.endpoint_data, 2)
+    s.use_shard(1 - shard, 2, coordinator)
+    assert not s.endpoints
+    s.use_shard(shard, 2, coordinator)
+    assert s.config["max_concurrent_reinvestigations"] == 2
+    assert s.investigation_budget(1) == 1
+    assert s.investigation_budget(5) == 2
+    coordinator.claim(1 - shard, 2, 0, 2)
+    assert s.investigation_budget(5) == 0
+
+
+def test_shard_mirrors():
+    class MockFaucetConfRpc:
+        def __init__(self):
+            self.mirrored = set()
+
+        def mirror_port(self, switch, _mirror_port, port):
+            self.mirrored.add((switch, port))
+
+        def unmirror_port(self, switch, _mirror_port, port):
+            self.mirrored.discard((switch, port))
+
+        def get_port_conf(self, _switch, _port):
+            return {"output_only": True}
+
+        def get_switch_conf(self, _switch):
+            return {}
+
+    coordinator = ShardCoordinator(2)
+    frpc = MockFaucetConfRpc()
+    proxies = []
+    # two MACs on the same port, owned by different shards.
+    for shard, mac in enumerate(("00:00:00:00:00:01", "00:00:00:00:00:02")):
+        s = get_sdn_connect(logger)
+        s.sdnc = FaucetProxy(
+            s.config,
+            mirror_ports={"switch1": 99},
+            faucetconfgetsetter_cl=FaucetLocalConfGetSetter,
+        )
+        s.sdnc.frpc = frpc
+        s.sdnc.mac_table[mac] = [{"segment": "switch1", "port": "1"}]
+        s.use_shard(shard, 2, coordinator)
+        proxies.append((s.sdnc, mac))
+    for proxy, mac in proxies:
+        assert proxy.mirror_mac(mac, None, None)
+    assert dict(coordinator.mirror_counts) == {("switch1", 1): 2}
+    proxy, mac = proxies[0]
+    assert proxy.unmirror_mac(mac, None, None)
+    # the other shard still mirrors the port.
+    assert frpc.mirrored == {("switch1", 1)}
+    proxy, mac = proxies[1]
+    assert proxy.unmirror_mac(mac, None, None)
+    assert frpc.mirrored == set()
+    assert dict(coordinator.mirror_counts) == {}
+    coordinator.manager.shutdown()
+
+
+def test_shard_metrics_collector():
+    def free_port():
+        with socket.socket() as sock:
+            sock.bind(("localhost", 0))
+            return sock.getsockname()[1]
+
+    servers = []
+    ports = []
+    for shard in range(2):
+        registry = CollectorRegistry()
+        Gauge("poseidon_endpoints", "All endpoints", ["mac"], registry=registry).labels(
+            mac="00:00:00:00:00:0%u" % shard
+        ).set(shard)
+        Counter("poseidon_ncapture_count", "ncapture runs", registry=registry).inc()
+        ports.append(free_port())
+        servers.append(start_http_server(ports[-1], registry=registry)[0])
+    # a shard that is not exporting is left out.
+    ports.append(free_port())
+    collector = ShardMetricsCollector(ports, timeout=1)
+    registry = CollectorRegistry()
+    registry.register(collector)
+    try:
+        for shard in range(2):
+            assert (
+                registry.get_sample_value(
+                    "poseidon_endpoints",
+                    {"mac": "00:00:00:00:00:0%u" % shard, "shard": str(shard)},
+                )
+                == shard
+            )
+            assert (
+                registry.get_sample_value(
+                    "poseidon_ncapture_count_total", {"shard": str(shard)}
+                )
+                == 1
+            )
+        names = [family.name for family in registry.collect()]
+        assert len(names) == len(set(names))
+    finally:
+        for server in servers:
+            server.shutdown()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Test module for endpoint timeout tracking.
+"""
+from poseidon_core.helpers.endpoint import endpoint_factory
+from poseidon_core.helpers.timers import DeadlineHeap
+from poseidon_core.helpers.timers import EndpointTimers
+
+
+def test_deadline_heap():
+    deadlines = DeadlineHeap()
+    deadlines.schedule("a", 10)
+    deadlines.schedule("b", 5)
+    # a later deadline is covered by the earlier one already scheduled.
+    deadlines.schedule("a", 20)
+    # an earlier one replaces it.
+    deadlines.schedule("b", 1)
+    assert len(deadlines) == 2
+    assert deadlines.pop_due(5) == ["b"]
+    assert deadlines.pop_due(10) == []
+    assert deadlines.pop_due(11) == ["a"]
+    assert not deadlines
+
+
+def test_endpoint_timers():
+    timers = EndpointTimers(100, 200)
+    endpoint = endpoint_factory("foo")
+    endpoint.observed_time = 1000
+    timers.track(endpoint)
+    assert timers.due_reinvestigation(1100) == []
+    assert timers.due_reinvestigation(1101) == ["foo"]
+    assert endpoint.timers is timers
+
+    # touch and state transitions reschedule.
+    endpoint.touch()
+    assert timers.due_reinvestigation(endpoint.observed_time + 99) == []
+    endpoint.copro_queue()  # pytype: disable=attribute-error
+    endpoint.copro_coprocess()  # pytype: disable=attribute-error
+    assert timers.due_coprocessing(endpoint.copro_state_time + 100) == []
+    assert timers.due_coprocessing(endpoint.copro_state_time + 202) == ["foo"]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Test module for trunk port lookups.
+"""
+import logging
+
+from faucetconfgetsetter import get_sdn_connect
+from poseidon_core.helpers.endpoint import Endpoint
+from poseidon_core.helpers.trunks import TrunkPorts
+
+logger = logging.getLogger("test")
+
+
+def test_trunk_ports():
+    trunk_ports = TrunkPorts('{"switch1": "00:00:00:00:00:01,3"}')
+    assert len(trunk_ports) == 1
+    assert trunk_ports.is_trunk("switch1", 3, "00:00:00:00:00:01")
+    assert not trunk_ports.is_trunk("switch1", 3, "00:00:00:00:00:02")
+    assert trunk_ports.is_trunk_port("switch1", "3")
+    assert not trunk_ports.is_trunk_port("switch2", 3)
+    tables = trunk_ports.tables
+    trunk_ports.reload({"switch2": "00:00:00:00:00:01,3"})
+    assert not trunk_ports.is_trunk_port("switch1", 3)
+    assert trunk_ports.is_trunk_port("switch2", 3)
+    # the old tables are replaced, not updated in place.
+    assert tables[1] == frozenset([("switch1", "3")])
+    assert trunk_ports.trunks == frozenset([("switch2", "3", "00:00:00:00:00:01")])
+
+
+def test_trunk_ports_malformed():
+    # entries not in "mac,port" form are skipped, not fatal.
+    trunk_ports = TrunkPorts(
+        {"switch1": 99, "switch2": "00:00:00:00:00:01,", "switch3": "a,b,c"}
+    )
+    assert len(trunk_ports) == 0
+    trunk_ports.reload({"switch1": 99, "switch2": "00:00:00:00:00:02, 4"})
+    assert trunk_ports.trunks == frozenset([("switch2", "4", "00:00:00:00:00:02")])
+
+
+def test_sdnc_trunk_ports():
+    s = get_sdn_connect(logger)
+    assert s.sdnc.trunk_ports is s.trunk_ports
+    s.reload_trunk_ports({"switch1": "00:00:00:00:00:01,1"})
+    assert s.sdnc.trunk_ports.is_trunk_port("switch1", 1)
+    machine = {
+        "tenant": "vlan1",
+        "mac": "00:00:00:00:00:01",
+        "segment": "switch1",
+        "port": 1,
+        "ipv4": "10.0.0.1",
+        "ipv6": 0,
+    }
+    s.find_new_machines([machine])
+    assert list(s.endpoints) == [Endpoint.make_hash(machine, trunk=True)]